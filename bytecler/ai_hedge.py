@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 对冲请求模块（霜刃短回复用）
+主模型超过其 p90 延迟仍未返回时，向备用模型发出同一请求，取先返回者并取消另一个
+依赖：openai（AsyncOpenAI）
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 可配置参数（支持环境变量）
+FROST_HEDGE_ENABLED = os.getenv("FROST_HEDGE_ENABLED", "0").lower() in ("1", "true", "yes")
+# 备用模型，默认与小助理 PRESET_MODELS["ollama-qwen"] 一致（本地 Ollama）
+FROST_HEDGE_BASE_URL = os.getenv("FROST_HEDGE_BASE_URL", "http://localhost:11434/v1")
+FROST_HEDGE_API_KEY = os.getenv("FROST_HEDGE_API_KEY", "ollama")
+FROST_HEDGE_MODEL = os.getenv("FROST_HEDGE_MODEL", "qwen2.5")
+FROST_HEDGE_PERCENTILE = float(os.getenv("FROST_HEDGE_PERCENTILE", "90"))
+FROST_HEDGE_WINDOW = int(os.getenv("FROST_HEDGE_WINDOW", "50"))  # 统计主模型最近 N 次延迟
+FROST_HEDGE_MIN_SAMPLES = int(os.getenv("FROST_HEDGE_MIN_SAMPLES", "10"))  # 样本不足时用默认延迟
+FROST_HEDGE_DEFAULT_DELAY = float(os.getenv("FROST_HEDGE_DEFAULT_DELAY", "3"))
+FROST_HEDGE_MIN_DELAY = float(os.getenv("FROST_HEDGE_MIN_DELAY", "0.5"))
+
+_primary_latencies: Deque[float] = deque(maxlen=max(1, FROST_HEDGE_WINDOW))
+_hedge_stats: Dict[str, int] = {
+    "requests": 0,        # 总请求数
+    "hedged": 0,          # 发出了对冲请求
+    "secondary_wins": 0,  # 对冲后备用模型先返回
+    "primary_wins": 0,    # 对冲后主模型仍先返回
+    "failed": 0,          # 两边都失败
+}
+
+
+def secondary_config() -> Dict[str, str]:
+    return {"base_url": FROST_HEDGE_BASE_URL, "api_key": FROST_HEDGE_API_KEY, "model": FROST_HEDGE_MODEL}
+
+
+def hedge_delay() -> float:
+    """主模型最近延迟的 p90（可配置分位）；样本不足时用默认值"""
+    samples = sorted(_primary_latencies)
+    if len(samples) < FROST_HEDGE_MIN_SAMPLES:
+        return FROST_HEDGE_DEFAULT_DELAY
+    idx = min(len(samples) - 1, int(len(samples) * FROST_HEDGE_PERCENTILE / 100))
+    return max(FROST_HEDGE_MIN_DELAY, samples[idx])
+
+
+async def _call(cfg: Dict[str, str], messages: List[Dict[str, str]], **kwargs: Any) -> str:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=cfg["api_key"], base_url=cfg["base_url"])
+    resp = await client.chat.completions.create(model=cfg["model"], messages=messages, **kwargs)
+    return (resp.choices[0].message.content or "").strip()
+
+
+async def _timed_primary(cfg: Dict[str, str], messages: List[Dict[str, str]], **kwargs: Any) -> str:
+    """成功、报错、被取消都计入延迟样本：只记成功会漏掉慢请求；被取消时的耗时是实际延迟的下限"""
+    start = time.monotonic()
+    try:
+        return await _call(cfg, messages, **kwargs)
+    finally:
+        _primary_latencies.append(time.monotonic() - start)
+
+
+async def hedged_completion(
+    primary: Dict[str, str],
+    messages: List[Dict[str, str]],
+    log_prefix: str = "PTB",
+    **kwargs: Any,
+) -> Tuple[str, str]:
+    """
+    primary: {"base_url", "api_key", "model"}；kwargs 透传给 chat.completions.create
+    返回 (回复, "primary"|"secondary")。未开启对冲时等价于直接调用主模型
+    主模型在对冲延迟内报错时立即改发备用模型
+    """
+    _hedge_stats["requests"] += 1
+    p_task = asyncio.create_task(_timed_primary(primary, messages, **kwargs))
+    if not FROST_HEDGE_ENABLED:
+        return await p_task, "primary"
+    delay = hedge_delay()
+    done, _ = await asyncio.wait({p_task}, timeout=delay)
+    if p_task in done and p_task.exception() is None:
+        return p_task.result(), "primary"
+
+    _hedge_stats["hedged"] += 1
+    if p_task in done:
+        print(f"[{log_prefix}] 霜刃: 主模型失败（{type(p_task.exception()).__name__}），改发备用模型 model={FROST_HEDGE_MODEL}")
+    else:
+        print(f"[{log_prefix}] 霜刃: 主模型 {delay:.1f}s 未返回，发出对冲请求 model={FROST_HEDGE_MODEL}")
+    s_task = asyncio.create_task(_call(secondary_config(), messages, **kwargs))
+    tasks = {s_task: "secondary"}
+    if p_task not in done:
+        tasks[p_task] = "primary"
+    pending = set(tasks)
+    last_exc: Optional[BaseException] = p_task.exception() if p_task in done else None
+    try:
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in finished:
+                exc = t.exception()
+                if exc is not None:
+                    last_exc = exc
+                    continue
+                winner = tasks[t]
+                _hedge_stats["secondary_wins" if winner == "secondary" else "primary_wins"] += 1
+                _log_stats(log_prefix)
+                return t.result(), winner
+    finally:
+        for t in pending:
+            t.cancel()
+    _hedge_stats["failed"] += 1
+    raise last_exc if last_exc else RuntimeError("hedged request failed")
+
+
+def _log_stats(log_prefix: str) -> None:
+    st = get_stats()
+    print(
+        f"[{log_prefix}] 霜刃对冲: 请求 {st['requests']} 对冲率 {st['hedge_rate']:.0%} "
+        f"备用胜率 {st['secondary_win_rate']:.0%} 当前延迟阈值 {st['delay']:.1f}s"
+    )
+
+
+def get_stats() -> Dict[str, Any]:
+    """对冲统计：hedge_rate = 对冲次数/请求数，secondary_win_rate = 备用先返回/对冲次数"""
+    st: Dict[str, Any] = dict(_hedge_stats)
+    st["hedge_rate"] = st["hedged"] / st["requests"] if st["requests"] else 0.0
+    st["secondary_win_rate"] = st["secondary_wins"] / st["hedged"] if st["hedged"] else 0.0
+    st["delay"] = hedge_delay()
+    return st
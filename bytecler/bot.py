@@ -13,6 +13,7 @@ import sqlite3
 import sys
 import time
 import traceback
+import zlib
 from datetime import datetime, time as dt_time, timedelta, timezone
 from pathlib import Path
 from typing import List, Optional, Tuple
@@ -44,11 +45,20 @@ try:
     _tgface_base = _bot_dir / "tgface"
     if _tgface_base.exists() and str(_tgface_base) not in sys.path:
         sys.path.insert(0, str(_tgface_base))
-    from opencv_gender import detect_gender as _detect_gender_sync
+    from opencv_gender import pick_photo_sizes as _pick_photo_sizes, NO_FACE as _NO_FACE
+    from gender_pool import get_pool as _get_gender_pool, InferenceQueueFull as _GenderQueueFull
     _FACE_GENDER_AVAILABLE = True
 except Exception as e:
     print(f"[PTB] tgface 未启用（头像性别检测不可用）: {e}")
 
+# 图片感知哈希黑名单（可选，需 opencv-python）
+_IMAGE_HASH_AVAILABLE = False
+try:
+    from image_hash import ImageHashIndex, hash_image_bytes, to_hex as _hash_hex
+    _IMAGE_HASH_AVAILABLE = True
+except Exception as e:
+    print(f"[PTB] 图片哈希黑名单未启用: {e}")
+
 from message_delete import (
     delete_message_with_retry as _delete_message_with_retry_raw,
     retry_pending_deletes_for_chat,
@@ -57,7 +67,24 @@ from message_delete import (
     get_stats as get_delete_stats,
     get_pending_queue_len,
     get_persist_queue_len,
+    schedule_delete,
+    cancel_scheduled_delete,
+    pop_due_deletes,
+    finish_scheduled_deletes,
+    load_scheduled_deletes,
+    flush_scheduled_log,
+    flush_scheduled_log_async,
+    get_scheduled_len,
 )
+from ai_hedge import hedged_completion
+from ttl_store import TTLMap, get_ttl_stats
+from text_lsh import MinHashLSH
+
+# xhbot 根目录下与小助理共用的模块（handoff、window_counter）
+_XHBOT_ROOT = Path(__file__).resolve().parent.parent
+if str(_XHBOT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_XHBOT_ROOT))
+from window_counter import WindowCounter
 
 
 def _select_delete_bot(chat_id: int, msg_id: int) -> str:
@@ -105,13 +132,40 @@ async def _delete_message_with_retry(bot, chat_id: int, msg_id: int, label: str,
     return ok
 
 
-async def _delete_after(bot, chat_id: int, msg_id: int, sec: int, user_msg_id: Optional[int] = None, user_cache_key: Optional[Tuple[str, int]] = None):
-    """本项目封装：sec 秒后删除；user_cache_key 时自动用 _last_message_by_user 清理；走负载均衡"""
-    await asyncio.sleep(sec)
-    cid_int = int(chat_id) if isinstance(chat_id, str) else chat_id
-    if user_msg_id is not None:
-        await _delete_message_with_retry(bot, cid_int, user_msg_id, "user_msg", retries=3, clear_cache_key=user_cache_key)
-    await _delete_message_with_retry(bot, cid_int, msg_id, "bot_msg", retries=3)
+def _schedule_delete(chat_id, msg_id: int, sec: int, user_msg_id: Optional[int] = None, user_cache_key: Optional[Tuple[str, int]] = None, label: str = "bot_msg", kind: str = "") -> int:
+    """本项目封装：sec 秒后删除（进持久化定时堆，重启不丢）；有 user_msg_id 时先删用户消息并按 user_cache_key 清理缓存"""
+    user_id = user_cache_key[1] if user_cache_key else 0
+    return schedule_delete(chat_id, msg_id, sec, label=label, kind=kind, user_msg_id=user_msg_id, user_id=user_id)
+
+
+async def _run_scheduled_delete(bot, item: dict) -> None:
+    """执行一条到期的定时删除；合并消息删除后清理对应合并状态"""
+    cid_int = int(item["chat_id"])
+    kind = item.get("kind") or ""
+    if item.get("user_msg_id") is not None:
+        user_id = item.get("user_id") or 0
+        await _delete_message_with_retry(bot, cid_int, item["user_msg_id"], "user_msg", retries=3, clear_cache_key=(item["chat_id"], user_id) if user_id else None)
+    hit_type = {"bgroup_merge": "bgroup", "verify_merge": "verify_other"}.get(kind)
+    await _delete_message_with_retry(bot, cid_int, item["msg_id"], item.get("label") or "bot_msg", retries=3, hit_type=hit_type)
+    # 失败已转入待重试队列，合并状态不再保留
+    state_map = _bgroup_merge_state if kind == "bgroup_merge" else (_verify_merge_state if kind == "verify_merge" else None)
+    if state_map is not None:
+        state = state_map.get(item["chat_id"])
+        if state and state.get("msg_id") == item["msg_id"]:
+            state_map.pop(item["chat_id"], None)
+
+
+async def _job_run_scheduled_deletes(context: ContextTypes.DEFAULT_TYPE):
+    """每秒取出定时堆中到期的删除，同一批并发执行；顺带在线程中落盘上一秒缓冲的定时删除日志"""
+    await flush_scheduled_log_async()
+    due = pop_due_deletes()
+    if not due:
+        return
+    results = await asyncio.gather(*(_run_scheduled_delete(context.bot, item) for _, item in due), return_exceptions=True)
+    for (eid, item), r in zip(due, results):
+        if isinstance(r, Exception):
+            print(f"[PTB] 定时删除异常 chat_id={item.get('chat_id')} msg_id={item.get('msg_id')}: {type(r).__name__}: {r}")
+    finish_scheduled_deletes([eid for eid, _ in due])
 
 
 # ==================== 共享逻辑 (原 shared.py) ====================
@@ -128,6 +182,8 @@ VERIFICATION_RECORDS_PATH = _path("verification_records.json")
 SYNC_LOTTERY_CHECKPOINT_PATH = _path("sync_lottery_checkpoint.json")
 SETTIME_CONFIG_PATH = _path("settime_config.json")
 BGROUP_CONFIG_PATH = _path("bgroup_config.json")  # 每群单独配置 B 群（仅一个）：{ "chat_id": "b_id" }，无全局
+AVATAR_GENDER_CACHE_PATH = _path("avatar_gender_cache.json")  # 头像性别判定缓存：{ "entries": { file_unique_id: gender } }
+IMAGE_HASH_BLACKLIST_PATH = _path("image_hash_blacklist.json")  # 图片黑名单：{ "entries": [{ "phash", "dhash", "added_by", "time", "source" }] }
 COMBINED_PAIRS_PATH = _path("combined_pairs.json")  # 组合关键词：昵称+消息同时匹配时直接删除，[{"name":"小月","text":"开课了"}]
 LOTTERY_DB_PATH = os.getenv("LOTTERY_DB_PATH", "/tgbot/cjbot/cjdb/lottery.db")
 
@@ -147,23 +203,42 @@ _combined_pairs: list[dict[str, str]] = []  # [{"name":"小月","text":"开课
 verified_users = set()
 verified_users_details = {}
 join_times = {}
-verification_failures = {}
 verification_blacklist = set()
 _verification_records = {}
 # 缓存用户最近一条消息，供管理员删除+限制/封禁时自动加入关键词，保存一天后自动删除
 LAST_MESSAGE_CACHE_TTL_SECONDS = 86400  # 24 小时
-_last_message_by_user: dict[tuple[str, int], tuple[str, float]] = {}
+LAST_MESSAGE_CACHE_MAX = int(os.getenv("LAST_MESSAGE_CACHE_MAX", "50000"))  # 超出按 LRU 淘汰
+_last_message_by_user: TTLMap = TTLMap(LAST_MESSAGE_CACHE_TTL_SECONDS, LAST_MESSAGE_CACHE_MAX, name="last_message")  # (chat_id, uid) -> (text, ts)
 
 VERIFY_FAIL_THRESHOLD = 5
 VERIFY_FAILURES_RETENTION_SECONDS = 86400
 # 冷却间隔 + 时间窗口：15 秒内重复触发不计入，20 分钟内 5 次即限制
 TRIGGER_COOLDOWN_SECONDS = int(os.getenv("TRIGGER_COOLDOWN_SECONDS", "15"))
 TRIGGER_WINDOW_SECONDS = int(os.getenv("TRIGGER_WINDOW_SECONDS", "1200"))  # 20 分钟
+# 验证码错误/超时计数，(chat_id, uid) -> 窗口内最近 VERIFY_FAIL_THRESHOLD 次时间戳
+verification_failures = WindowCounter(TRIGGER_WINDOW_SECONDS, VERIFY_FAIL_THRESHOLD, cooldown=TRIGGER_COOLDOWN_SECONDS)
 # 含 emoji 的消息/昵称触发验证，0/false 关闭
 ENABLE_EMOJI_CHECK = os.getenv("ENABLE_EMOJI_CHECK", "1").lower() not in ("0", "false", "no")
 ENABLE_STICKER_CHECK = os.getenv("ENABLE_STICKER_CHECK", "1").lower() not in ("0", "false", "no")
+# 图片/贴纸缩略图与图片黑名单近似即删除+加黑；IMAGE_HASH_CHECK_AVATAR=1 时头像也比对（多一次 get_user_profile_photos）
+ENABLE_IMAGE_HASH_CHECK = os.getenv("ENABLE_IMAGE_HASH_CHECK", "1").lower() not in ("0", "false", "no")
+IMAGE_HASH_CHECK_AVATAR = os.getenv("IMAGE_HASH_CHECK_AVATAR", "0").lower() in ("1", "true", "yes")
+IMAGE_HASH_RADIUS = int(os.getenv("IMAGE_HASH_RADIUS", "4"))  # pHash 汉明距离 <= 此值视为同一张图
+IMAGE_HASH_DHASH_MAX = int(os.getenv("IMAGE_HASH_DHASH_MAX", "10"))  # 候选复核的 dHash 距离上限
+IMAGE_HASH_CACHE_MAX = int(os.getenv("IMAGE_HASH_CACHE_MAX", "20000"))  # file_unique_id -> 哈希 缓存条数
+# 近似广告文案（MinHash LSH）：与近期被删广告文案相似度 >= 阈值时触发验证（verify）或直接删除+加黑（delete）
+ENABLE_TEXT_LSH = os.getenv("ENABLE_TEXT_LSH", "1").lower() not in ("0", "false", "no")
+TEXT_LSH_ACTION = os.getenv("TEXT_LSH_ACTION", "verify").lower()
+TEXT_LSH_THRESHOLD = float(os.getenv("TEXT_LSH_THRESHOLD", "0.6"))
+TEXT_LSH_MIN_CHARS = int(os.getenv("TEXT_LSH_MIN_CHARS", "8"))  # 归一化后不足此长度不参与
+TEXT_LSH_MAX = int(os.getenv("TEXT_LSH_MAX", "10000"))  # 索引条目上限
+TEXT_LSH_TTL_DAYS = float(os.getenv("TEXT_LSH_TTL_DAYS", "7"))
 # 霜刃 AI 回复 N 秒后自动删除，0 表示不删除
 FROST_REPLY_DELETE_AFTER = int(os.getenv("FROST_REPLY_DELETE_AFTER", "0") or "0")
+# 霜刃回复缓存：相同提问直接返回上次回复，默认关闭；含时效词（今天/天气/新闻等）的提问不缓存
+FROST_REPLY_CACHE_ENABLED = os.getenv("FROST_REPLY_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+FROST_REPLY_CACHE_TTL = int(os.getenv("FROST_REPLY_CACHE_TTL", "600") or "600")
+FROST_REPLY_CACHE_MAX = int(os.getenv("FROST_REPLY_CACHE_MAX", "300") or "300")
 # 方案 C：删除负载均衡（霜刃/小助理 50% 分配），0 关闭
 DELETE_LOAD_BALANCE = os.getenv("DELETE_LOAD_BALANCE", "1").lower() not in ("0", "false", "no")
 # 消息删除模块（message_delete.py），删除失败待重试队列等参数在模块内配置
@@ -176,17 +251,6 @@ def _mask_display_name(name: str) -> str:
     return name if len(name) <= 7 else name[:2] + "***" + name[-2:]
 
 
-def _apply_trigger_cooldown_window(timestamps: list, now: float) -> tuple[bool, list, int]:
-    """冷却间隔+时间窗口。返回 (本次是否计入, 更新后的时间戳列表, 当前窗口内次数)"""
-    cutoff = now - TRIGGER_WINDOW_SECONDS
-    ts_list = [t for t in (timestamps or []) if t > cutoff]
-    last_ts = ts_list[-1] if ts_list else 0
-    if last_ts and (now - last_ts) < TRIGGER_COOLDOWN_SECONDS:
-        return False, ts_list, len(ts_list)  # 冷却中，不计入
-    ts_list.append(now)
-    return True, ts_list, len(ts_list)
-
-
 def _parse_field_keywords(cfg: dict) -> tuple:
     exact = [s.strip() for s in (cfg.get("exact") or []) if s and s.strip()]
     match_raw = [s.strip() for s in (cfg.get("match") or []) if s and s.strip()]
@@ -271,12 +335,14 @@ def load_spam_keywords():
     except Exception as e:
         print(f"[shared] 加载关键词失败: {e}")
         traceback.print_exc()
+    _bump_keywords_version()
 
 
 def _load_combined_pairs():
     global _combined_pairs
     if not COMBINED_PAIRS_PATH.exists():
         _combined_pairs = []
+        _bump_keywords_version()
         return
     try:
         with open(COMBINED_PAIRS_PATH, "r", encoding="utf-8") as f:
@@ -301,6 +367,7 @@ def _load_combined_pairs():
         print(f"[PTB] 加载组合关键词失败: {e}")
         traceback.print_exc()
         _combined_pairs = []
+    _bump_keywords_version()
 
 
 def _save_combined_pairs():
@@ -312,20 +379,32 @@ def _save_combined_pairs():
         traceback.print_exc()
 
 
-def check_combined_pairs(first_name: str, last_name: str, msg_text: str) -> Optional[tuple[str, str]]:
-    """检查昵称+消息是否同时匹配某组合对。exact=True 时精确匹配，否则子串匹配。返回 (name_kw, text_kw) 或 None"""
-    full_name = f"{first_name or ''} {last_name or ''}".strip()
+def _combined_pairs_name_hits(full_name: str) -> tuple:
+    """昵称侧命中的组合对下标（下标在关键词版本内稳定，增删组合对会使版本 +1）"""
     name_lower = full_name.lower()
-    text_lower = (msg_text or "").lower()
-    for p in _combined_pairs:
+    hits = []
+    for i, p in enumerate(_combined_pairs):
         nk, tk = (p.get("name") or "").strip(), (p.get("text") or "").strip()
         if not nk or not tk:
             continue
-        use_exact = bool(p.get("exact", False))
-        if use_exact:
-            matched = full_name.lower() == nk.lower() and (msg_text or "").strip().lower() == tk.lower()
+        if (name_lower == nk.lower()) if p.get("exact", False) else (nk.lower() in name_lower):
+            hits.append(i)
+    return tuple(hits)
+
+
+def check_combined_pairs(first_name: str, last_name: str, msg_text: str, name_hits: Optional[tuple] = None) -> Optional[tuple[str, str]]:
+    """检查昵称+消息是否同时匹配某组合对。exact=True 时精确匹配，否则子串匹配。返回 (name_kw, text_kw) 或 None
+    name_hits: 已算好的昵称侧命中下标（见 _name_verdict），传入时只需比对消息侧"""
+    if name_hits is None:
+        name_hits = _combined_pairs_name_hits(f"{first_name or ''} {last_name or ''}".strip())
+    text_lower = (msg_text or "").lower()
+    for i in name_hits:
+        p = _combined_pairs[i]
+        nk, tk = (p.get("name") or "").strip(), (p.get("text") or "").strip()
+        if p.get("exact", False):
+            matched = (msg_text or "").strip().lower() == tk.lower()
         else:
-            matched = nk.lower() in name_lower and tk.lower() in text_lower
+            matched = tk.lower() in text_lower
         if matched:
             return (nk, tk)
     return None
@@ -340,6 +419,7 @@ def add_combined_pair(name_kw: str, text_kw: str, exact: bool = False, count: in
         if (p.get("name") or "").strip() == nk and (p.get("text") or "").strip() == tk:
             return True
     _combined_pairs.append({"name": nk, "text": tk, "exact": bool(exact), "count": max(0, count)})
+    _bump_keywords_version()
     return True
 
 
@@ -379,6 +459,7 @@ def remove_combined_pair(name_kw: str, text_kw: str) -> bool:
     if len(new_cp) == len(_combined_pairs):
         return False
     _combined_pairs = new_cp
+    _bump_keywords_version()
     return True
 
 
@@ -629,6 +710,7 @@ def add_spam_keyword(field: str, keyword: str, is_regex: bool = False, as_exact:
     if field in ("text", "name"):
         remove_blacklist_keyword(field, keyword, is_regex=is_regex, as_exact=use_exact)
         _remove_whitelist_keyword(field, keyword, is_regex=is_regex, as_exact=use_exact)
+    _bump_keywords_version()
     return True
 
 
@@ -664,6 +746,7 @@ def remove_spam_keyword(field: str, keyword: str, is_regex: bool = False, as_exa
         kw["match"] = mt
         kw["_regex"] = [x[1] for x in mt if x[0] == "regex"]
     kw["_ac"] = _build_ac([x for x in (kw.get("match") or []) if x[0] == "str"])
+    _bump_keywords_version()
     return True
 
 
@@ -715,6 +798,37 @@ def check_facename(first_name: str, last_name: str) -> Optional[str]:
     return _check_field(spam_keywords.get("facename") or {}, name)
 
 
+# 昵称判定缓存：同一用户昵称很少变化，昵称侧结果按 (uid, first, last, 关键词版本) 缓存，老用户再次发言只查一次 dict
+# 关键词（待验证/黑名单/facename/组合关键词）增删或重载时版本 +1 并清空缓存
+_keywords_version = 0
+NAME_VERDICT_CACHE_MAX = int(os.getenv("NAME_VERDICT_CACHE_MAX", "50000"))
+_name_verdict_cache: TTLMap = TTLMap(86400, NAME_VERDICT_CACHE_MAX, name="name_verdict")
+
+
+def _bump_keywords_version():
+    global _keywords_version
+    _keywords_version += 1
+    _name_verdict_cache.clear()
+
+
+def _name_verdict(user_id: int, first_name: str, last_name: str) -> dict:
+    """昵称侧判定：spam/blacklist/facename 命中词、昵称是否含 emoji、昵称侧命中的组合关键词下标"""
+    key = (user_id, first_name or "", last_name or "", _keywords_version)
+    v = _name_verdict_cache.get(key)
+    if v is not None:
+        return v
+    full_name = f"{first_name or ''} {last_name or ''}".strip()
+    v = {
+        "spam": check_spam_name(first_name, last_name),
+        "blacklist": check_blacklist_name(first_name, last_name),
+        "face": check_facename(first_name, last_name),
+        "emoji": _contains_emoji(full_name),
+        "cp": _combined_pairs_name_hits(full_name),
+    }
+    _name_verdict_cache[key] = v
+    return v
+
+
 def _has_face_keywords(field: str) -> bool:
     """检查 facetext/facename 是否有配置关键词"""
     kw = spam_keywords.get(field) or {}
@@ -752,6 +866,7 @@ def add_face_keyword(field: str, keyword: str, is_regex: bool = False, as_exact:
                 return True
         kw["match"] = (kw.get("match") or []) + [("str", keyword.strip().lower())]
     kw["_ac"] = _build_ac([x for x in (kw.get("match") or []) if x[0] == "str"])
+    _bump_keywords_version()
     return True
 
 
@@ -790,6 +905,7 @@ def remove_face_keyword(field: str, keyword: str, is_regex: bool = False, as_exa
         kw["match"] = mt
         kw["_regex"] = [x[1] for x in mt if x[0] == "regex"]
     kw["_ac"] = _build_ac([x for x in (kw.get("match") or []) if x[0] == "str"])
+    _bump_keywords_version()
     return True
 
 
@@ -827,6 +943,7 @@ def add_blacklist_keyword(field: str, keyword: str, is_regex: bool = False, as_e
     # 添加入黑名单时，自动从待验证关键词和白名单移出
     remove_spam_keyword(field, keyword, is_regex=is_regex, as_exact=use_exact)
     _remove_whitelist_keyword(field, keyword, is_regex=is_regex, as_exact=use_exact)
+    _bump_keywords_version()
     return True
 
 
@@ -865,6 +982,7 @@ def remove_blacklist_keyword(field: str, keyword: str, is_regex: bool = False, a
         kw["_regex"] = [x[1] for x in mt if x[0] == "regex"]
     kw["_ac"] = _build_ac([x for x in (kw.get("match") or []) if x[0] == "str"])
     spam_keywords.setdefault("blacklist", {})[field] = kw
+    _bump_keywords_version()
     return True
 
 
@@ -910,7 +1028,6 @@ def _verification_failures_ent_to_timestamps(ent) -> list:
 
 
 def load_verification_failures():
-    global verification_failures
     if not VERIFICATION_FAILURES_PATH.exists():
         return
     try:
@@ -923,10 +1040,7 @@ def load_verification_failures():
             if len(parts) != 2 or not parts[1].isdigit():
                 continue
             key = (parts[0], int(parts[1]))
-            ts_list = _verification_failures_ent_to_timestamps(v)
-            ts_list = [t for t in ts_list if now - t <= VERIFY_FAILURES_RETENTION_SECONDS]
-            if ts_list:
-                verification_failures[key] = {"timestamps": ts_list}
+            verification_failures.load(key, _verification_failures_ent_to_timestamps(v), now)
     except Exception as e:
         print(f"[shared] 加载失败计数失败: {e}")
         traceback.print_exc()
@@ -981,26 +1095,13 @@ def save_verified_users():
 
 def increment_verification_failures(chat_id: str, user_id: int) -> int:
     """验证码错误计数，冷却+窗口内 5 次即限制。返回当前窗口内次数。"""
-    key = (chat_id, user_id)
-    now = time.time()
-    ent = verification_failures.get(key)
-    ts_list = _verification_failures_ent_to_timestamps(ent) if ent else []
-    ts_list = [t for t in ts_list if now - t <= VERIFY_FAILURES_RETENTION_SECONDS]
-    should_count, new_ts, cnt = _apply_trigger_cooldown_window(ts_list, now)
-    if should_count:
-        verification_failures[key] = {"timestamps": new_ts}
+    _, cnt = verification_failures.hit((chat_id, user_id))
     return cnt
 
 
 def save_verification_failures():
     try:
-        now = time.time()
-        to_save = {}
-        for (c, u), v in verification_failures.items():
-            ts_list = _verification_failures_ent_to_timestamps(v)
-            ts_list = [t for t in ts_list if now - t <= VERIFY_FAILURES_RETENTION_SECONDS]
-            if ts_list:
-                to_save[f"{c}:{u}"] = {"timestamps": ts_list}
+        to_save = {f"{c}:{u}": {"timestamps": ts} for (c, u), ts in verification_failures.snapshot().items()}
         with open(VERIFICATION_FAILURES_PATH, "w", encoding="utf-8") as f:
             json.dump({"failures": to_save}, f, ensure_ascii=False)
     except Exception as e:
@@ -1269,6 +1370,7 @@ _MENU_ADMIN = [
     BotCommand("add_name", "添加昵称关键词"),
     BotCommand("addcp", "添加组合关键词"),
     BotCommand("add_group", "添加霜刃可用群"),
+    BotCommand("add_image", "添加图片黑名单"),
     BotCommand("cancel", "取消操作"),
     BotCommand("facename", "女性头像+昵称关键词"),
     BotCommand("facetext", "女性头像+消息关键词"),
@@ -1645,20 +1747,24 @@ KIMI_MODEL = os.getenv("MODEL_NAME", "moonshot-v1-128k")
 XHCHAT_BOT_USERNAME = (os.getenv("XHCHAT_BOT_USERNAME") or os.getenv("BOT_USERNAME") or "").strip().lstrip("@")
 BOT_NICKNAME = (os.getenv("BOT_NICKNAME") or "").strip()  # 机器人显示昵称，用于消息内容；未配置则用 get_me().first_name
 
-pending_verification = {}
-pending_private_verify: dict[int, dict] = {}  # user_id -> {chat_id, start_time}，自助验证私聊会话状态
-# 未加入 B 群的触发时间戳，(chat_id, uid) -> [t1,t2,...]，冷却+窗口内 5 次即限制
-_required_group_warn_count: dict[tuple[str, int], list] = {}
+# 两段式/验证类状态的保留上限：超时判断仍由各处按时间戳处理（以便回复「已超时」），TTLMap 只负责兜底回收内存
+PENDING_STATE_MAX = 10000
+# 验证超时后再发言才计失败，故保留 1 天而非 VERIFY_TIMEOUT；验证状态不按 LRU 淘汰（被挤掉等于放行），只靠 TTL 回收
+pending_verification: TTLMap = TTLMap(VERIFY_FAILURES_RETENTION_SECONDS, 0, name="pending_verification")
+pending_private_verify: TTLMap = TTLMap(86400, 0, name="pending_private_verify")  # user_id -> {chat_id, start_time}，自助验证私聊会话状态
+# 未加入 B 群的触发计数，(chat_id, uid)，冷却+窗口内 5 次即限制
+_required_group_warn_count = WindowCounter(TRIGGER_WINDOW_SECONDS, VERIFY_FAIL_THRESHOLD, cooldown=TRIGGER_COOLDOWN_SECONDS, max_keys=PENDING_STATE_MAX)
 _LINK_RE = re.compile(r"t\.me/c/(\d+)/(\d+)", re.I)
 _LINK_PUBLIC_RE = re.compile(r"t\.me/([a-zA-Z0-9_]+)/(\d+)", re.I)
 _bot_me_cache = None  # get_me() 结果，ExtBot 不允许动态属性
-# B 群信息缓存：b_group_id -> (title, link, ts)，TTL 1 天
-_required_group_info_cache: dict[str, tuple[str, str, float]] = {}
+# B 群信息缓存：b_group_id -> (title, link)，TTL 1 天
 _REQUIRED_GROUP_INFO_CACHE_TTL = 86400
-# 用户是否在 B 群缓存，(user_id, b_group_id) -> (is_in, ts)
-_user_in_required_group_cache: dict[tuple[int, str], tuple[bool, float]] = {}
+_required_group_info_cache: TTLMap = TTLMap(_REQUIRED_GROUP_INFO_CACHE_TTL, 1000, name="required_group_info")
+# 用户是否在 B 群缓存，(user_id, b_group_id) -> is_in
 _USER_IN_GROUP_CACHE_TTL = 86400  # 「在」时缓存 1 天
 _USER_IN_GROUP_CACHE_TTL_NOT_IN = 2  # 「不在」时仅缓存 2 秒
+_USER_IN_GROUP_CACHE_MAX = int(os.getenv("USER_IN_GROUP_CACHE_MAX", "100000"))
+_user_in_required_group_cache: TTLMap = TTLMap(_USER_IN_GROUP_CACHE_TTL, _USER_IN_GROUP_CACHE_MAX, name="user_in_required_group")
 
 
 async def _is_user_in_required_group(bot, user_id: int, chat_id: str, skip_cache: bool = False) -> bool:
@@ -1668,11 +1774,9 @@ async def _is_user_in_required_group(bot, user_id: int, chat_id: str, skip_cache
         return True
     for b_id in b_ids:
         key = (user_id, b_id)
-        now = time.time()
-        if not skip_cache and key in _user_in_required_group_cache:
-            cached_val, ts = _user_in_required_group_cache[key]
-            ttl = _USER_IN_GROUP_CACHE_TTL if cached_val else _USER_IN_GROUP_CACHE_TTL_NOT_IN
-            if now - ts <= ttl:
+        if not skip_cache:
+            cached_val = _user_in_required_group_cache.get(key)
+            if cached_val is not None:
                 if cached_val:
                     return True
                 continue
@@ -1683,7 +1787,7 @@ async def _is_user_in_required_group(bot, user_id: int, chat_id: str, skip_cache
             status_str = getattr(status, "value", status) if status else ""
             status_str = str(status_str).lower() if status_str else ""
             is_in = status_str not in ("left", "kicked")
-            _user_in_required_group_cache[key] = (is_in, now)
+            _user_in_required_group_cache.set(key, is_in, ttl=_USER_IN_GROUP_CACHE_TTL if is_in else _USER_IN_GROUP_CACHE_TTL_NOT_IN)
             print(f"[PTB] B群检查: chat_id={chat_id} uid={user_id} b_id={b_id} status={status_str!r} is_in={is_in} skip_cache={skip_cache}")
             if is_in:
                 return True
@@ -1700,21 +1804,17 @@ async def _get_required_group_buttons(bot, chat_id: str) -> list[tuple[str, str]
     if not b_ids:
         return []
     result = []
-    now = time.time()
     for b_id in b_ids:
         cached = _required_group_info_cache.get(b_id)
-        if cached and len(cached) >= 3 and (now - cached[2]) <= _REQUIRED_GROUP_INFO_CACHE_TTL:
-            result.append((cached[0], cached[1]))
-            continue
-        # 读时若过期则删除该 key 再重新拉取，避免 dict 残留过期数据
         if cached:
-            _required_group_info_cache.pop(b_id, None)
+            result.append(cached)
+            continue
         try:
             chat = await bot.get_chat(chat_id=int(b_id))
             title = (getattr(chat, "title", None) or "").strip() or f"群组 {b_id}"
             username = (getattr(chat, "username", None) or "").strip()
             link = f"https://t.me/{username}" if username else ""
-            _required_group_info_cache[b_id] = (title, link, now)
+            _required_group_info_cache[b_id] = (title, link)
             result.append((title, link))
         except Exception as e:
             print(f"[PTB] 获取 B 群 {b_id} 信息失败: {e}")
@@ -1752,37 +1852,195 @@ async def _is_mention_bot(msg, text: str, bot) -> bool:
     return False
 
 
+# 头像性别判定缓存：同一张头像（最大尺寸的 file_unique_id）只下载、推理一次，持久化到 AVATAR_GENDER_CACHE_PATH
+AVATAR_GENDER_CACHE_MAX = int(os.getenv("AVATAR_GENDER_CACHE_MAX", "20000"))
+AVATAR_GENDER_CACHE_TTL = 30 * 86400
+# 用户 -> 当前头像 file_unique_id（"" 表示无头像），短时间内连 get_user_profile_photos 也省去
+AVATAR_USER_PHOTO_TTL = int(os.getenv("AVATAR_USER_PHOTO_TTL", "600"))
+_avatar_gender_cache: TTLMap = TTLMap(AVATAR_GENDER_CACHE_TTL, AVATAR_GENDER_CACHE_MAX, name="avatar_gender")
+_avatar_user_photo: TTLMap = TTLMap(AVATAR_USER_PHOTO_TTL, AVATAR_GENDER_CACHE_MAX, name="avatar_user_photo")
+_avatar_gender_cache_dirty = False
+_AVATAR_GENDER_CACHEABLE = ("female", "male", "other")  # failure 不缓存，下次重试
+
+
+def _load_avatar_gender_cache():
+    if not AVATAR_GENDER_CACHE_PATH.exists():
+        return
+    try:
+        with open(AVATAR_GENDER_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for fuid, gender in (data.get("entries") or {}).items():
+            if gender in _AVATAR_GENDER_CACHEABLE:
+                _avatar_gender_cache[fuid] = gender
+    except Exception as e:
+        print(f"[PTB] 加载头像性别缓存失败: {e}")
+
+
+def _save_avatar_gender_cache():
+    global _avatar_gender_cache_dirty
+    if not _avatar_gender_cache_dirty:
+        return
+    _avatar_gender_cache_dirty = False
+    try:
+        with open(AVATAR_GENDER_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"entries": dict(_avatar_gender_cache.items())}, f, ensure_ascii=False)
+    except Exception as e:
+        _avatar_gender_cache_dirty = True
+        print(f"[PTB] 保存头像性别缓存失败: {e}")
+
+
+async def _job_save_avatar_gender_cache(context: ContextTypes.DEFAULT_TYPE):
+    """有新判定时每 5 分钟落盘一次"""
+    if _avatar_gender_cache_dirty:
+        _schedule_sync_background(_save_avatar_gender_cache)
+
+
 async def _detect_avatar_gender(bot, user_id: int) -> Optional[str]:
     """
     获取用户头像并检测性别（不保留图片，仅识别）。
     返回: "female" | "male" | "other" | "failure" | None（无头像）
+    先查用户→头像映射与头像判定缓存，命中则不发网络请求也不推理
     """
+    global _avatar_gender_cache_dirty
     if not _FACE_GENDER_AVAILABLE:
         return None
+    fuid = _avatar_user_photo.get(user_id)
+    if fuid == "":
+        return None
+    if fuid and (cached := _avatar_gender_cache.get(fuid)):
+        return cached
     try:
         photos = await bot.get_user_profile_photos(user_id, limit=1)
         if not photos or not photos.photos:
+            _avatar_user_photo[user_id] = ""
             return None
         photo_sizes = photos.photos[0]
         largest = max(photo_sizes, key=lambda p: p.width * p.height)
-        file = await bot.get_file(largest.file_id)
-        temp_path = _BASE / "debug" / f"_face_{user_id}_{int(time.time()*1000)}.jpg"
-        temp_path.parent.mkdir(parents=True, exist_ok=True)
-        try:
-            await file.download_to_drive(custom_path=str(temp_path))
-            # 同步 CPU 密集操作放到线程，避免阻塞
-            result = await asyncio.to_thread(_detect_gender_sync, temp_path)
-            return result
-        finally:
-            try:
-                temp_path.unlink(missing_ok=True)
-            except OSError:
-                pass
+        fuid = largest.file_unique_id
+        _avatar_user_photo[user_id] = fuid
+        cached = _avatar_gender_cache.get(fuid)
+        if cached:
+            return cached
+        # 先下满足最小分辨率的小尺寸，未检出人脸再换大一档、最后跳到最大尺寸；最后一档走完整流程（含人体检测）
+        candidates = _pick_photo_sizes(photo_sizes)
+        result = "failure"
+        for i, size in enumerate(candidates):
+            file = await bot.get_file(size.file_id)
+            # 下载到内存直接解码，不写临时文件
+            data = await file.download_as_bytearray()
+            # 交给专用推理池（模型已预热，队列有界，超时即放弃）
+            result = await _get_gender_pool().detect(data, face_only=i < len(candidates) - 1)
+            if result != _NO_FACE:
+                break
+        if result in _AVATAR_GENDER_CACHEABLE:
+            _avatar_gender_cache[fuid] = result
+            _avatar_gender_cache_dirty = True
+        return result
+    except (_GenderQueueFull, asyncio.TimeoutError) as e:
+        print(f"[PTB] 头像性别检测跳过 uid={user_id}: {type(e).__name__} {_get_gender_pool().stats()}")
+        return "failure"
     except Exception as e:
         print(f"[PTB] 头像性别检测失败 uid={user_id}: {e}")
         return "failure"
 
 
+# 图片黑名单：pHash 多段索引，管理员 /add_image 拉黑；比对用最小尺寸缩略图，同一文件（file_unique_id）只下载、哈希一次
+_image_hash_index = ImageHashIndex(IMAGE_HASH_RADIUS, IMAGE_HASH_DHASH_MAX) if _IMAGE_HASH_AVAILABLE else None
+_image_hash_cache: TTLMap = TTLMap(7 * 86400, IMAGE_HASH_CACHE_MAX, name="image_hash")  # file_unique_id -> (phash, dhash) | None
+_avatar_thumb_by_user: TTLMap = TTLMap(AVATAR_USER_PHOTO_TTL, IMAGE_HASH_CACHE_MAX, name="avatar_thumb")  # uid -> (file_id, file_unique_id) | None
+_MISSING = object()
+
+
+def _load_image_hash_blacklist():
+    if _image_hash_index is None:
+        return
+    if not IMAGE_HASH_BLACKLIST_PATH.exists():
+        _image_hash_index.clear()
+        return
+    try:
+        with open(IMAGE_HASH_BLACKLIST_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        n = _image_hash_index.load(data.get("entries") or [])
+        print(f"[PTB] 已加载图片黑名单 {n} 条")
+    except Exception as e:
+        print(f"[PTB] 加载图片黑名单失败: {e}")
+
+
+def _save_image_hash_blacklist():
+    if _image_hash_index is None:
+        return
+    try:
+        with open(IMAGE_HASH_BLACKLIST_PATH, "w", encoding="utf-8") as f:
+            json.dump({"entries": _image_hash_index.dump()}, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"[PTB] 保存图片黑名单失败: {e}")
+        traceback.print_exc()
+
+
+def _message_image_file(msg) -> Optional[Tuple[str, str, str]]:
+    """消息中可比对的图片：(file_id, file_unique_id, 来源)；图片取最小尺寸，贴纸取缩略图（静态贴纸无缩略图时取原图）"""
+    photo = getattr(msg, "photo", None)
+    if photo:
+        p = min(photo, key=lambda s: s.width * s.height)
+        return p.file_id, p.file_unique_id, "photo"
+    sticker = getattr(msg, "sticker", None)
+    if sticker:
+        thumb = getattr(sticker, "thumbnail", None) or getattr(sticker, "thumb", None)
+        if thumb:
+            return thumb.file_id, thumb.file_unique_id, "sticker"
+        if not getattr(sticker, "is_animated", False) and not getattr(sticker, "is_video", False):
+            return sticker.file_id, sticker.file_unique_id, "sticker"
+    return None
+
+
+async def _avatar_thumb_file(bot, user_id: int) -> Optional[Tuple[str, str, str]]:
+    """用户当前头像的最小尺寸：(file_id, file_unique_id, "avatar")，无头像返回 None"""
+    cached = _avatar_thumb_by_user.get(user_id, _MISSING)
+    if cached is _MISSING:
+        photos = await bot.get_user_profile_photos(user_id, limit=1)
+        if photos and photos.photos:
+            p = min(photos.photos[0], key=lambda s: s.width * s.height)
+            cached = (p.file_id, p.file_unique_id)
+        else:
+            cached = None
+        _avatar_thumb_by_user[user_id] = cached
+    return (cached[0], cached[1], "avatar") if cached else None
+
+
+async def _image_hash_of(bot, file_id: str, file_unique_id: str) -> Optional[Tuple[int, int]]:
+    """下载并计算 (phash, dhash)，按 file_unique_id 缓存（无法解码也缓存 None）"""
+    cached = _image_hash_cache.get(file_unique_id, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    file = await bot.get_file(file_id)
+    data = await file.download_as_bytearray()
+    h = hash_image_bytes(data)  # 缩略图很小，解码+哈希在百微秒量级，直接在事件循环内完成
+    _image_hash_cache[file_unique_id] = h
+    return h
+
+
+async def _match_image_blacklist(bot, msg, user_id: int) -> Optional[Tuple[str, str, int]]:
+    """消息图片/贴纸（及可选的头像）命中图片黑名单时返回 (来源, 命中 phash, 汉明距离)"""
+    if _image_hash_index is None or not ENABLE_IMAGE_HASH_CHECK or not len(_image_hash_index):
+        return None
+    try:
+        targets = [t for t in (_message_image_file(msg),) if t]
+        if IMAGE_HASH_CHECK_AVATAR:
+            avatar = await _avatar_thumb_file(bot, user_id)
+            if avatar:
+                targets.append(avatar)
+        for file_id, fuid, source in targets:
+            h = await _image_hash_of(bot, file_id, fuid)
+            if not h:
+                continue
+            hit = _image_hash_index.match(*h)
+            if hit:
+                return source, _hash_hex(hit[0]), hit[1]
+    except Exception as e:
+        print(f"[PTB] 图片黑名单比对失败 uid={user_id}: {e}")
+    return None
+
+
 async def _is_frost_trigger(msg, text: str, bot) -> bool:
     """判断是否触发霜刃 AI：以「霜刃，」开头、@提及霜刃、或回复霜刃的消息"""
     if (text or "").strip().startswith("霜刃，"):
@@ -1910,6 +2168,62 @@ def _log_deleted_content(user_id: int, full_name: str, deleted_content: str, cha
     except Exception as e:
         print(f"[PTB] 记录被删文案失败: {e}")
         traceback.print_exc()
+    _feed_text_lsh(content, trigger_type or "", verification_passed)
+
+
+# 近似广告文案索引：与写 bio_calls.jsonl 的事件同源，只收确认的广告（直接删除类、人机验证未通过），不收 B 群与待验证
+_text_lsh = MinHashLSH(
+    threshold=TEXT_LSH_THRESHOLD, min_chars=TEXT_LSH_MIN_CHARS,
+    max_docs=TEXT_LSH_MAX, ttl=TEXT_LSH_TTL_DAYS * 86400,
+)
+# 只收录「消息文本本身」是广告证据的触发：昵称/头像/图片/转发来源等命中时，消息正文可能是正常内容，收录会误伤
+_TEXT_LSH_FEED_TRIGGERS = frozenset(["blacklist_text", "combined_pair", "ad"])
+_TEXT_LSH_FEED_VERIFY = "verify:spam_text"  # 因消息文本触发人机验证且未通过
+TEXT_LSH_WARM_BYTES = 8 * 1024 * 1024  # 启动时只回放 bio_calls.jsonl 末尾这么多字节
+
+
+def _text_lsh_feedable(trigger_type: str, verification_passed: Optional[str]) -> bool:
+    if trigger_type in _TEXT_LSH_FEED_TRIGGERS:
+        return True
+    return trigger_type == _TEXT_LSH_FEED_VERIFY and verification_passed == "false"
+
+
+def _feed_text_lsh(content: str, trigger_type: str, verification_passed: Optional[str] = None, ttl: Optional[float] = None):
+    if not ENABLE_TEXT_LSH or not _text_lsh_feedable(trigger_type, verification_passed):
+        return
+    if _is_in_keyword_whitelist("text", content):
+        return
+    _text_lsh.add(content, {"trigger": trigger_type, "sample": content[:50]}, ttl=ttl)
+
+
+def _load_text_lsh_from_log():
+    """启动时回放 bio_calls.jsonl 末尾记录，恢复 TTL 内的近似文案索引"""
+    if not ENABLE_TEXT_LSH or not DELETED_CONTENT_LOG_PATH.exists():
+        return
+    ttl = TEXT_LSH_TTL_DAYS * 86400
+    now = time.time()
+    n = 0
+    try:
+        with open(DELETED_CONTENT_LOG_PATH, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TEXT_LSH_WARM_BYTES))
+            if size > TEXT_LSH_WARM_BYTES:
+                f.readline()  # 丢弃被截断的第一行
+            lines = f.read().decode("utf-8", errors="ignore").splitlines()
+        for line in lines:
+            try:
+                rec = json.loads(line)
+                age = now - datetime.strptime(rec.get("time", ""), "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if age >= ttl or not _text_lsh_feedable(rec.get("trigger_type") or "", rec.get("verification_passed")):
+                continue
+            _feed_text_lsh(rec.get("deleted_content") or "", rec.get("trigger_type") or "", rec.get("verification_passed"), ttl=ttl - age)
+            n += 1
+        print(f"[PTB] 近似文案索引已从 bio_calls.jsonl 恢复 {n} 条记录（索引 {len(_text_lsh)} 条）")
+    except Exception as e:
+        print(f"[PTB] 恢复近似文案索引失败: {e}")
 
 
 def _schedule_sync_background(func, *args, **kwargs):
@@ -1927,14 +2241,6 @@ def _schedule_sync_background(func, *args, **kwargs):
         func(*args, **kwargs)  # 无事件循环时同步执行
 
 
-def _cleanup_expired_message_cache():
-    """删除超过 TTL 的缓存消息"""
-    now = time.time()
-    expired = [k for k, (_, ts) in _last_message_by_user.items() if now - ts > LAST_MESSAGE_CACHE_TTL_SECONDS]
-    for k in expired:
-        del _last_message_by_user[k]
-
-
 def _add_whitelist_keyword(field: str, keyword: str, is_regex: bool = False, as_exact: bool = None) -> bool:
     """白名单添加：管理员限制用户时不录入这些昵称/消息"""
     if field not in ("name", "text"):
@@ -2091,7 +2397,7 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 # 仅私聊有效的命令（群内输入时提示）
 _PRIVATE_ONLY_COMMANDS = frozenset([
     "/help", "/start", "/cancel",
-    "/add_group", "/add_text", "/add_name", "/addcp", "/add_bio",
+    "/add_group", "/add_text", "/add_name", "/addcp", "/add_bio", "/add_image",
     "/reload", "/search", "/set", "/settime",
     "/kw_text", "/kw_name",
     "/wl_name", "/wl_text", "/facetext", "/facename",
@@ -2167,8 +2473,6 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
     # 缓存用户最近消息（必须在所有 return 之前），供管理员删除+限制/封禁时自动加入 text 关键词
     if text:
         _last_message_by_user[(chat_id, uid)] = (text[:500], time.time())
-        if len(_last_message_by_user) % 100 == 0:  # 每 100 条消息清理一次过期缓存
-            _cleanup_expired_message_cache()
 
     # 未加入 B 群？→ 触发验证。开关关闭时在霜刃唤醒之前检查；开关开启时延后到组合关键词与白名单之间
     is_bot = getattr(user, "is_bot", False)
@@ -2198,8 +2502,9 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} verified_pass")
         return
 
+    name_verdict = _name_verdict(uid, first_name, last_name)
     # 组合关键词：白名单之后、facetext/facename 之前
-    hit_cp = check_combined_pairs(first_name, last_name, text or "") if get_addcp_enabled(chat_id) else None
+    hit_cp = check_combined_pairs(first_name, last_name, text or "", name_hits=name_verdict["cp"]) if name_verdict["cp"] and get_addcp_enabled(chat_id) else None
     if hit_cp:
         nk, tk = hit_cp
         new_count = _increment_combined_pair_count(nk, tk)
@@ -2218,7 +2523,7 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
     # facetext/facename：女性头像+关键词命中→加黑+直接删除（放在霜刃唤醒和黑名单之间，每次均识别头像）
     if _FACE_GENDER_AVAILABLE and (_has_face_keywords("facetext") or _has_face_keywords("facename")):
         hit_ft = check_facetext(text)
-        hit_fn = check_facename(first_name, last_name)
+        hit_fn = name_verdict["face"]
         if hit_ft or hit_fn:
             gender = await _detect_avatar_gender(context.bot, uid)
             if gender == "female":
@@ -2237,7 +2542,7 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
     # 黑名单关键词：命中直接删除，并将用户加入黑名单
     hit_bl_text = check_blacklist_text(text)
-    hit_bl_name = check_blacklist_name(first_name, last_name)
+    hit_bl_name = name_verdict["blacklist"]
     if hit_bl_text:
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 黑名单关键词(text) 直接删除+加黑 hit={hit_bl_text}")
         add_to_blacklist(uid)
@@ -2261,6 +2566,21 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await _delete_message_with_retry(context.bot, int(chat_id), msg.message_id, "blacklist_name", retries=2, clear_cache_key=(chat_id, uid), hit_type="blacklist_name", hit_keyword=hit_bl_name)
         return
 
+    # 图片黑名单：图片/贴纸缩略图（及可选头像）与拉黑图片近似 → 直接删除+加黑
+    hit_img = await _match_image_blacklist(context.bot, msg, uid)
+    if hit_img:
+        source, hit_hash, dist = hit_img
+        print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 图片黑名单 直接删除+加黑 source={source} hash={hit_hash} d={dist}")
+        add_to_blacklist(uid)
+        save_verified_users()
+        save_verification_blacklist()
+        full_name = f"{first_name} {last_name}".strip() or "用户"
+        msg_preview = (text or "")[:200]
+        if msg_preview.strip():
+            _schedule_sync_background(_log_deleted_content, uid, full_name, msg_preview, chat_id=chat_id, trigger_type="image_hash")
+        await _delete_message_with_retry(context.bot, int(chat_id), msg.message_id, "image_hash", retries=2, clear_cache_key=(chat_id, uid), hit_type="image_hash", hit_keyword=f"{source}:{hit_hash}")
+        return
+
     # 广告链接：含链接且文本≤10字 → 直接删除+加黑
     if _is_ad_message(msg):
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 广告链接 直接删除+加黑")
@@ -2317,7 +2637,7 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
                     print(f"[PTB] 群消息: chat_id={chat_id} 验证码错误 msg_id={msg.message_id} [验证码消息不单独建记录]")
                     await _delete_message_with_retry(context.bot, int(chat_id), msg.message_id, "verify_wrong_code", retries=2, clear_cache_key=(chat_id, uid), hit_type="verify_other")
                     vmsg = await msg.reply_text(f"验证失败，再失败 {left} 次将被限制发言")
-                    asyncio.create_task(_delete_after(context.bot, int(chat_id), vmsg.message_id, _get_verify_msg_delete_after(), user_msg_id=msg.message_id, user_cache_key=(chat_id, uid)))
+                    _schedule_delete(int(chat_id), vmsg.message_id, _get_verify_msg_delete_after(), user_msg_id=msg.message_id, user_cache_key=(chat_id, uid))
             return
         # 超时 = 未完成验证，计 1 次失败，杜绝「间隔发违禁词」规避限制
         cnt = increment_verification_failures(chat_id, uid)
@@ -2335,13 +2655,13 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
                                   "⚠️ 检测到有疑似广告风险，请先完成人机验证。", "sticker")
         return
 
-    if ENABLE_EMOJI_CHECK and (_contains_emoji(text) or _contains_emoji(f"{first_name} {last_name}".strip())):
+    if ENABLE_EMOJI_CHECK and (name_verdict["emoji"] or _contains_emoji(text)):
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 触发验证(emoji)")
         await _start_verification(context.bot, msg, chat_id, uid, first_name, last_name,
                                   "⚠️ 检测到您的消息或昵称中含有表情符号，请先完成人机验证。", "emoji")
         return
     hit_text = check_spam_text(text)
-    hit_name = check_spam_name(first_name, last_name)
+    hit_name = name_verdict["spam"]
     if hit_text:
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 触发验证(spam_text hit={hit_text})")
         await _start_verification(context.bot, msg, chat_id, uid, first_name, last_name,
@@ -2352,6 +2672,23 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await _start_verification(context.bot, msg, chat_id, uid, first_name, last_name,
                                   "⚠️ 检测到您昵称中含有疑似广告词，请先完成人机验证。", "spam_name", hit_keyword=hit_name)
         return
+    lsh_hit = _text_lsh.query(text) if ENABLE_TEXT_LSH and text else None
+    if lsh_hit:
+        sim, meta = lsh_hit
+        sample = meta.get("sample", "")
+        if TEXT_LSH_ACTION == "delete":
+            print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 近似广告文案 直接删除+加黑 sim={sim:.2f} sample={sample!r}")
+            add_to_blacklist(uid)
+            save_verified_users()
+            save_verification_blacklist()
+            full_name = f"{first_name} {last_name}".strip() or "用户"
+            _schedule_sync_background(_log_deleted_content, uid, full_name, text[:200], chat_id=chat_id, trigger_type="text_lsh")
+            await _delete_message_with_retry(context.bot, int(chat_id), msg.message_id, "text_lsh", retries=2, clear_cache_key=(chat_id, uid), hit_type="text_lsh", hit_keyword=sample)
+            return
+        print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 触发验证(text_lsh sim={sim:.2f} sample={sample!r})")
+        await _start_verification(context.bot, msg, chat_id, uid, first_name, last_name,
+                                  "⚠️ 检测到您的消息与近期广告高度相似，请先完成人机验证。", "text_lsh")
+        return
     if uid in verification_blacklist:
         print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} 触发验证(blacklist)")
         await _start_verification(context.bot, msg, chat_id, uid, first_name, last_name,
@@ -2371,15 +2708,6 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
     print(f"[PTB] 群消息已记录: chat_id={chat_id} msg_id={msg.message_id} whitelist_added")
 
 
-def _cleanup_required_group_warn_count():
-    """清理 _required_group_warn_count 中已过期的 key（窗口外的不再计入）"""
-    now = time.time()
-    cutoff = now - TRIGGER_WINDOW_SECONDS
-    expired = [k for k, ts_list in _required_group_warn_count.items() if not ts_list or max(ts_list) <= cutoff]
-    for k in expired:
-        _required_group_warn_count.pop(k, None)
-
-
 def _get_bgroup_merge_lock(chat_id: str) -> asyncio.Lock:
     """获取 B 群合并的 per-chat 锁，防止并发导致多条合并消息刷屏"""
     if chat_id not in _bgroup_merge_lock:
@@ -2397,12 +2725,7 @@ def _get_verify_merge_lock(chat_id: str) -> asyncio.Lock:
 async def _start_required_group_verification(bot, msg, chat_id: str, user_id: int, first_name: str, last_name: str):
     """未加入 B 群时：删除消息，发送带按钮的警告。30s 窗口内多用户合并为一条，替换时删旧发新，合并消息 N 秒后删除。"""
     global _bgroup_merge_state
-    _cleanup_required_group_warn_count()
-    key = (chat_id, user_id)
-    ts_list = _required_group_warn_count.get(key, [])
-    should_count, new_ts, cnt = _apply_trigger_cooldown_window(ts_list, time.time())
-    if should_count:
-        _required_group_warn_count[key] = new_ts
+    should_count, cnt = _required_group_warn_count.hit((chat_id, user_id))
     await _delete_message_with_retry(bot, int(chat_id), msg.message_id, "required_group_trigger", retries=2, clear_cache_key=(chat_id, user_id), hit_type="bgroup")
     full_name = f"{first_name} {last_name}".strip() or "用户"
     deleted_text = (msg.text or msg.caption or "").strip()
@@ -2447,6 +2770,7 @@ async def _start_required_group_verification(bot, msg, chat_id: str, user_id: in
 
         # 删除旧的合并消息（若存在）
         if prev_msg_id is not None:
+            cancel_scheduled_delete(state.get("sched_id"))
             await _delete_message_with_retry(bot, int(chat_id), prev_msg_id, "bgroup_merge_replace", retries=1, hit_type="bgroup")
 
         # 构建合并文案（用户名>7字时脱敏展示）
@@ -2462,23 +2786,8 @@ async def _start_required_group_verification(bot, msg, chat_id: str, user_id: in
             rows.append([InlineKeyboardButton("自助解禁", callback_data=cb_data)])
         reply_markup = InlineKeyboardMarkup(rows) if rows else None
         vmsg = await bot.send_message(chat_id=int(chat_id), text=body, reply_markup=reply_markup)
-        _bgroup_merge_state[chat_id] = {"users": users_in_window, "msg_id": vmsg.message_id, "ts": time.time()}
-    _safe_create_task(_delete_bgroup_merge_after(bot, int(chat_id), vmsg.message_id, chat_id), "bgroup_merge")
-
-
-async def _delete_verify_merge_after(bot, chat_id: int, msg_id: int, chat_id_str: str):
-    """人机验证合并消息 N 秒后删除（settime 选项 2）。仅删除成功时清理 state，失败时保留供兜底任务补删。"""
-    global _verify_merge_state
-    try:
-        await asyncio.sleep(_get_verify_msg_delete_after())
-        ok = await _delete_message_with_retry(bot, chat_id, msg_id, "verify_merge", hit_type="verify_other")
-        if ok:
-            state = _verify_merge_state.get(chat_id_str)
-            if state and state.get("msg_id") == msg_id:
-                _verify_merge_state.pop(chat_id_str, None)
-    except Exception as e:
-        print(f"[PTB] 人机验证合并删除异常 chat_id={chat_id_str} msg_id={msg_id}: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        sched_id = _schedule_delete(chat_id, vmsg.message_id, req_sec, label="bgroup_merge", kind="bgroup_merge")
+        _bgroup_merge_state[chat_id] = {"users": users_in_window, "msg_id": vmsg.message_id, "ts": time.time(), "sched_id": sched_id}
 
 
 async def _start_verification(bot, msg, chat_id: str, user_id: int, first_name: str, last_name: str, intro: str, trigger_reason: str = "", hit_keyword: str = ""):
@@ -2522,6 +2831,7 @@ async def _start_verification(bot, msg, chat_id: str, user_id: int, first_name:
         users_in_window.append((user_id, full_name, code, msg_id, now))
 
         if prev_msg_id is not None:
+            cancel_scheduled_delete(state.get("sched_id"))
             await _delete_message_with_retry(bot, int(chat_id), prev_msg_id, "verify_merge_replace", retries=1, hit_type="verify_other")
 
         lines = [f"【{_mask_display_name(name)}】" for (_, name, _, _, _) in users_in_window]
@@ -2539,8 +2849,8 @@ async def _start_verification(bot, msg, chat_id: str, user_id: int, first_name:
             buttons.append([InlineKeyboardButton("自助验证", url=deep_link)])
         reply_markup = InlineKeyboardMarkup(buttons) if buttons else None
         vmsg = await bot.send_message(chat_id=int(chat_id), text=body, parse_mode="HTML", reply_markup=reply_markup)
-        _verify_merge_state[chat_id] = {"users": users_in_window, "msg_id": vmsg.message_id, "ts": now}
-    _safe_create_task(_delete_verify_merge_after(bot, int(chat_id), vmsg.message_id, chat_id), "verify_merge")
+        sched_id = _schedule_delete(chat_id, vmsg.message_id, _get_verify_msg_delete_after(), label="verify_merge", kind="verify_merge")
+        _verify_merge_state[chat_id] = {"users": users_in_window, "msg_id": vmsg.message_id, "ts": now, "sched_id": sched_id}
 
 
 def _safe_create_task(coro, name: str = ""):
@@ -2557,19 +2867,21 @@ def _safe_create_task(coro, name: str = ""):
     return task
 
 
-async def _delete_bgroup_merge_after(bot, chat_id: int, msg_id: int, chat_id_str: str):
-    """B 群合并消息 N 秒后删除（settime 选项 1）。仅删除成功时清理 state，失败时保留供兜底任务补删。"""
-    global _bgroup_merge_state
-    try:
-        await asyncio.sleep(_get_required_group_msg_delete_after())
-        ok = await _delete_message_with_retry(bot, chat_id, msg_id, "bgroup_merge", hit_type="bgroup")
-        if ok:
-            state = _bgroup_merge_state.get(chat_id_str)
-            if state and state.get("msg_id") == msg_id:
-                _bgroup_merge_state.pop(chat_id_str, None)
-    except Exception as e:
-        print(f"[PTB] B群合并删除异常 chat_id={chat_id_str} msg_id={msg_id}: {type(e).__name__}: {e}")
-        traceback.print_exc()
+FROST_SYSTEM_PROMPT = "你是一个冷酷的女杀手，沉默寡言。你的老板是小熊。回答严格控制在15字以内，尽量一句话。复杂或不好回复的问题可以回复：小助理，你来回答"
+_FROST_TIME_SENSITIVE = re.compile(r"今天|明天|昨天|现在|几点|几号|星期|周几|天气|新闻|最新|实时")
+_FROST_QUERY_STRIP = re.compile(r"[\s,，.。!！?？~～、…:：;；\"'“”‘’()（）\[\]【】]+")
+# (chat_id, model, 设定指纹, 归一化提问) -> 回复，按插入/命中顺序 LRU 淘汰
+_frost_reply_cache: TTLMap = TTLMap(FROST_REPLY_CACHE_TTL, FROST_REPLY_CACHE_MAX, name="frost_reply")
+
+
+def _frost_cache_key(chat_id: str, query: str) -> tuple | None:
+    """未开启、提问为空或含时效词时返回 None（不走缓存）"""
+    if not FROST_REPLY_CACHE_ENABLED:
+        return None
+    norm = _FROST_QUERY_STRIP.sub("", query.lower())
+    if not norm or _FROST_TIME_SENSITIVE.search(query):
+        return None
+    return (chat_id, KIMI_MODEL, zlib.crc32(FROST_SYSTEM_PROMPT.encode("utf-8")), norm)
 
 
 async def _maybe_ai_trigger(bot, msg, chat_id: str, user_id: int, text: str, first_name: str, last_name: str):
@@ -2591,28 +2903,36 @@ async def _maybe_ai_trigger(bot, msg, chat_id: str, user_id: int, text: str, fir
                 reply_to_message_id=msg.message_id,
             )
             if FROST_REPLY_DELETE_AFTER > 0:
-                asyncio.create_task(_delete_after(bot, int(chat_id), m.message_id, FROST_REPLY_DELETE_AFTER))
+                _schedule_delete(int(chat_id), m.message_id, FROST_REPLY_DELETE_AFTER)
         except Exception:
             pass
         return
+    # 回复霜刃唤醒时依赖上文，不走缓存
+    cache_key = None if replied_frost_text else _frost_cache_key(chat_id, query)
     try:
-        from openai import AsyncOpenAI
-        print(f"[PTB] 霜刃: 调用 Kimi API model={KIMI_MODEL}")
-        client = AsyncOpenAI(api_key=KIMI_API_KEY, base_url=KIMI_BASE_URL)
-        messages = [
-            {"role": "system", "content": "你是一个冷酷的女杀手，沉默寡言。你的老板是小熊。回答严格控制在15字以内，尽量一句话。复杂或不好回复的问题可以回复：小助理，你来回答"},
-        ]
-        if replied_frost_text:
-            messages.append({"role": "assistant", "content": replied_frost_text})
-        messages.append({"role": "user", "content": query})
-        resp = await client.chat.completions.create(
-            model=KIMI_MODEL,
-            messages=messages,
-            temperature=0.6,
-            max_tokens=1024,
-        )
-        reply = (resp.choices[0].message.content or "").strip()
-        print(f"[PTB] 霜刃: API 返回 len={len(reply)}")
+        reply = _frost_reply_cache.get(cache_key) if cache_key else None
+        if reply is not None:
+            st = _frost_reply_cache.stats()
+            print(f"[PTB] 霜刃: 命中回复缓存 hit={st['hits']} miss={st['misses']} size={st['size']}")
+        else:
+            print(f"[PTB] 霜刃: 调用 Kimi API model={KIMI_MODEL}")
+            messages = [
+                {"role": "system", "content": FROST_SYSTEM_PROMPT},
+            ]
+            if replied_frost_text:
+                messages.append({"role": "assistant", "content": replied_frost_text})
+            messages.append({"role": "user", "content": query})
+            # 开启 FROST_HEDGE_ENABLED 时，主模型超过 p90 延迟未返回则同时请求备用模型，取先返回者
+            reply, source = await hedged_completion(
+                {"base_url": KIMI_BASE_URL, "api_key": KIMI_API_KEY, "model": KIMI_MODEL},
+                messages,
+                temperature=0.6,
+                max_tokens=1024,
+            )
+            print(f"[PTB] 霜刃: API 返回 len={len(reply)} source={source}")
+            # 键中的 model 是主模型，备用模型的回复不写入，避免以主模型名义缓存
+            if reply and cache_key and source == "primary":
+                _frost_reply_cache[cache_key] = reply
         if not reply:
             return
         # 仅当回复几乎就是「小助理，你来回答」时才转交，避免误判（如回答中顺带提到小助理）
@@ -2628,7 +2948,7 @@ async def _maybe_ai_trigger(bot, msg, chat_id: str, user_id: int, text: str, fir
                     reply_to_message_id=msg.message_id,
                 )
                 if FROST_REPLY_DELETE_AFTER > 0:
-                    asyncio.create_task(_delete_after(bot, int(chat_id), hm.message_id, FROST_REPLY_DELETE_AFTER))
+                    _schedule_delete(int(chat_id), hm.message_id, FROST_REPLY_DELETE_AFTER)
                 _xhbot = _BASE.parent
                 if str(_xhbot) not in sys.path:
                     sys.path.insert(0, str(_xhbot))
@@ -2643,7 +2963,7 @@ async def _maybe_ai_trigger(bot, msg, chat_id: str, user_id: int, text: str, fir
                     reply_to_message_id=msg.message_id,
                 )
                 if FROST_REPLY_DELETE_AFTER > 0:
-                    asyncio.create_task(_delete_after(bot, int(chat_id), fm.message_id, FROST_REPLY_DELETE_AFTER))
+                    _schedule_delete(int(chat_id), fm.message_id, FROST_REPLY_DELETE_AFTER)
             return
         rm = await bot.send_message(
             chat_id=int(chat_id),
@@ -2651,7 +2971,7 @@ async def _maybe_ai_trigger(bot, msg, chat_id: str, user_id: int, text: str, fir
             reply_to_message_id=msg.message_id,
         )
         if FROST_REPLY_DELETE_AFTER > 0:
-            asyncio.create_task(_delete_after(bot, int(chat_id), rm.message_id, FROST_REPLY_DELETE_AFTER))
+            _schedule_delete(int(chat_id), rm.message_id, FROST_REPLY_DELETE_AFTER)
         print("[PTB] 霜刃: 已发送回复")
     except Exception as e:
         print(f"[PTB] 霜刃 AI 唤醒异常: {e}")
@@ -2738,16 +3058,18 @@ async def _restrict_and_notify(bot, chat_id: str, user_id: int, full_name: str,
             chat_id=int(chat_id),
             text=f"【{_mask_display_name(full_name)}】\n\n验证失败，如有需要，请联系 {UNBAN_BOT_USERNAME} 进行解封",
         )
-        asyncio.create_task(_delete_after(bot, int(chat_id), m.message_id, VERIFY_MSG_DELETE_AFTER))
+        _schedule_delete(int(chat_id), m.message_id, VERIFY_MSG_DELETE_AFTER)
     except Exception:
         pass
 
 
+# 两段式等待状态：超时后下一条消息仍要回复「已超时」，故 TTLMap 保留 1 小时兜底，超时判断沿用时间戳
+PENDING_STATE_RETENTION_SECONDS = 3600
 PENDING_SETLIMIT_TIMEOUT = 120
-pending_setlimit: dict[tuple[str, int], dict] = {}  # (chat_id, uid) -> {timestamp}
-pending_search: dict[int, dict] = {}  # uid -> {timestamp}，/search 后等待链接，仅管理员
+pending_setlimit: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_setlimit")  # (chat_id, uid) -> {timestamp}
+pending_search: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_search")  # uid -> {timestamp}，/search 后等待链接，仅管理员
 PENDING_SEARCH_TIMEOUT = 120
-pending_start_verify: dict[int, dict] = {}  # uid -> {timestamp}，/start 后非白名单用户等待群链接以发起验证
+pending_start_verify: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_start_verify")  # uid -> {timestamp}，/start 后非白名单用户等待群链接以发起验证
 PENDING_START_VERIFY_TIMEOUT = 120
 
 
@@ -2944,7 +3266,8 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• /addcp — 组合关键词（昵称+消息同时命中删除，格式：昵称,消息 或 /昵称,/消息 精确匹配）\n"
             "• /kw_text、/kw_name — 待验证（命中触发人机验证）\n"
             "• /wl_name、/wl_text — 白名单（限制用户时不录入）\n"
-            "• /facetext、/facename — 女性头像+关键词（命中删除，需 tgface）\n\n"
+            "• /facetext、/facename — 女性头像+关键词（命中删除，需 tgface）\n"
+            "• /add_image — 图片黑名单（发送图片/贴纸，近似图命中删除+加黑）\n\n"
             "【系统】\n"
             "• /settime — 验证消息自动删除时间\n"
             "• /reload — 重载配置\n"
@@ -3170,21 +3493,26 @@ async def cmd_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _load_bgroup_config()
     _load_target_groups()
     _load_group_settings()
-    await update.message.reply_text("已重载 关键词(黑名单/待验证/白名单)、组合关键词、用户黑名单、B群配置、监控群列表、群管理设置")
-
-pending_keyword_cmd = {}
-pending_keyword_confirm = {}  # 黑名单关键词已存在时等待用户确认是否移除
-pending_addcp_confirm = {}  # 组合关键词已存在时等待用户确认是否移除
-pending_face_confirm = {}  # facetext/facename 关键词已存在时等待用户确认是否移除
-pending_verify_confirm = {}  # 待验证关键词已存在时等待用户确认是否移除
-pending_wl_confirm = {}  # 白名单关键词已存在时等待用户确认是否移除
-pending_settime_cmd = {}  # uid -> {"type": "required_group"|"verify"}
-pending_add_group: dict[int, dict] = {}  # uid -> {timestamp}，/add_group 两段式
-pending_limit: dict[int, dict] = {}  # uid -> {"step":"chat"|"users","chat_id":str,"timestamp":float}
-pending_limit_confirm: dict[str, dict] = {}  # confirm_id -> {"uid":int,"chat_id":str,"user_ids":list,"group_title":str,"ts":float}
+    _load_image_hash_blacklist()
+    await update.message.reply_text("已重载 关键词(黑名单/待验证/白名单)、组合关键词、用户黑名单、B群配置、监控群列表、群管理设置、图片黑名单")
+
+PENDING_KEYWORD_CONFIRM_TIMEOUT = 120  # 关键词已存在确认按钮 120 秒超时
+PENDING_LIMIT_CONFIRM_TIMEOUT = 300  # 确认按钮 300 秒超时
+pending_keyword_cmd: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_keyword_cmd")
+# 确认按钮：到期即由 TTLMap 回收，回调取不到时提示已超时
+pending_keyword_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_keyword_confirm")  # 黑名单关键词已存在时等待用户确认是否移除
+pending_addcp_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_addcp_confirm")  # 组合关键词已存在时等待用户确认是否移除
+pending_face_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_face_confirm")  # facetext/facename 关键词已存在时等待用户确认是否移除
+pending_verify_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_verify_confirm")  # 待验证关键词已存在时等待用户确认是否移除
+pending_wl_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_wl_confirm")  # 白名单关键词已存在时等待用户确认是否移除
+pending_settime_cmd: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_settime_cmd")  # uid -> {"type": "required_group"|"verify"}
+pending_add_group: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_add_group")  # uid -> {timestamp}，/add_group 两段式
+pending_limit: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_limit")  # uid -> {"step":"chat"|"users","chat_id":str,"timestamp":float}
+pending_image_cmd: TTLMap = TTLMap(PENDING_STATE_RETENTION_SECONDS, PENDING_STATE_MAX, name="pending_image_cmd")  # uid -> {timestamp}，/add_image 多轮
+pending_image_confirm: TTLMap = TTLMap(PENDING_KEYWORD_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_image_confirm")  # /add_image 发送的图片与黑名单近似时等待用户确认是否移除
+pending_limit_confirm: TTLMap = TTLMap(PENDING_LIMIT_CONFIRM_TIMEOUT, PENDING_STATE_MAX, name="pending_limit_confirm")  # confirm_id -> {"uid":int,"chat_id":str,"user_ids":list,"group_title":str,"ts":float}
 PENDING_ADD_GROUP_TIMEOUT = 120
 PENDING_LIMIT_TIMEOUT = 120
-PENDING_LIMIT_CONFIRM_TIMEOUT = 300  # 确认按钮 300 秒超时
 LIMIT_BATCH_INTERVAL_SEC = 2  # 每两个 user_id 间隔秒数
 LIMIT_PROGRESS_EVERY = 10  # 每完成 N 个发送进度
 LIMIT_BATCH_MAX = 100  # 单次最多限制人数（产品方案 3.2）
@@ -3357,6 +3685,9 @@ async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif uid in pending_keyword_cmd:
         pending_keyword_cmd.pop(uid, None)
         await update.message.reply_text("已取消")
+    elif uid in pending_image_cmd:
+        pending_image_cmd.pop(uid, None)
+        await update.message.reply_text("已取消")
     elif any(v.get("uid") == uid for v in pending_keyword_confirm.values()):
         to_pop = [k for k, v in pending_keyword_confirm.items() if v.get("uid") == uid]
         for k in to_pop:
@@ -3367,6 +3698,11 @@ async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for k in to_pop:
             pending_addcp_confirm.pop(k, None)
         await update.message.reply_text("已取消")
+    elif any(v.get("uid") == uid for v in pending_image_confirm.values()):
+        to_pop = [k for k, v in pending_image_confirm.items() if v.get("uid") == uid]
+        for k in to_pop:
+            pending_image_confirm.pop(k, None)
+        await update.message.reply_text("已取消")
     elif uid in pending_settime_cmd:
         pending_settime_cmd.pop(uid, None)
         await update.message.reply_text("已取消")
@@ -3437,7 +3773,6 @@ async def _process_add_keyword_followup(update: Update, context: ContextTypes.DE
     as_exact, kw, is_regex = _parse_keyword_input(text)
     exists = _keyword_exists_in_blacklist(field, kw, as_exact, is_regex)
     if exists:
-        _cleanup_pending_keyword_confirm()
         confirm_id = f"{int(time.time()*1000)}_{uid}"[:32]
         pending_keyword_confirm[confirm_id] = {"uid": uid, "field": field, "kw": kw, "as_exact": as_exact, "is_regex": is_regex, "label": label, "ts": time.time()}
         rows = [[InlineKeyboardButton("取消", callback_data=f"kw_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"kw_confirm:{confirm_id}:remove")]]
@@ -3462,7 +3797,6 @@ async def _process_add_verify_keyword_followup(update: Update, context: ContextT
     kw_for_storage = text if is_regex else kw
     exists = _keyword_exists_in_verify(field, kw_for_storage, as_exact, is_regex)
     if exists:
-        _cleanup_pending_verify_confirm()
         confirm_id = f"v{int(time.time()*1000)}_{uid}"[:32]
         pending_verify_confirm[confirm_id] = {"uid": uid, "field": field, "kw": kw_for_storage, "as_exact": as_exact, "is_regex": is_regex, "label": label, "ts": time.time()}
         rows = [[InlineKeyboardButton("取消", callback_data=f"verify_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"verify_confirm:{confirm_id}:remove")]]
@@ -3487,7 +3821,6 @@ async def _process_add_whitelist_followup(update: Update, context: ContextTypes.
     kw_for_storage = text if is_regex else kw
     exists = _keyword_exists_in_whitelist(field, kw_for_storage, as_exact, is_regex)
     if exists:
-        _cleanup_pending_wl_confirm()
         confirm_id = f"w{int(time.time()*1000)}_{uid}"[:32]
         pending_wl_confirm[confirm_id] = {"uid": uid, "field": field, "kw": kw_for_storage, "as_exact": as_exact, "is_regex": is_regex, "label": label, "ts": time.time()}
         rows = [[InlineKeyboardButton("取消", callback_data=f"wl_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"wl_confirm:{confirm_id}:remove")]]
@@ -3512,7 +3845,6 @@ async def _process_add_face_followup(update: Update, context: ContextTypes.DEFAU
     kw_for_storage = text if is_regex else kw
     exists = _keyword_exists_in_face(field, kw_for_storage, as_exact, is_regex)
     if exists:
-        _cleanup_pending_face_confirm()
         confirm_id = f"f{int(time.time()*1000)}_{uid}"[:32]
         pending_face_confirm[confirm_id] = {"uid": uid, "field": field, "kw": kw_for_storage, "as_exact": as_exact, "is_regex": is_regex, "label": label, "ts": time.time()}
         rows = [[InlineKeyboardButton("取消", callback_data=f"face_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"face_confirm:{confirm_id}:remove")]]
@@ -3577,14 +3909,56 @@ async def cmd_add_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("bio 简介关键词暂未启用")
 
 
-def _cleanup_pending_addcp_confirm():
-    """清理超时的 pending_addcp_confirm 条目"""
-    global pending_addcp_confirm
-    now = time.time()
-    cutoff = now - PENDING_KEYWORD_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_addcp_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_addcp_confirm.pop(k, None)
+async def _process_add_image(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: int, msg) -> bool:
+    """/add_image 的图片输入：不在黑名单则加入，已有近似图片则询问是否移除。返回是否已处理"""
+    target = _message_image_file(msg)
+    if not target:
+        await update.message.reply_text("请发送图片或贴纸（动态贴纸需带缩略图），/cancel 结束")
+        return True
+    file_id, fuid, source = target
+    h = await _image_hash_of(context.bot, file_id, fuid)
+    if not h:
+        await update.message.reply_text("无法识别该图片（解码失败或纯色图），未添加")
+        return True
+    hit = _image_hash_index.match(*h)
+    if hit:
+        confirm_id = f"{int(time.time()*1000)}_{uid}"[:32]
+        pending_image_confirm[confirm_id] = {"uid": uid, "phash": hit[0], "ts": time.time()}
+        rows = [[InlineKeyboardButton("取消", callback_data=f"img_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"img_confirm:{confirm_id}:remove")]]
+        await update.message.reply_text(
+            f"该图片与黑名单中的 {_hash_hex(hit[0])} 近似（距离 {hit[1]}），是否移除？",
+            reply_markup=InlineKeyboardMarkup(rows),
+        )
+        return True
+    _image_hash_index.add(h[0], h[1], {"added_by": uid, "time": int(time.time()), "source": source})
+    _save_image_hash_blacklist()
+    await update.message.reply_text(f"已加入图片黑名单（{_hash_hex(h[0])}，共 {len(_image_hash_index)} 条）。继续发送图片，/cancel 结束")
+    return True
+
+
+async def cmd_add_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """多轮：添加图片黑名单（图片/贴纸，近似图命中删除+加黑）。回复某张图片发送 /add_image 则直接处理该图"""
+    if update.effective_chat.type != "private" or not update.effective_user:
+        return
+    _clear_pending_private_verify(update)
+    if not is_admin(update.effective_user.id, ADMIN_IDS):
+        await update.message.reply_text("⚠️ 仅管理员可使用")
+        return
+    if _image_hash_index is None:
+        await update.message.reply_text("图片黑名单未启用（需 opencv-python）")
+        return
+    uid = update.effective_user.id
+    pending_image_cmd[uid] = {"timestamp": time.time()}
+    reply = getattr(update.message, "reply_to_message", None)
+    if reply and _message_image_file(reply):
+        await _process_add_image(update, context, uid, reply)
+        return
+    await update.message.reply_text(
+        "【图片黑名单】近似图片/贴纸命中直接删除+加黑（多轮，/cancel 结束）\n"
+        "• 直接发送或转发图片、贴纸 → 加入\n"
+        "• 已存在（近似）则询问是否移除"
+    )
+
 
 
 def _parse_addcp_input(name_raw: str, text_raw: str) -> tuple[str, str, bool]:
@@ -3635,7 +4009,6 @@ async def _process_add_cp_followup(update: Update, context: ContextTypes.DEFAULT
                 added += 1
         else:
             if _combined_pair_exists(name_kw, text_kw):
-                _cleanup_pending_addcp_confirm()
                 confirm_id = f"c{int(time.time()*1000)}_{uid}"[:32]
                 pending_addcp_confirm[confirm_id] = {"uid": uid, "name_kw": name_kw, "text_kw": text_kw, "ts": time.time()}
                 rows = [[InlineKeyboardButton("取消", callback_data=f"addcp_confirm:{confirm_id}:cancel"), InlineKeyboardButton("移除", callback_data=f"addcp_confirm:{confirm_id}:remove")]]
@@ -3872,6 +4245,41 @@ async def callback_keyword_confirm(update: Update, context: ContextTypes.DEFAULT
             await query.edit_message_text(f"移除「{kw}」失败（可能已不存在）", reply_markup=None)
 
 
+async def callback_image_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /add_image 中图片与黑名单近似时的「取消/移除」按钮"""
+    global pending_image_confirm
+    query = update.callback_query
+    if not query or not query.data or not query.data.startswith("img_confirm:"):
+        return
+    uid = query.from_user.id if query.from_user else 0
+    if not uid or not is_admin(uid, ADMIN_IDS):
+        await query.answer("⚠️ 仅管理员可使用", show_alert=True)
+        return
+    parts = query.data.split(":", 2)  # img_confirm:id:action
+    if len(parts) < 3:
+        await query.answer("数据格式错误", show_alert=True)
+        return
+    _, confirm_id, action = parts[0], parts[1], parts[2]
+    info = pending_image_confirm.pop(confirm_id, None)
+    if not info:
+        await query.answer("已超时或已处理", show_alert=True)
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except Exception:
+            pass
+        return
+    ph = info["phash"]
+    await query.answer()
+    if action == "cancel":
+        await query.edit_message_text(f"{_hash_hex(ph)} 已取消移除", reply_markup=None)
+    elif action == "remove":
+        if _image_hash_index is not None and _image_hash_index.remove(ph):
+            _save_image_hash_blacklist()
+            await query.edit_message_text(f"已从图片黑名单移除 {_hash_hex(ph)}（剩余 {len(_image_hash_index)} 条）", reply_markup=None)
+        else:
+            await query.edit_message_text(f"移除 {_hash_hex(ph)} 失败（可能已不存在）", reply_markup=None)
+
+
 async def callback_face_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 facetext/facename 中关键词已存在时的「取消/移除」按钮"""
     global pending_face_confirm
@@ -4081,6 +4489,10 @@ async def private_nontext_handler(update: Update, context: ContextTypes.DEFAULT_
     uid = update.effective_user.id
     if uid in pending_private_verify:
         await update.message.reply_text("验证码错误")
+        return
+    if uid in pending_image_cmd and is_admin(uid, ADMIN_IDS) and _image_hash_index is not None:
+        pending_image_cmd[uid] = {"timestamp": time.time()}
+        await _process_add_image(update, context, uid, update.message)
 
 
 async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -4335,6 +4747,7 @@ async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_
             pending_keyword_cmd.pop(uid, None)
         else:
             info["timestamp"] = time.time()  # 刷新超时时间
+            pending_keyword_cmd.touch(uid)  # 原地修改不会续期 TTLMap 条目，需显式 touch
         return
 
     # 2. 群消息链接查询：需先 /search，再发送链接
@@ -4455,7 +4868,7 @@ async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_
         flow_lines.append(f"{prefix} {label} → {result}")
     trigger_map = {
         "spam_text": "消息垃圾关键词", "spam_name": "昵称垃圾关键词",
-        "ad": "广告链接", "emoji": "消息/昵称含表情", "sticker": "贴纸", "reply_other_chat": "引用非本群消息", "blacklist": "黑名单账号",
+        "ad": "广告链接", "emoji": "消息/昵称含表情", "sticker": "贴纸", "text_lsh": "近似广告文案", "reply_other_chat": "引用非本群消息", "blacklist": "黑名单账号",
         "not_in_required_group": "未加入指定群组",
         "normal": "正常消息", "ai_trigger": "霜刃 AI 唤醒",
     }
@@ -4533,109 +4946,6 @@ async def _job_delete_handoff_frost(context: ContextTypes.DEFAULT_TYPE):
         traceback.print_exc()
 
 
-PENDING_KEYWORD_CONFIRM_TIMEOUT = 120  # 关键词已存在确认按钮 120 秒超时
-
-
-def _cleanup_pending_keyword_confirm():
-    """清理超时的 pending_keyword_confirm 条目"""
-    global pending_keyword_confirm
-    now = time.time()
-    cutoff = now - PENDING_KEYWORD_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_keyword_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_keyword_confirm.pop(k, None)
-
-
-def _cleanup_pending_limit_confirm():
-    """清理超时的 pending_limit_confirm 条目"""
-    global pending_limit_confirm
-    now = time.time()
-    cutoff = now - PENDING_LIMIT_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_limit_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_limit_confirm.pop(k, None)
-
-
-def _cleanup_pending_face_confirm():
-    """清理超时的 pending_face_confirm 条目"""
-    global pending_face_confirm
-    now = time.time()
-    cutoff = now - PENDING_KEYWORD_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_face_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_face_confirm.pop(k, None)
-
-
-def _cleanup_pending_verify_confirm():
-    """清理超时的 pending_verify_confirm 条目"""
-    global pending_verify_confirm
-    now = time.time()
-    cutoff = now - PENDING_KEYWORD_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_verify_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_verify_confirm.pop(k, None)
-
-
-def _cleanup_pending_wl_confirm():
-    """清理超时的 pending_wl_confirm 条目"""
-    global pending_wl_confirm
-    now = time.time()
-    cutoff = now - PENDING_KEYWORD_CONFIRM_TIMEOUT
-    to_pop = [k for k, v in pending_wl_confirm.items() if (v.get("ts") or 0) <= cutoff]
-    for k in to_pop:
-        pending_wl_confirm.pop(k, None)
-
-
-async def _job_cleanup_pending_keyword_confirm(context: ContextTypes.DEFAULT_TYPE):
-    """定时清理超时的各类 pending_confirm"""
-    _cleanup_pending_keyword_confirm()
-    _cleanup_pending_limit_confirm()
-    _cleanup_pending_addcp_confirm()
-    _cleanup_pending_face_confirm()
-    _cleanup_pending_verify_confirm()
-    _cleanup_pending_wl_confirm()
-
-
-async def _job_cleanup_bgroup_merge(context: ContextTypes.DEFAULT_TYPE):
-    """兜底：定时检查 B 群合并消息，超时未删则补删（应对 create_task 丢失、异常等）"""
-    global _bgroup_merge_state
-    bot = context.bot
-    now = time.time()
-    cutoff = now - _get_required_group_msg_delete_after() - 5  # 留 5s 缓冲
-    to_clean = []
-    for chat_id_str, state in list(_bgroup_merge_state.items()):
-        ts = state.get("ts") or 0
-        if ts <= cutoff:
-            to_clean.append((chat_id_str, state.get("msg_id")))
-    for chat_id_str, msg_id in to_clean:
-        if msg_id is not None:
-            ok = await _delete_message_with_retry(bot, int(chat_id_str), msg_id, "bgroup_merge", retries=2, hit_type="bgroup")
-            if ok:
-                print(f"[PTB] B群合并兜底删除: chat_id={chat_id_str} msg_id={msg_id}")
-        if _bgroup_merge_state.get(chat_id_str, {}).get("msg_id") == msg_id:
-            _bgroup_merge_state.pop(chat_id_str, None)
-
-
-async def _job_cleanup_verify_merge(context: ContextTypes.DEFAULT_TYPE):
-    """兜底：定时检查人机验证合并消息，超时未删则补删"""
-    global _verify_merge_state
-    bot = context.bot
-    now = time.time()
-    cutoff = now - _get_verify_msg_delete_after() - 5
-    to_clean = []
-    for chat_id_str, state in list(_verify_merge_state.items()):
-        ts = state.get("ts") or 0
-        if ts <= cutoff:
-            to_clean.append((chat_id_str, state.get("msg_id")))
-    for chat_id_str, msg_id in to_clean:
-        if msg_id is not None:
-            ok = await _delete_message_with_retry(bot, int(chat_id_str), msg_id, "verify_merge", retries=2, hit_type="verify_other")
-            if ok:
-                print(f"[PTB] 人机验证合并兜底删除: chat_id={chat_id_str} msg_id={msg_id}")
-        if _verify_merge_state.get(chat_id_str, {}).get("msg_id") == msg_id:
-            _verify_merge_state.pop(chat_id_str, None)
-
-
 def _write_delete_stats_sync():
     """同步写入删除统计到文件，供 run_in_executor 调用，避免阻塞事件循环。统一写入 delete_stats.json，最新记录在文件最上方。"""
     stats = get_delete_stats()
@@ -4671,6 +4981,11 @@ def _write_delete_stats_sync():
         "total_deleted": total_del,
         "pending_queue_len": pending_len,
         "persist_queue_len": persist_len,
+        "scheduled_len": get_scheduled_len(),
+        "ttl_maps": get_ttl_stats(),
+        "gender_pool": _get_gender_pool().stats() if _FACE_GENDER_AVAILABLE else None,
+        "image_hash_blacklist": len(_image_hash_index) if _image_hash_index is not None else None,
+        "text_lsh": _text_lsh.stats(),
         "persist_retry_success": stats.get("persist_retry_success", 0),
         "persist_retry_fail": stats.get("persist_retry_fail", 0),
     }
@@ -4795,6 +5110,11 @@ def _ptb_main():
     load_verification_failures()
     load_verification_blacklist()
     load_verification_records()
+    _load_avatar_gender_cache()
+    _load_image_hash_blacklist()
+    _load_text_lsh_from_log()
+    if _FACE_GENDER_AVAILABLE:
+        _get_gender_pool().start()  # 推理线程启动即加载并预热模型，不等到首次命中
 
     app = Application.builder().token(BOT_TOKEN).post_init(_post_init_send_hello).build()
     globals()["_ptb_app"] = app
@@ -4832,6 +5152,7 @@ def _ptb_main():
     app.add_handler(CommandHandler("add_name", cmd_add_name, _admin_private))
     app.add_handler(CommandHandler("addcp", cmd_addcp, _admin_private))
     app.add_handler(CommandHandler("add_bio", cmd_add_bio, _admin_private))
+    app.add_handler(CommandHandler("add_image", cmd_add_image, _admin_private))
     app.add_handler(CommandHandler("settime", cmd_settime, _admin_private))
     app.add_handler(CommandHandler("add_group", cmd_add_group, _admin_private))
     app.add_handler(CommandHandler("search", cmd_search, _admin_private))
@@ -4847,20 +5168,23 @@ def _ptb_main():
     app.add_handler(CallbackQueryHandler(callback_keyword_confirm, pattern="^kw_confirm:"))
     app.add_handler(CallbackQueryHandler(callback_addcp_confirm, pattern="^addcp_confirm:"))
     app.add_handler(CallbackQueryHandler(callback_face_confirm, pattern="^face_confirm:"))
+    app.add_handler(CallbackQueryHandler(callback_image_confirm, pattern="^img_confirm:"))
     app.add_handler(CallbackQueryHandler(callback_verify_confirm, pattern="^verify_confirm:"))
     app.add_handler(CallbackQueryHandler(callback_wl_confirm, pattern="^wl_confirm:"))
 
+    n_sched = load_scheduled_deletes()
+    if n_sched:
+        print(f"[PTB] 已恢复定时删除 {n_sched} 条（过期的将立即执行）")
     jq = app.job_queue
     if jq:
         jq.run_repeating(_job_frost_reply, interval=2, first=2)
         jq.run_repeating(_job_delete_handoff_frost, interval=2, first=2)  # 方案 C：小助理失败兜底
-        jq.run_repeating(_job_cleanup_pending_keyword_confirm, interval=60, first=60)  # 每 60 秒清理超时确认
-        jq.run_repeating(_job_cleanup_bgroup_merge, interval=45, first=45)  # 每 45 秒兜底检查 B 群合并消息
-        jq.run_repeating(_job_cleanup_verify_merge, interval=45, first=45)  # 每 45 秒兜底检查人机验证合并消息
+        jq.run_repeating(_job_run_scheduled_deletes, interval=1, first=1)  # 每秒执行到期的定时删除（持久化，重启后继续）
         jq.run_repeating(job_retry_pending_deletes, interval=120, first=120)  # 每 2 分钟兜底重试待删队列（无新消息群）
         jq.run_daily(_job_lottery_sync, time=dt_time(20, 0))  # 20:00 UTC = 北京时间凌晨 4 点
         jq.run_repeating(_job_delete_stats, interval=21600, first=21600)  # 每 6 小时输出删除统计到 debug/
-        print("[PTB] 定时任务已注册：抽奖同步 每日 20:00 UTC；关键词确认清理 每 60 秒；B群合并兜底 每 45 秒；待删队列兜底 每 2 分钟；删除统计 每 6 小时")
+        jq.run_repeating(_job_save_avatar_gender_cache, interval=300, first=300)  # 头像性别缓存有变更时每 5 分钟落盘
+        print("[PTB] 定时任务已注册：抽奖同步 每日 20:00 UTC；定时删除 每秒；待删队列兜底 每 2 分钟；删除统计 每 6 小时；头像性别缓存落盘 每 5 分钟")
     else:
         print("[PTB] ⚠️ job_queue 为 None，定时任务未注册。请执行: pip install 'python-telegram-bot[job-queue]'")
 
@@ -4870,6 +5194,8 @@ def _ptb_main():
 
 def stop_bytecler():
     """停止霜刃 PTB（供 main.py Ctrl+C 时优雅退出）"""
+    _save_avatar_gender_cache()
+    flush_scheduled_log()
     app_ref = globals().get("_ptb_app")
     if app_ref:
         try:
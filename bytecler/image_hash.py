@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片感知哈希黑名单（广告图片/贴纸/头像的小改动复用识别）
+- 指纹：pHash（32x32 灰度 DCT 低频 8x8，与中位数比较）+ dHash（9x8 相邻像素差），各 64 位
+- 索引：pHash 多段索引（multi-index hashing）——64 位切成 radius+1 段，两哈希距离 <= radius 时
+  至少有一段完全相同（抽屉原理），查询只需 radius+1 次字典查找 + 少量候选的 popcount，与黑名单规模基本无关
+- 候选再用 dHash 距离复核，减少纯色/渐变类图片的误命中；几乎全 0/全 1 的退化哈希不入库也不匹配
+依赖：opencv-python、numpy（与 tgface 相同）
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+_DEGENERATE_MIN_BITS = 4  # 置位数 < 4 或 > 60 视为退化哈希（纯色、几乎无纹理）
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def dhash(gray: np.ndarray) -> int:
+    """差值哈希：缩放到 9x8，每行相邻像素比较"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray: np.ndarray) -> int:
+    """感知哈希：缩放到 32x32 做 DCT，取左上 8x8 低频与其中位数（不含直流分量）比较"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    median = np.median(low.flatten()[1:])
+    return _bits_to_int(low > median)
+
+
+def hash_image_bytes(data: bytes | bytearray) -> Optional[Tuple[int, int]]:
+    """图片字节 → (phash, dhash)；无法解码或哈希退化时返回 None"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    gray = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+    if gray is None or gray.size == 0:
+        return None
+    ph = phash(gray)
+    if is_degenerate(ph):
+        return None
+    return ph, dhash(gray)
+
+
+def is_degenerate(h: int) -> bool:
+    n = h.bit_count()
+    return n < _DEGENERATE_MIN_BITS or n > HASH_BITS - _DEGENERATE_MIN_BITS
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_hex(h: int) -> str:
+    return f"{h:016x}"
+
+
+def from_hex(s: str) -> int:
+    return int(s, 16)
+
+
+class ImageHashIndex:
+    """
+    radius: pHash 汉明距离阈值（<= radius 视为同一张图），决定分段数 radius+1；
+            半径越大每段越短、候选越多（5 万条时 radius=4 单次约几十微秒，radius=6 约十倍）
+    dhash_max: 候选复核时 dHash 距离上限
+    条目 meta 为任意可 JSON 序列化的 dict（添加人、时间、备注等），同一 pHash 只保留一条
+    """
+
+    def __init__(self, radius: int = 4, dhash_max: int = 10):
+        self.radius = max(0, min(radius, 15))
+        self.dhash_max = dhash_max
+        segments = self.radius + 1
+        # 各段 (起始位, 位数)：64 位尽量均分
+        base, extra = divmod(HASH_BITS, segments)
+        self._segments: List[Tuple[int, int]] = []
+        shift = 0
+        for i in range(segments):
+            width = base + (1 if i < extra else 0)
+            self._segments.append((shift, width))
+            shift += width
+        self._tables: List[Dict[int, set]] = [{} for _ in self._segments]
+        self._entries: Dict[int, Tuple[int, Dict[str, Any]]] = {}  # phash -> (dhash, meta)
+        self._lock = threading.Lock()
+
+    def _keys(self, h: int) -> List[int]:
+        return [(h >> shift) & ((1 << width) - 1) for shift, width in self._segments]
+
+    def add(self, ph: int, dh: int, meta: Optional[Dict[str, Any]] = None) -> bool:
+        """加入黑名单，已存在（pHash 相同）返回 False"""
+        with self._lock:
+            if ph in self._entries:
+                return False
+            self._entries[ph] = (dh, meta or {})
+            for table, key in zip(self._tables, self._keys(ph)):
+                table.setdefault(key, set()).add(ph)
+            return True
+
+    def remove(self, ph: int) -> bool:
+        with self._lock:
+            if self._entries.pop(ph, None) is None:
+                return False
+            for table, key in zip(self._tables, self._keys(ph)):
+                bucket = table.get(key)
+                if bucket is not None:
+                    bucket.discard(ph)
+                    if not bucket:
+                        del table[key]
+            return True
+
+    def match(self, ph: int, dh: int) -> Optional[Tuple[int, int, Dict[str, Any]]]:
+        """最近的命中条目 (phash, 距离, meta)，无命中返回 None"""
+        if is_degenerate(ph):
+            return None
+        best: Optional[Tuple[int, int, Dict[str, Any]]] = None
+        with self._lock:
+            seen = set()
+            for table, key in zip(self._tables, self._keys(ph)):
+                for cand in table.get(key, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    dist = hamming(ph, cand)
+                    if dist > self.radius or (best and dist >= best[1]):
+                        continue
+                    cand_dh, meta = self._entries[cand]
+                    if hamming(dh, cand_dh) > self.dhash_max:
+                        continue
+                    best = (cand, dist, meta)
+        return best
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """持久化用：[{"phash": hex, "dhash": hex, ...meta}, ...]"""
+        with self._lock:
+            return [{"phash": to_hex(ph), "dhash": to_hex(dh), **meta} for ph, (dh, meta) in self._entries.items()]
+
+    def load(self, entries: List[Dict[str, Any]]) -> int:
+        """从 dump() 的结果恢复（先清空），返回条目数"""
+        self.clear()
+        for e in entries:
+            try:
+                ph, dh = from_hex(e["phash"]), from_hex(e["dhash"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.add(ph, dh, {k: v for k, v in e.items() if k not in ("phash", "dhash")})
+        return len(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -3,11 +3,15 @@
 """
 消息删除模块（可复用）
 保证所有需删消息最终都能删除：立即删除 + 重试 → 入队 → 持久化溢出 → 永不放弃重试
+定时删除：最小堆 + 追加日志持久化（内存缓冲，每秒随调度 tick 在线程中批量写入、按需压缩），重启后重新加载，到期批量执行
 依赖：python-telegram-bot
 """
 import asyncio
+import heapq
+import itertools
 import json
 import os
+import threading
 import time
 from datetime import datetime, timezone
 from pathlib import Path
@@ -23,6 +27,10 @@ PENDING_DELETE_PERSIST_BATCH = int(os.getenv("PENDING_DELETE_PERSIST_BATCH", "30
 _BASE = Path(__file__).resolve().parent
 PENDING_DELETE_PERSIST_PATH = Path(os.getenv("PENDING_DELETE_PERSIST_PATH", str(_BASE / "pending_delete_persist.jsonl")))
 
+# 定时删除调度：追加日志（add/done），done 累计超过阈值时压缩重写
+SCHEDULED_DELETE_PATH = Path(os.getenv("SCHEDULED_DELETE_PATH", str(_BASE / "scheduled_deletes.jsonl")))
+SCHEDULED_DELETE_COMPACT_EVERY = int(os.getenv("SCHEDULED_DELETE_COMPACT_EVERY", "500"))
+
 # 删除事件埋点配置
 DELETE_EVENTS_ENABLED = os.getenv("DELETE_EVENTS_ENABLED", "1") == "1"
 DELETE_EVENTS_PATH = Path(os.getenv("DELETE_EVENTS_PATH", str(_BASE / "debug" / "delete_events.jsonl")))
@@ -365,6 +373,175 @@ async def job_retry_pending_deletes(context: Any) -> None:
     _cleanup_old_event_files()
 
 
+# ==================== 定时删除调度 ====================
+# 替代每条消息一个 sleep 任务：所有未来删除进同一个最小堆，每次 tick 取出到期项批量执行
+_sched_heap: List[Tuple[float, int]] = []  # (due_ts, entry_id)
+_sched_items: Dict[int, Dict[str, Any]] = {}  # entry_id -> {chat_id, msg_id, due, label, kind, user_msg_id, user_id}
+_sched_ids = itertools.count(1)
+_sched_inflight: Dict[int, Dict[str, Any]] = {}  # 已出堆、正在执行尚未 finish 的项，压缩时仍须保留
+_sched_done_since_compact = 0
+_sched_compact_due = False
+# 待写入日志的行：事件循环里只追加到内存，由定时任务取走后在线程中批量落盘（进程崩溃最多丢失约 1 秒的记录）
+_sched_buf: List[str] = []
+_sched_file_lock = threading.Lock()  # 串行化线程中的日志写入（事件循环不持有此锁）
+
+
+def _sched_log(record: Dict[str, Any]) -> None:
+    _sched_buf.append(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _sched_take() -> Tuple[Optional[List[str]], List[str]]:
+    """
+    在事件循环中取走待写内容：(压缩快照, 缓冲行)。到了压缩阈值时快照为当前未完成项（含执行中的）的 add 行，
+    否则为 None；缓冲行始终取走，快照写入失败时改为追加它们
+    """
+    global _sched_compact_due, _sched_done_since_compact
+    snapshot = None
+    if _sched_compact_due:
+        live = {**_sched_items, **_sched_inflight}
+        snapshot = [json.dumps({"op": "add", "id": eid, **item}, ensure_ascii=False) + "\n" for eid, item in live.items()]
+        _sched_compact_due = False
+        _sched_done_since_compact = 0
+    lines = _sched_buf[:]
+    _sched_buf.clear()
+    return snapshot, lines
+
+
+def _sched_write(snapshot: Optional[List[str]], lines: List[str]) -> None:
+    """在线程中落盘：有快照时整体重写（快照已包含缓冲行的效果），否则或重写失败时追加缓冲行"""
+    with _sched_file_lock:
+        SCHEDULED_DELETE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        if snapshot is not None:
+            try:
+                tmp = SCHEDULED_DELETE_PATH.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write("".join(snapshot))
+                os.replace(tmp, SCHEDULED_DELETE_PATH)
+                return
+            except Exception as e:
+                print(f"[PTB] 定时删除日志压缩失败: {e}")
+        if not lines:
+            return
+        try:
+            with open(SCHEDULED_DELETE_PATH, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        except Exception as e:
+            print(f"[PTB] 定时删除持久化失败: {e}")
+
+
+async def flush_scheduled_log_async() -> None:
+    """定时任务调用：在事件循环中取走缓冲（及压缩快照），在线程中写入"""
+    snapshot, lines = _sched_take()
+    if snapshot is not None or lines:
+        await asyncio.to_thread(_sched_write, snapshot, lines)
+
+
+def flush_scheduled_log() -> None:
+    """同步落盘（启动加载后、退出时调用）"""
+    _sched_write(*_sched_take())
+
+
+def schedule_delete(
+    chat_id: Any,
+    msg_id: int,
+    delay: float,
+    label: str = "bot_msg",
+    kind: str = "",
+    user_msg_id: Optional[int] = None,
+    user_id: int = 0,
+) -> int:
+    """安排 delay 秒后删除 msg_id（若有 user_msg_id 先删用户消息）。O(log n) 入堆并记入持久化缓冲，返回 entry_id"""
+    eid = next(_sched_ids)
+    item = {
+        "chat_id": str(chat_id), "msg_id": msg_id, "due": time.time() + max(0.0, delay),
+        "label": label, "kind": kind, "user_msg_id": user_msg_id, "user_id": user_id,
+    }
+    _sched_items[eid] = item
+    heapq.heappush(_sched_heap, (item["due"], eid))
+    _sched_log({"op": "add", "id": eid, **item})
+    return eid
+
+
+def cancel_scheduled_delete(entry_id: Optional[int]) -> bool:
+    """取消尚未执行的定时删除（如合并消息被替换后旧消息已删除）。堆中残留项在出堆时跳过"""
+    if entry_id is None or _sched_items.pop(entry_id, None) is None:
+        return False
+    _mark_done([entry_id])
+    return True
+
+
+def _mark_done(entry_ids: List[int]) -> None:
+    global _sched_done_since_compact, _sched_compact_due
+    for eid in entry_ids:
+        _sched_log({"op": "done", "id": eid})
+    _sched_done_since_compact += len(entry_ids)
+    if _sched_done_since_compact >= SCHEDULED_DELETE_COMPACT_EVERY:
+        _sched_compact_due = True  # 下次落盘时在线程中压缩
+
+
+def pop_due_deletes(now: Optional[float] = None) -> List[Tuple[int, Dict[str, Any]]]:
+    """取出所有已到期项 [(entry_id, item)]，调用方执行后须调用 finish_scheduled_deletes"""
+    now = time.time() if now is None else now
+    due: List[Tuple[int, Dict[str, Any]]] = []
+    while _sched_heap and _sched_heap[0][0] <= now:
+        _, eid = heapq.heappop(_sched_heap)
+        item = _sched_items.pop(eid, None)
+        if item is not None:
+            _sched_inflight[eid] = item
+            due.append((eid, item))
+    return due
+
+
+def finish_scheduled_deletes(entry_ids: List[int]) -> None:
+    """执行完毕（无论成败，失败已由 delete_message_with_retry 转入待重试队列）后记 done"""
+    for eid in entry_ids:
+        _sched_inflight.pop(eid, None)
+    if entry_ids:
+        _mark_done(entry_ids)
+
+
+def load_scheduled_deletes() -> int:
+    """启动时从日志重建堆：add 且未 done 的项重新入堆，已过期的在下次 tick 立即执行。返回加载条数"""
+    global _sched_ids, _sched_compact_due
+    if not SCHEDULED_DELETE_PATH.exists():
+        return 0
+    items: Dict[int, Dict[str, Any]] = {}
+    max_id = 0
+    try:
+        with open(SCHEDULED_DELETE_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    d = json.loads(line)
+                    eid = int(d["id"])
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    continue
+                max_id = max(max_id, eid)
+                if d.get("op") == "done":
+                    items.pop(eid, None)
+                elif d.get("op") == "add":
+                    items[eid] = {k: d.get(k) for k in ("chat_id", "msg_id", "due", "label", "kind", "user_msg_id", "user_id")}
+    except Exception as e:
+        print(f"[PTB] 加载定时删除失败: {e}")
+        return 0
+    _sched_items.clear()
+    _sched_inflight.clear()
+    _sched_items.update(items)
+    _sched_heap[:] = [(float(item["due"] or 0), eid) for eid, item in items.items()]
+    heapq.heapify(_sched_heap)
+    _sched_ids = itertools.count(max_id + 1)
+    _sched_compact_due = True
+    flush_scheduled_log()  # 启动时同步压缩一次
+    return len(items)
+
+
+def get_scheduled_len() -> int:
+    """获取定时删除待执行数"""
+    return len(_sched_items)
+
+
 def get_stats() -> Dict[str, int]:
     """获取删除统计"""
     return dict(_delete_stats)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近似重复文案检测（MinHash + LSH）：识别打乱字符、插空格/符号、替换个别词的广告变体
+- 归一化：NFKC（全角转半角等）、转小写、只保留文字与数字，去掉空格/标点/表情
+- 指纹：字符 k-gram 集合的 MinHash 签名，单次哈希分桶（one permutation hashing）+ 空桶向后借值，
+  每条消息只对每个 k-gram 算一次哈希，O(文本长度)
+- 索引：签名分 bands 段，每段一张哈希表；查询只看同段相同的候选，再用签名估计 Jaccard 相似度复核
+- 条目数有上限、按写入时间过期，队头淘汰；近似重复的文案并入已有条目（hits+1），不重复占用
+"""
+import hashlib
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+_MASK64 = (1 << 64) - 1
+_DENSIFY_MIX = 0x9E3779B97F4A7C15
+# 每次写入时最多顺带清理的队头过期条目数
+_EXPIRE_PER_WRITE = 4
+
+
+def normalize_text(text: str) -> str:
+    """NFKC + 小写，只保留文字（L*）与数字（N*）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] in ("L", "N"))
+
+
+def shingles(norm: str, k: int) -> set:
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHashLSH:
+    """
+    num_perm: 签名长度（桶数），bands * rows 须等于 num_perm
+    bands: LSH 段数；相似度阈值约为 (1/bands)^(1/rows)，默认 16x4 约 0.5，再以 threshold 复核
+    threshold: 估计 Jaccard 相似度 >= threshold 视为命中
+    shingle: 字符 k-gram 的 k（中文短文案取 2）
+    min_chars: 归一化后不足此长度的文案不入库也不查询（太短的话术撞车概率高）
+    max_docs / ttl: 条目上限与存活秒数
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.6, shingle: int = 2,
+                 min_chars: int = 8, max_docs: int = 10000, ttl: float = 7 * 86400):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle = max(1, shingle)
+        self.min_chars = min_chars
+        self.max_docs = max(1, max_docs)
+        self.ttl = ttl
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        # doc_id -> [过期时间, 签名, meta]，按写入顺序排列，队头最旧
+        self._docs: "OrderedDict[int, list]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.matches = 0
+        self.merged = 0
+        self.evicted = 0
+
+    def signature(self, text: str) -> Optional[array]:
+        """文案 → MinHash 签名（array('Q')）；归一化后过短返回 None"""
+        norm = normalize_text(text)
+        if len(norm) < self.min_chars:
+            return None
+        n = self.num_perm
+        bins: List[Optional[int]] = [None] * n
+        for g in shingles(norm, self.shingle):
+            h = _hash64(g)
+            b, v = h % n, h // n
+            cur = bins[b]
+            if cur is None or v < cur:
+                bins[b] = v
+        # 空桶向右（循环）借最近的非空桶值，并按距离混淆，保证相同集合得到相同签名
+        sig = array("Q", [0] * n)
+        for i in range(n):
+            if bins[i] is not None:
+                sig[i] = bins[i]
+                continue
+            for d in range(1, n):
+                j = (i + d) % n
+                if bins[j] is not None:
+                    sig[i] = (bins[j] ^ (d * _DENSIFY_MIX)) & _MASK64
+                    break
+        return sig
+
+    def _band_keys(self, sig: array) -> List[int]:
+        r = self.rows
+        return [hash(tuple(sig[i * r:(i + 1) * r])) for i in range(self.bands)]
+
+    def _similarity(self, a: array, b: array) -> float:
+        return sum(1 for x, y in zip(a, b) if x == y) / self.num_perm
+
+    def _drop(self, doc_id: int) -> None:
+        """删除条目及其各段索引（需持有锁）"""
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for table, key in zip(self._tables, self._band_keys(doc[1])):
+            ids = table.get(key)
+            if ids is None:
+                continue
+            try:
+                ids.remove(doc_id)
+            except ValueError:
+                pass
+            if not ids:
+                del table[key]
+
+    def _expire_head(self, now: float, limit: int) -> None:
+        for _ in range(limit):
+            if not self._docs:
+                return
+            doc_id, doc = next(iter(self._docs.items()))
+            if doc[0] > now:
+                return
+            self._drop(doc_id)
+
+    def _best(self, sig: array, now: float) -> Optional[Tuple[int, float]]:
+        """同段候选中相似度最高且 >= threshold 的 (doc_id, 相似度)（需持有锁）"""
+        best: Optional[Tuple[int, float]] = None
+        seen = set()
+        for table, key in zip(self._tables, self._band_keys(sig)):
+            for doc_id in table.get(key, ()):
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                doc = self._docs.get(doc_id)
+                if doc is None or doc[0] <= now:
+                    continue
+                sim = self._similarity(sig, doc[1])
+                if sim >= self.threshold and (best is None or sim > best[1]):
+                    best = (doc_id, sim)
+        return best
+
+    def add(self, text: str, meta: Optional[Dict[str, Any]] = None, ttl: Optional[float] = None) -> bool:
+        """加入一条广告文案；已有近似条目时并入（hits+1、续期）返回 False，新建条目返回 True，过短也返回 False"""
+        sig = self.signature(text)
+        if sig is None:
+            return False
+        now = time.time()
+        expire_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._expire_head(now, _EXPIRE_PER_WRITE)
+            hit = self._best(sig, now)
+            if hit:
+                doc = self._docs[hit[0]]
+                doc[0] = max(doc[0], expire_at)
+                doc[2]["hits"] = doc[2].get("hits", 1) + 1
+                self._docs.move_to_end(hit[0])
+                self.merged += 1
+                return False
+            doc_id = self._next_id
+            self._next_id += 1
+            self._docs[doc_id] = [expire_at, sig, dict(meta or {}, hits=1)]
+            for table, key in zip(self._tables, self._band_keys(sig)):
+                table.setdefault(key, []).append(doc_id)
+            while len(self._docs) > self.max_docs:
+                self._drop(next(iter(self._docs)))
+                self.evicted += 1
+            return True
+
+    def query(self, text: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """与已知广告文案近似时返回 (估计相似度, meta)，否则 None"""
+        sig = self.signature(text)
+        if sig is None:
+            return None
+        now = time.time()
+        with self._lock:
+            self.queries += 1
+            hit = self._best(sig, now)
+            if hit is None:
+                return None
+            self.matches += 1
+            return hit[1], dict(self._docs[hit[0]][2])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs.clear()
+            for table in self._tables:
+                table.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "docs": len(self._docs),
+                "max_docs": self.max_docs,
+                "queries": self.queries,
+                "matches": self.matches,
+                "merged": self.merged,
+                "evicted": self.evicted,
+            }
+
+    def __len__(self) -> int:
+        return len(self._docs)
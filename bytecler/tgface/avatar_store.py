@@ -0,0 +1,113 @@
+"""头像存储索引 - 内存索引 user_id -> (路径, 判定, 修改时间) + 分片子目录
+
+- 启动时扫描一次 STORAGE_PATH 重建索引（兼容旧的平铺文件：移入分片目录，同一用户多张只留最新）
+- 之后每条消息只查内存索引，O(1)，不再 glob 整个目录
+- 文件路径：STORAGE_PATH/<user_id % 256 的两位十六进制>/<性别前缀>_<user_id>.jpg
+"""
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+SHARD_COUNT = 256
+# 判定结果 -> 文件名前缀
+PREFIX_MAP = {"male": "男性", "female": "女性", "other": "其他", "failure": "失败"}
+_VERDICT_BY_PREFIX = {v: k for k, v in PREFIX_MAP.items()}
+_NAME_RE = re.compile(r"^(?P<prefix>[^_]+)_(?P<uid>-?\d+)\.jpg$")
+_SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+
+
+class AvatarEntry(NamedTuple):
+    path: Path
+    verdict: str  # male / female / other / failure
+    mtime: float
+
+
+def shard_dir(root: Path, user_id: int) -> Path:
+    return root / f"{user_id % SHARD_COUNT:02x}"
+
+
+class AvatarStore:
+    def __init__(self, root: Path):
+        self.root = root
+        self._index: dict[int, AvatarEntry] = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, directory: Path, found: dict[int, list[AvatarEntry]]) -> None:
+        with os.scandir(directory) as it:
+            for e in it:
+                m = _NAME_RE.match(e.name)
+                if not m or m.group("prefix") not in _VERDICT_BY_PREFIX or not e.is_file():
+                    continue
+                entry = AvatarEntry(Path(e.path), _VERDICT_BY_PREFIX[m.group("prefix")], e.stat().st_mtime)
+                found.setdefault(int(m.group("uid")), []).append(entry)
+
+    def rebuild(self) -> int:
+        """扫描存储目录重建索引（启动时调用一次），返回索引中的用户数"""
+        started = time.perf_counter()
+        found: dict[int, list[AvatarEntry]] = {}
+        self._scan(self.root, found)  # 旧版平铺文件
+        for d in self.root.iterdir():
+            if d.is_dir() and _SHARD_RE.match(d.name):
+                self._scan(d, found)
+        index: dict[int, AvatarEntry] = {}
+        moved = removed = 0
+        for user_id, entries in found.items():
+            entries.sort(key=lambda x: x.mtime, reverse=True)
+            for stale in entries[1:]:
+                try:
+                    stale.path.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"删除重复头像失败 {stale.path}: {e}")
+            latest = entries[0]
+            target_dir = shard_dir(self.root, user_id)
+            if latest.path.parent != target_dir:
+                target_dir.mkdir(exist_ok=True)
+                target = target_dir / latest.path.name
+                try:
+                    os.replace(latest.path, target)
+                    latest = latest._replace(path=target)
+                    moved += 1
+                except OSError as e:
+                    logger.warning(f"头像移入分片目录失败 {latest.path}: {e}")
+            index[user_id] = latest
+        with self._lock:
+            self._index = index
+        logger.info(
+            f"头像索引已重建：{len(index)} 个用户，迁移 {moved}，清理重复 {removed}，"
+            f"耗时 {time.perf_counter() - started:.2f}s"
+        )
+        return len(index)
+
+    def get(self, user_id: int) -> AvatarEntry | None:
+        with self._lock:
+            return self._index.get(user_id)
+
+    def save(self, user_id: int, verdict: str, data: bytes | bytearray) -> Path:
+        """写入用户头像（先写临时文件再替换），删除旧判定的文件并更新索引"""
+        verdict = verdict if verdict in PREFIX_MAP else "failure"
+        target_dir = shard_dir(self.root, user_id)
+        target_dir.mkdir(exist_ok=True)
+        path = target_dir / f"{PREFIX_MAP[verdict]}_{user_id}.jpg"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._index.get(user_id)
+            self._index[user_id] = AvatarEntry(path, verdict, time.time())
+        if old and old.path != path:
+            try:
+                old.path.unlink(missing_ok=True)
+                logger.debug(f"已删除旧头像: {old.path.name}")
+            except OSError as e:
+                logger.warning(f"删除旧头像失败 {old.path}: {e}")
+        return path
+
+    def __len__(self) -> int:
+        return len(self._index)
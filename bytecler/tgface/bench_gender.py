@@ -0,0 +1,235 @@
+"""头像性别检测基准：分阶段耗时、多线程吞吐、判定分布，输出可跨次对比的 JSON
+
+用法：
+    python bench_gender.py <图片目录> [--detectors haar,dnn] [--repeat 3] [--threads 1,2,4]
+                           [--json out.json] [--compare base.json] [--cv-threads 1] [--pool-window 5]
+
+- 分阶段：decode（imdecode）/ face（人脸检测）/ hog（无人脸时的人体检测）/ forward（性别网络前向），
+  以及整条流水线 total，各给出 p50/p95/p99/mean（毫秒）与该阶段实际执行次数
+- 检测器对比：各检测器的人脸检出率、HOG 回退率
+- 吞吐：N 个线程（线程内模型已预热，与推理池一致）并发跑完全部样本的张/秒，用于确定 GENDER_POOL_WORKERS
+- 推理池：--pool-window > 0 时用 GenderInferencePool 跑同样的样本，对比不合批与合批（窗口毫秒）的张/秒与平均批大小
+- 判定分布：male / female / other / failure 各占多少
+- --json 写出完整结果（"-" 为标准输出），--compare 与之前的 JSON 对比各阶段 p50/p95 与吞吐
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+
+import opencv_gender as og
+from gender_pool import GenderInferencePool
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+STAGES = ("decode", "face", "hog", "forward", "total")
+
+
+def load_images(directory: Path) -> list[tuple[str, bytes]]:
+    """读取目录下所有图片的原始字节（按文件名排序）"""
+    files = sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    return [(str(p.relative_to(directory)), p.read_bytes()) for p in files]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _summary(samples: list[float]) -> dict:
+    """秒 → 毫秒的分位数汇总"""
+    ms = [s * 1000 for s in samples]
+    return {
+        "count": len(ms),
+        "p50": round(percentile(ms, 50), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "mean": round(statistics.fmean(ms), 2) if ms else 0.0,
+    }
+
+
+def bench_stages(images: list, detector: str, repeat: int = 1) -> dict:
+    """单线程逐张跑完整流水线，统计各阶段耗时、人脸检出率、HOG 回退率与判定分布（取最后一遍）"""
+    og.warm_up(detector)
+    samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    verdicts: Counter = Counter()
+    faces_found = hog_fallback = 0
+    for _ in range(max(1, repeat)):
+        verdicts.clear()
+        faces_found = hog_fallback = 0
+        for _, data in images:
+            timings: dict = {}
+            started = time.perf_counter()
+            verdict = og.detect_gender_bytes(data, face_detector=detector, timings=timings)
+            timings["total"] = time.perf_counter() - started
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            verdicts[verdict] += 1
+            if "hog" in timings:
+                hog_fallback += 1
+            elif "face" in timings and "forward" in timings:
+                faces_found += 1
+    n = len(images)
+    return {
+        "images": n,
+        "detect_rate": round(faces_found / n, 4) if n else 0.0,
+        "hog_fallback_rate": round(hog_fallback / n, 4) if n else 0.0,
+        "stages_ms": {stage: _summary(samples[stage]) for stage in STAGES},
+        "verdicts": {v: verdicts.get(v, 0) for v in ("male", "female", "other", "failure")},
+    }
+
+
+def bench_throughput(images: list, detector: str, threads: int) -> dict:
+    """threads 个线程并发跑完全部样本，返回张/秒；线程内先预热，预热时间不计入"""
+    with ThreadPoolExecutor(max_workers=threads, initializer=og.warm_up, initargs=(detector,)) as ex:
+        list(ex.map(lambda _: None, range(threads)))  # 触发全部线程启动并完成预热
+        started = time.perf_counter()
+        list(ex.map(lambda item: og.detect_gender_bytes(item[1], face_detector=detector), images))
+        elapsed = time.perf_counter() - started
+    return {
+        "threads": threads,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(len(images) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def bench_pool(images: list, detector: str, workers: int, window_ms: float) -> dict:
+    """GenderInferencePool 一次性提交全部样本，返回张/秒与合批统计；window_ms=0 为不合批；预热不计入"""
+    og.FACE_DETECTOR = detector  # 推理池按模块配置选检测器
+    pool = GenderInferencePool(workers=workers, queue_size=len(images) + 1, timeout=600, batch_window_ms=window_ms)
+    pool.start()
+    pool.wait_ready()
+    pool.submit(images[0][1]).result()  # 合批线程也完成预热
+    before = pool.stats()["batching"] or {"batches": 0, "crops": 0}
+    started = time.perf_counter()
+    futures = [pool.submit(data) for _, data in images]
+    for f in futures:
+        f.result()
+    elapsed = time.perf_counter() - started
+    batching = pool.stats()["batching"]
+    return {
+        "workers": workers,
+        "window_ms": window_ms,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(len(images) / elapsed, 2) if elapsed > 0 else 0.0,
+        "batches": batching["batches"] - before["batches"] if batching else None,
+        "avg_batch": round((batching["crops"] - before["crops"]) / max(1, batching["batches"] - before["batches"]), 2)
+        if batching else None,
+    }
+
+
+def run(images: list, detectors: list[str], thread_counts: list[int], repeat: int,
+        pool_window_ms: float = 0) -> dict:
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "opencv": cv2.__version__,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "cv_threads": cv2.getNumThreads(),
+            "images": len(images),
+            "repeat": repeat,
+        },
+        "detectors": {},
+    }
+    for det in detectors:
+        result = bench_stages(images, det, repeat)
+        result["throughput"] = [bench_throughput(images, det, n) for n in thread_counts]
+        if pool_window_ms > 0:
+            result["pool"] = [bench_pool(images, det, n, w) for n in thread_counts for w in (0, pool_window_ms)]
+        report["detectors"][det] = result
+    return report
+
+
+def print_report(report: dict) -> None:
+    meta = report["meta"]
+    print(f"样本 {meta['images']} 张，重复 {meta['repeat']} 遍，OpenCV {meta['opencv']}，"
+          f"CPU {meta['cpu_count']}，cv 线程 {meta['cv_threads']}")
+    for det, r in report["detectors"].items():
+        print(f"\n== {det} ==  人脸检出率 {r['detect_rate']:.1%}  HOG 回退率 {r['hog_fallback_rate']:.1%}")
+        print(f"{'阶段':<10}{'次数':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}  (ms)")
+        for stage, s in r["stages_ms"].items():
+            print(f"{stage:<10}{s['count']:>8}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}{s['mean']:>10.2f}")
+        print("吞吐: " + "  ".join(f"{t['threads']} 线程 {t['images_per_sec']:.1f} 张/s" for t in r["throughput"]))
+        for p in r.get("pool", []):
+            mode = f"合批 {p['window_ms']:g}ms（平均 {p['avg_batch']} 张/批）" if p["window_ms"] else "不合批"
+            print(f"推理池 {p['workers']} 线程 {mode}: {p['images_per_sec']:.1f} 张/s")
+        print("判定: " + "  ".join(f"{v} {c}" for v, c in r["verdicts"].items()))
+
+
+def print_compare(report: dict, base: dict) -> None:
+    """与之前的结果对比：各阶段 p50/p95 与吞吐的变化（负数为变快）"""
+    print(f"\n对比基线（{base.get('meta', {}).get('time', '?')}）")
+    for det, r in report["detectors"].items():
+        b = base.get("detectors", {}).get(det)
+        if not b:
+            print(f"{det}: 基线中无此检测器")
+            continue
+        print(f"== {det} ==")
+        for stage, s in r["stages_ms"].items():
+            bs = b.get("stages_ms", {}).get(stage)
+            if not bs:
+                continue
+            print(f"{stage:<10}p50 {bs['p50']:.2f} → {s['p50']:.2f} ({_pct(bs['p50'], s['p50'])})  "
+                  f"p95 {bs['p95']:.2f} → {s['p95']:.2f} ({_pct(bs['p95'], s['p95'])})")
+        base_tp = {t["threads"]: t["images_per_sec"] for t in b.get("throughput", [])}
+        for t in r["throughput"]:
+            if t["threads"] in base_tp:
+                print(f"{t['threads']} 线程吞吐 {base_tp[t['threads']]:.1f} → {t['images_per_sec']:.1f} 张/s "
+                      f"({_pct(base_tp[t['threads']], t['images_per_sec'])})")
+
+
+def _pct(old: float, new: float) -> str:
+    return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="头像性别检测基准（分阶段耗时 / 吞吐 / 判定分布）")
+    parser.add_argument("images", type=Path, help="样本图片目录")
+    parser.add_argument("--detectors", default="haar,dnn", help="逗号分隔，可选 haar,dnn")
+    parser.add_argument("--repeat", type=int, default=1, help="分阶段计时重复遍数（全部样本都计入分位数）")
+    parser.add_argument("--threads", type=_int_list, default=[1, 2, 4], help="吞吐测试的线程数，逗号分隔")
+    parser.add_argument("--cv-threads", type=int, default=None, help="cv2.setNumThreads，默认不改")
+    parser.add_argument("--json", dest="json_out", default=None, help="结果写入 JSON 文件，- 为标准输出")
+    parser.add_argument("--compare", type=Path, default=None, help="与之前 --json 的结果对比")
+    parser.add_argument("--pool-window", type=float, default=0, help="> 0 时额外测推理池不合批/合批（毫秒）的吞吐")
+    args = parser.parse_args()
+
+    detectors = [d.strip() for d in args.detectors.split(",") if d.strip()]
+    bad = [d for d in detectors if d not in og.FACE_DETECTORS]
+    if bad:
+        sys.exit(f"未知检测器: {', '.join(bad)}（可选 {', '.join(og.FACE_DETECTORS)}）")
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"{args.images} 下没有图片")
+    if args.cv_threads is not None:
+        cv2.setNumThreads(args.cv_threads)
+
+    report = run(images, detectors, [n for n in args.threads if n > 0], args.repeat, args.pool_window)
+    if args.json_out == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"\n结果已写入 {args.json_out}")
+    if args.compare:
+        print_compare(report, json.loads(args.compare.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 """Telegram 机器人 - 群消息监听、头像下载、性别检测"""
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import time
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
 from telegram import Update
 from telegram.ext import Application, MessageHandler, filters, ContextTypes
 
-from config import BOT_TOKEN, ADMIN_IDS, STORAGE_PATH, LOG_PATH
-from opencv_gender import detect_gender
+from config import BOT_TOKEN, ADMIN_IDS, STORAGE_PATH, LOG_PATH, AVATAR_CONCURRENCY, AVATAR_MAX_PENDING, \
+    AVATAR_ARCHIVE_FULL_SIZE
+from avatar_store import AvatarEntry, AvatarStore
+from gender_pool import get_pool
+from opencv_gender import NO_FACE, pick_photo_sizes
 
 # 头像缓存时长（天）
 AVATAR_CACHE_DAYS = 1
@@ -35,38 +38,17 @@ file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logging.getLogger().addHandler(file_handler)
 
 
-def get_timestamp() -> str:
-    """获取当前时间戳字符串"""
-    return datetime.now().strftime("%Y%m%d_%H%M%S")
+# 头像索引（启动时重建一次，之后只查内存）
+avatar_store = AvatarStore(STORAGE_PATH)
+# 处理中/排队中的用户（同一用户只处理一次）与并发上限
+_inflight: set[int] = set()
+_tasks: set[asyncio.Task] = set()
+_semaphore = asyncio.Semaphore(max(1, AVATAR_CONCURRENCY))
 
 
-def _get_user_avatar_path(user_id: int) -> Path | None:
-    """查找用户已有的头像文件（格式：*_user_id.jpg）"""
-    suffix = f"_{user_id}.jpg"
-    for f in STORAGE_PATH.glob(f"*{suffix}"):
-        if f.name.startswith("temp_"):
-            continue
-        return f
-    return None
-
-
-def _is_avatar_cached(avatar_path: Path) -> bool:
+def _is_avatar_cached(entry: AvatarEntry) -> bool:
     """检查头像是否在缓存有效期内（1天）"""
-    mtime = datetime.fromtimestamp(avatar_path.stat().st_mtime)
-    return datetime.now() - mtime < timedelta(days=AVATAR_CACHE_DAYS)
-
-
-def _remove_old_avatars(user_id: int) -> None:
-    """删除该用户的所有旧头像"""
-    suffix = f"_{user_id}.jpg"
-    for f in STORAGE_PATH.glob(f"*{suffix}"):
-        if f.name.startswith("temp_"):
-            continue
-        try:
-            f.unlink()
-            logger.debug(f"已删除旧头像: {f.name}")
-        except OSError as e:
-            logger.warning(f"删除旧头像失败 {f}: {e}")
+    return time.time() - entry.mtime < AVATAR_CACHE_DAYS * 86400
 
 
 async def process_user_avatar(
@@ -82,38 +64,33 @@ async def process_user_avatar(
     bot = application.bot
     try:
         # 检查缓存：已有头像且在有效期内则跳过
-        existing = _get_user_avatar_path(user_id)
+        existing = avatar_store.get(user_id)
         if existing and _is_avatar_cached(existing):
             logger.debug(f"用户 {user_id} 头像已缓存，跳过")
-            return existing
+            return existing.path
 
         photos = await bot.get_user_profile_photos(user_id, limit=1)
         if not photos or not photos.photos:
             logger.info(f"用户 {user_id} 没有头像")
             return None
 
-        # 获取最大尺寸的头像
-        photo_sizes = photos.photos[0]
-        largest = max(photo_sizes, key=lambda p: p.width * p.height)
-        file = await bot.get_file(largest.file_id)
-
-        # 临时保存
-        timestamp = get_timestamp()
-        temp_path = STORAGE_PATH / f"temp_{user_id}_{timestamp}.jpg"
-        await file.download_to_drive(custom_path=str(temp_path))
-
-        # 调用 OpenCV DNN 本地检测性别
-        result = detect_gender(temp_path)
-        prefix_map = {"male": "男性", "female": "女性", "other": "其他", "failure": "失败"}
-        prefix = prefix_map.get(result, "失败")
-
-        # 每个用户固定一个文件名，覆盖旧头像
-        final_name = f"{prefix}_{user_id}.jpg"
-        final_path = STORAGE_PATH / final_name
-        _remove_old_avatars(user_id)
-        temp_path.rename(final_path)
-
-        logger.info(f"已保存: {final_path} (用户 {user_id}, 性别: {prefix})")
+        # 从满足最小分辨率的最小尺寸开始检测，未检出人脸再换大一档、最后跳到最大尺寸；最后一档走完整流程（含人体检测）
+        candidates = pick_photo_sizes(photos.photos[0])
+        for i, size in enumerate(candidates):
+            file = await bot.get_file(size.file_id)
+            # 下载到内存，直接解码检测，不写临时文件
+            data = await file.download_as_bytearray()
+            # 调用 OpenCV DNN 本地检测性别（专用推理池，不阻塞事件循环）
+            result = await get_pool().detect(data, face_only=i < len(candidates) - 1)
+            if result != NO_FACE:
+                break
+        # 默认存档检测用的那一档；显式开启 AVATAR_ARCHIVE_FULL_SIZE 时才再下载一次最大尺寸
+        if AVATAR_ARCHIVE_FULL_SIZE and size is not candidates[-1]:
+            data = await (await bot.get_file(candidates[-1].file_id)).download_as_bytearray()
+        # 每个用户只保留一张头像（分片目录下），检测完成后只写一次最终文件，索引同步更新
+        final_path = avatar_store.save(user_id, result, data)
+
+        logger.info(f"已保存: {final_path} (用户 {user_id}, 性别: {result})")
         return final_path
 
     except Exception as e:
@@ -129,13 +106,28 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     user_id = user.id
 
-    # 在后台异步处理，不阻塞回复
+    # 内存索引命中且未过期、或该用户已在处理中：直接返回，不建任务
+    existing = avatar_store.get(user_id)
+    if existing and _is_avatar_cached(existing):
+        return
+    if user_id in _inflight:
+        return
+    if len(_inflight) >= AVATAR_MAX_PENDING:
+        logger.debug(f"头像待处理用户已达上限 {AVATAR_MAX_PENDING}，跳过用户 {user_id}")
+        return
+    _inflight.add(user_id)
+
+    # 在后台异步处理，不阻塞回复；同时处理的用户数受信号量限制
     async def _process():
-        path = await process_user_avatar(
-            user_id,
-            user.username,
-            context.application,
-        )
+        try:
+            async with _semaphore:
+                path = await process_user_avatar(
+                    user_id,
+                    user.username,
+                    context.application,
+                )
+        finally:
+            _inflight.discard(user_id)
         if path and update.effective_chat:
             # 可选：在群里回复结果（仅管理员可触发回复，避免刷屏）
             # 这里改为静默处理，只记录日志。如需回复可取消注释：
@@ -146,11 +138,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             #     )
             pass
 
-    asyncio.create_task(_process())
+    task = asyncio.create_task(_process())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
 
 
 async def post_init(application: Application) -> None:
-    """启动成功后向管理员私聊发送你好"""
+    """重建头像索引、启动推理池（预热模型），并向管理员私聊发送你好"""
+    await asyncio.to_thread(avatar_store.rebuild)
+    get_pool().start()
     for admin_id in ADMIN_IDS:
         try:
             await application.bot.send_message(chat_id=admin_id, text="你好")
@@ -18,3 +18,9 @@ STORAGE_PATH.mkdir(parents=True, exist_ok=True)
 # 日志路径（异常日志保存目录）
 LOG_PATH = Path(os.getenv("LOG_PATH", "./logs"))
 LOG_PATH.mkdir(parents=True, exist_ok=True)
+
+# 头像处理：同时处理的用户数上限；排队（含处理中）用户数上限，超出时本条消息不再处理头像
+AVATAR_CONCURRENCY = int(os.getenv("AVATAR_CONCURRENCY", "8"))
+AVATAR_MAX_PENDING = int(os.getenv("AVATAR_MAX_PENDING", "1000"))
+# 头像存档：默认保存用于检测的那一档尺寸；设为 1 时在小尺寸上已得出结论后再下载一次最大尺寸存档（多一次下载）
+AVATAR_ARCHIVE_FULL_SIZE = os.getenv("AVATAR_ARCHIVE_FULL_SIZE", "0").lower() in ("1", "true", "yes")
@@ -0,0 +1,296 @@
+"""性别检测推理池 - 专用线程 + 预热模型 + 有界队列
+
+- 每个推理线程启动时加载并预热模型（缺失时在启动阶段下载），请求路径上不再懒加载
+- 队列有界：满时立即拒绝（InferenceQueueFull），调用方按检测失败处理，不堆积
+- 异步接口 await pool.detect(data)，可设超时；超时或取消的请求在出队时直接跳过
+- 统计排队等待与推理耗时（p50/p95），供日志与统计文件使用
+- 性别分类合批：各线程检出的人脸裁剪交给一个合批线程后即去处理下一张，由合批线程 blobFromImages 一次前向；
+  推理线程都已空闲时立即前向，否则最多等 GENDER_BATCH_WINDOW_MS；合批时推理线程不加载性别网络
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable
+
+from opencv_gender import (
+    detect_gender_bytes,
+    gender_crops_bytes,
+    predict_gender_batch,
+    verdict_from_scores,
+    warm_up,
+    warm_up_gender,
+)
+
+logger = logging.getLogger(__name__)
+
+GENDER_POOL_WORKERS = int(os.getenv("GENDER_POOL_WORKERS", "2"))
+GENDER_POOL_QUEUE = int(os.getenv("GENDER_POOL_QUEUE", "32"))
+GENDER_POOL_TIMEOUT = float(os.getenv("GENDER_POOL_TIMEOUT", "10"))
+# 合批等待窗口（毫秒），0 表示不合批（各线程自行前向）；单批最多裁剪数
+GENDER_BATCH_WINDOW_MS = float(os.getenv("GENDER_BATCH_WINDOW_MS", "5"))
+GENDER_BATCH_MAX = int(os.getenv("GENDER_BATCH_MAX", "32"))
+
+_METRIC_WINDOW = 500  # 统计最近 N 次的耗时
+_IDLE_POLL_SECONDS = 0.0005  # 合批窗口内检查推理线程是否都已空闲的间隔
+
+
+class InferenceQueueFull(Exception):
+    """推理队列已满"""
+
+
+def _percentile(samples: deque, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class GenderBatcher:
+    """
+    跨请求合批：推理线程做完检测后 submit(crops, callback) 即返回，继续检测下一张，不等前向；
+    合批线程取到第一组裁剪后继续收集，直到攒满 max_batch、等满 window 秒，
+    或 idle() 为真（没有线程在检测、任务队列也空，不会再有新裁剪）时立即前向，不空等窗口
+    """
+
+    def __init__(self, window_ms: float = GENDER_BATCH_WINDOW_MS, max_batch: int = GENDER_BATCH_MAX,
+                 idle: Callable[[], bool] | None = None):
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._idle = idle
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._batch_sizes: deque = deque(maxlen=_METRIC_WINDOW)
+        self.batches = 0
+        self.crops = 0
+        self.early_flushes = 0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="gender_batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, rois: list, callback: Callable[[list | None, Exception | None], None]) -> None:
+        """非阻塞：rois 排入下一批；前向后在合批线程调用 callback(scored, None)，出错时 callback(None, exc)"""
+        self._queue.put((rois, callback))
+
+    def _collect(self) -> tuple[list, bool]:
+        """取一批 [(rois, callback), ...]；返回 (批, 是否因空闲提前结束)"""
+        batch = [self._queue.get()]
+        n = len(batch[0][0])
+        deadline = time.perf_counter() + self.window
+        while n < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                if self._idle is not None and self._idle():
+                    return batch, True
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=min(remaining, _IDLE_POLL_SECONDS))
+                except queue.Empty:
+                    continue
+            batch.append(item)
+            n += len(item[0])
+        return batch, False
+
+    def _run(self) -> None:
+        try:
+            warm_up_gender()
+        except Exception as e:
+            logger.exception(f"合批线程模型预热失败: {e}")
+        while True:
+            batch, early = self._collect()
+            rois = [roi for item_rois, _ in batch for roi in item_rois]
+            try:
+                scored = predict_gender_batch(rois)
+            except Exception as e:
+                for _, callback in batch:
+                    self._call(callback, None, e)
+                continue
+            i = 0
+            for item_rois, callback in batch:
+                self._call(callback, scored[i:i + len(item_rois)], None)
+                i += len(item_rois)
+            with self._lock:
+                self.batches += 1
+                self.crops += len(rois)
+                self.early_flushes += early
+                self._batch_sizes.append(len(rois))
+
+    @staticmethod
+    def _call(callback: Callable, scored: list | None, exc: Exception | None) -> None:
+        try:
+            callback(scored, exc)
+        except Exception as e:
+            logger.exception(f"合批结果回调失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "crops": self.crops,
+                "avg_batch": round(self.crops / self.batches, 2) if self.batches else 0.0,
+                "max_batch_seen": max(self._batch_sizes) if self._batch_sizes else 0,
+                "early_flushes": self.early_flushes,
+            }
+
+
+class GenderInferencePool:
+    def __init__(self, workers: int = GENDER_POOL_WORKERS, queue_size: int = GENDER_POOL_QUEUE,
+                 timeout: float = GENDER_POOL_TIMEOUT, batch_window_ms: float = GENDER_BATCH_WINDOW_MS):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._batcher = GenderBatcher(batch_window_ms, idle=self._idle) if batch_window_ms > 0 else None
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: list[threading.Thread] = []
+        self._ready = threading.Event()
+        self._ready_count = 0
+        self._warm_failed = 0
+        self._detecting = 0  # 正在做检测（尚未把裁剪交给合批线程）的线程数
+        self._lock = threading.Lock()
+        self._wait_times: deque = deque(maxlen=_METRIC_WINDOW)
+        self._infer_times: deque = deque(maxlen=_METRIC_WINDOW)
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def start(self) -> None:
+        """启动推理线程（重复调用无副作用）；预热在各线程内进行，不阻塞调用方"""
+        if self._threads:
+            return
+        if self._batcher:
+            self._batcher.start()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"gender_infer_{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"性别推理池已启动：{self.workers} 线程，队列 {self._queue.maxsize}")
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """等待至少一个线程预热成功；全部线程预热失败时不再等待，返回 False"""
+        return self._ready.wait(timeout) and self._ready_count > 0
+
+    def _idle(self) -> bool:
+        """没有线程在检测且任务队列为空：合批线程不必再等新裁剪"""
+        return self._detecting == 0 and self._queue.empty()
+
+    def _run(self) -> None:
+        ok = False
+        try:
+            t0 = time.perf_counter()
+            # 合批时性别前向只在合批线程进行，推理线程不加载性别网络
+            warm_up(gender=self._batcher is None)
+            ok = True
+            logger.info(f"{threading.current_thread().name} 模型预热完成 {time.perf_counter() - t0:.2f}s")
+        except Exception as e:
+            logger.exception(f"模型预热失败: {e}")
+        with self._lock:
+            if ok:
+                self._ready_count += 1
+            else:
+                self._warm_failed += 1
+            # 预热失败的线程仍照常取任务（首次推理时会再尝试加载模型），只是不计入就绪数
+            if ok or self._warm_failed >= self.workers:
+                self._ready.set()
+        while True:
+            fut, enqueued_at, data, face_only = self._queue.get()
+            try:
+                if not fut.set_running_or_notify_cancel():
+                    continue  # 调用方已超时/取消
+                started = time.perf_counter()
+                if self._batcher is None:
+                    try:
+                        result = detect_gender_bytes(data, face_only=face_only)
+                    except Exception as e:
+                        fut.set_exception(e)
+                        continue
+                    self._finish(fut, enqueued_at, started, result)
+                    continue
+                with self._lock:
+                    self._detecting += 1
+                try:
+                    stage, crops = gender_crops_bytes(data, face_only=face_only)
+                    if crops:
+                        # 交给合批线程后立即处理下一张，结果由回调写入 fut
+                        self._batcher.submit(crops, partial(self._finish_batched, fut, enqueued_at, started, stage))
+                finally:
+                    with self._lock:
+                        self._detecting -= 1
+                if not crops:
+                    self._finish(fut, enqueued_at, started, stage)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, fut: Future, enqueued_at: float, started: float, result: str) -> None:
+        finished = time.perf_counter()
+        with self._lock:
+            self._wait_times.append(started - enqueued_at)
+            self._infer_times.append(finished - started)
+            self.completed += 1
+        fut.set_result(result)
+
+    def _finish_batched(self, fut: Future, enqueued_at: float, started: float, stage: str,
+                        scored: list | None, exc: Exception | None) -> None:
+        if exc is not None:
+            fut.set_exception(exc)
+            return
+        self._finish(fut, enqueued_at, started, verdict_from_scores(stage, scored))
+
+    def submit(self, data: bytes | bytearray, face_only: bool = False) -> Future:
+        """提交一张图片，返回 concurrent.futures.Future；队列满时抛 InferenceQueueFull"""
+        self.start()
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((fut, time.perf_counter(), data, face_only))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise InferenceQueueFull("性别推理队列已满") from None
+        return fut
+
+    async def detect(self, data: bytes | bytearray, face_only: bool = False, timeout: float | None = None) -> str:
+        """异步检测，返回值同 opencv_gender.detect_gender_image；超时抛 asyncio.TimeoutError"""
+        fut = self.submit(data, face_only)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "ready_workers": self._ready_count,
+                "warm_failed": self._warm_failed,
+                "queued": self._queue.qsize(),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_p50_ms": round(_percentile(self._wait_times, 50) * 1000, 1),
+                "wait_p95_ms": round(_percentile(self._wait_times, 95) * 1000, 1),
+                "infer_p50_ms": round(_percentile(self._infer_times, 50) * 1000, 1),
+                "infer_p95_ms": round(_percentile(self._infer_times, 95) * 1000, 1),
+                "batching": self._batcher.stats() if self._batcher else None,
+            }
+
+
+_pool: GenderInferencePool | None = None
+
+
+def get_pool() -> GenderInferencePool:
+    """进程内共用的推理池（按环境变量配置）"""
+    global _pool
+    if _pool is None:
+        _pool = GenderInferencePool()
+    return _pool
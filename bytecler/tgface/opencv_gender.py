@@ -3,10 +3,15 @@
 两阶段流水线：人脸 → 人体 → other
 - 有人脸：人脸区域性别分类
 - 无人脸：HOG 人体检测 → 上半身裁剪 → 性别分类（置信度 < 0.6 则返回 other）
+人脸检测可选 Haar（默认）或 SSD/ResNet DNN（FACE_DETECTOR=dnn，检出率更高，少走 HOG）
 """
 import logging
+import os
+import threading
+import time
 import urllib.request
 from pathlib import Path
+from typing import Callable
 
 import cv2
 import numpy as np
@@ -17,7 +22,17 @@ logger = logging.getLogger(__name__)
 MODELS_DIR = Path(__file__).parent / "models"
 MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
-# 性别模型（需下载），人脸检测用 OpenCV 内置 Haar
+# 人脸检测器：haar（OpenCV 内置级联）| dnn（res10 SSD，models/deploy.prototxt + 下载的权重）
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar").lower()
+FACE_DETECTORS = ("haar", "dnn")
+FACE_PROTO = MODELS_DIR / "deploy.prototxt"
+FACE_MODEL = MODELS_DIR / "res10_300x300_ssd_iter_140000.caffemodel"
+FACE_MODEL_URL = "https://github.com/opencv/opencv_3rdparty/raw/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel"
+FACE_DNN_CONFIDENCE = float(os.getenv("FACE_DNN_CONFIDENCE", "0.5"))
+FACE_DNN_MEAN = (104.0, 177.0, 123.0)
+FACE_MIN_SIZE = 30  # 与 Haar minSize 一致
+
+# 性别模型（需下载）
 GENDER_PROTO = MODELS_DIR / "gender_deploy.prototxt"
 GENDER_MODEL = MODELS_DIR / "gender_net.caffemodel"
 GENDER_MODEL_URL = "https://github.com/GilLevi/AgeGenderDeepLearning/raw/master/models/gender_net.caffemodel"
@@ -28,67 +43,141 @@ GENDER_MEAN = (78.4263377603, 87.7689143744, 114.895847746)
 # 全身人像：上半身性别预测置信度阈值，低于则返回 other
 BODY_GENDER_CONFIDENCE_THRESHOLD = 0.6
 
+# 头像下载：选短边不小于该值的最小尺寸（性别网络输入仅 227×227，Haar 最小人脸 30px）
+AVATAR_MIN_SIDE = int(os.getenv("AVATAR_MIN_SIDE", "160"))
+# face_only 模式下未检出人脸时的返回值，调用方据此换更大尺寸重试
+NO_FACE = "noface"
+# 1 时对图中所有人脸打分（一次批量前向），按各性别置信度之和取结果；默认只看第一张脸
+SCORE_ALL_FACES = os.getenv("GENDER_SCORE_ALL_FACES", "0").lower() in ("1", "true", "yes")
+
+# 批量性别预测：输入若干裁剪区域，返回等长的 [(gender, confidence), ...]
+GenderPredictor = Callable[[list[np.ndarray]], list[tuple[str, float]]]
+
+
+def _timed(timings: dict | None, stage: str, started: float) -> None:
+    """timings 非空时累加某阶段耗时（秒）"""
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+# 多个推理线程同时预热时只由一个线程下载，其余等待后直接使用
+_download_lock = threading.Lock()
+
 
 def _download_file(url: str, dest: Path) -> None:
-    """下载文件到指定路径"""
-    if dest.exists():
-        return
-    logger.info(f"正在下载: {dest.name} (~45MB) ...")
-    try:
-        urllib.request.urlretrieve(url, dest)
-        logger.info(f"下载完成: {dest.name}")
-    except Exception as e:
-        logger.error(f"下载失败 {dest.name}: {e}")
-        raise
+    """下载文件到指定路径：先写临时文件再替换，中断或失败不会留下半截模型"""
+    with _download_lock:
+        if dest.exists():
+            return
+        logger.info(f"正在下载: {dest.name} ...")
+        tmp = dest.with_name(dest.name + ".part")
+        try:
+            urllib.request.urlretrieve(url, tmp)
+            os.replace(tmp, dest)
+            logger.info(f"下载完成: {dest.name}")
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            logger.error(f"下载失败 {dest.name}: {e}")
+            raise
 
 
 def _ensure_models() -> None:
-    """确保性别模型存在，缺失则下载"""
+    """确保性别模型存在，缺失则下载（~45MB）"""
     if not GENDER_MODEL.exists():
         _download_file(GENDER_MODEL_URL, GENDER_MODEL)
 
 
-# 全局模型实例（懒加载）
-_face_cascade = None
-_gender_net = None
-_hog = None
+def _ensure_face_model() -> None:
+    """确保 DNN 人脸检测权重存在，缺失则下载（~10MB）"""
+    if not FACE_MODEL.exists():
+        _download_file(FACE_MODEL_URL, FACE_MODEL)
+
+
+# 模型实例按线程懒加载：cv2.dnn.Net / CascadeClassifier 不保证多线程共用安全，每个推理线程各持一份
+_local = threading.local()
 
 
 def _get_face_cascade():
     """获取 OpenCV 内置人脸检测器"""
-    global _face_cascade
-    if _face_cascade is None:
+    if getattr(_local, "face_cascade", None) is None:
         path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        _face_cascade = cv2.CascadeClassifier(path)
-    return _face_cascade
+        _local.face_cascade = cv2.CascadeClassifier(path)
+    return _local.face_cascade
+
+
+def _get_face_net():
+    """获取 SSD 人脸检测网络"""
+    if getattr(_local, "face_net", None) is None:
+        _ensure_face_model()
+        _local.face_net = cv2.dnn.readNetFromCaffe(str(FACE_PROTO), str(FACE_MODEL))
+    return _local.face_net
 
 
 def _get_gender_net():
     """获取性别识别网络"""
-    global _gender_net
-    if _gender_net is None:
+    if getattr(_local, "gender_net", None) is None:
         _ensure_models()
-        _gender_net = cv2.dnn.readNetFromCaffe(str(GENDER_PROTO), str(GENDER_MODEL))
-    return _gender_net
+        _local.gender_net = cv2.dnn.readNetFromCaffe(str(GENDER_PROTO), str(GENDER_MODEL))
+    return _local.gender_net
 
 
 def _get_hog():
     """获取 HOG 行人检测器"""
-    global _hog
-    if _hog is None:
-        _hog = cv2.HOGDescriptor()
-        _hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-    return _hog
+    if getattr(_local, "hog", None) is None:
+        _local.hog = cv2.HOGDescriptor()
+        _local.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    return _local.hog
+
+
+def warm_up(face_detector: str | None = None, gender: bool = True) -> None:
+    """
+    在当前线程加载模型并各跑一次空推理（模型缺失时在此下载），供推理线程启动时调用
+    gender=False 时不加载性别网络（推理池合批时只有合批线程做性别前向）
+    """
+    blank = np.zeros((256, 256, 3), dtype=np.uint8)
+    _detect_faces(blank, face_detector)
+    _detect_persons(blank)
+    if gender:
+        warm_up_gender()
 
 
-def _detect_faces(image: np.ndarray) -> list[tuple[int, int, int, int]]:
-    """检测人脸，返回 bbox 列表 [(x1,y1,x2,y2), ...]"""
+def warm_up_gender() -> None:
+    """只加载并预热性别网络（合批线程用）"""
+    _predict_gender(np.zeros((256, 256, 3), dtype=np.uint8))
+
+
+def _detect_faces(image: np.ndarray, detector: str | None = None) -> list[tuple[int, int, int, int]]:
+    """检测人脸，返回 bbox 列表 [(x1,y1,x2,y2), ...]；detector 为空时用 FACE_DETECTOR"""
+    if (detector or FACE_DETECTOR) == "dnn":
+        return _detect_faces_dnn(image)
     cascade = _get_face_cascade()
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     faces = cascade.detectMultiScale(gray, 1.1, 5, minSize=(30, 30))
     return [(int(x), int(y), int(x + w), int(y + h)) for (x, y, w, h) in faces]
 
 
+def _detect_faces_dnn(image: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """SSD 人脸检测，按置信度降序返回 bbox 列表 [(x1,y1,x2,y2), ...]"""
+    net = _get_face_net()
+    h, w = image.shape[:2]
+    blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), FACE_DNN_MEAN, swapRB=False)
+    net.setInput(blob)
+    detections = net.forward()
+    found = []
+    for i in range(detections.shape[2]):
+        conf = float(detections[0, 0, i, 2])
+        if conf < FACE_DNN_CONFIDENCE:
+            continue
+        box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+        x1, y1 = max(0, int(box[0])), max(0, int(box[1]))
+        x2, y2 = min(w, int(box[2])), min(h, int(box[3]))
+        if x2 - x1 < FACE_MIN_SIZE or y2 - y1 < FACE_MIN_SIZE:
+            continue
+        found.append((conf, (x1, y1, x2, y2)))
+    found.sort(key=lambda x: x[0], reverse=True)
+    return [bbox for _, bbox in found]
+
+
 def _detect_persons(image: np.ndarray) -> list[tuple[int, int, int, int]]:
     """HOG 人体检测，返回 bbox 列表 [(x1,y1,x2,y2), ...]，取面积最大的"""
     hog = _get_hog()
@@ -103,66 +192,183 @@ def _detect_persons(image: np.ndarray) -> list[tuple[int, int, int, int]]:
     return [(int(x), int(y), int(x + w), int(y + h)) for (x, y, w, h) in rects]
 
 
-def _predict_gender(face_roi: np.ndarray) -> tuple[str, float]:
+def _softmax_gender(probs: np.ndarray) -> tuple[str, float]:
+    if len(probs) < 2:
+        return "other", 0.0
+    exp = np.exp(probs - probs.max())
+    probs = exp / exp.sum()
+    idx = int(probs.argmax())
+    return ("male" if idx == 0 else "female", float(probs[idx]))
+
+
+def predict_gender_batch(rois: list[np.ndarray]) -> list[tuple[str, float]]:
     """
-    对裁剪区域做性别预测，返回 (gender, confidence)
-    gender: "male" | "female", confidence: 0~1
+    多个裁剪区域一次 blobFromImages + forward，返回等长的 [(gender, confidence), ...]
+    gender: "male" | "female"（空区域为 "other"）, confidence: 0~1
     """
-    if face_roi.size == 0:
-        return "other", 0.0
+    results: list[tuple[str, float]] = [("other", 0.0)] * len(rois)
+    valid = [i for i, roi in enumerate(rois) if roi.size > 0]
+    if not valid:
+        return results
     gender_net = _get_gender_net()
-    blob = cv2.dnn.blobFromImage(
-        face_roi, 1.0, (227, 227), GENDER_MEAN, swapRB=False
+    blob = cv2.dnn.blobFromImages(
+        [rois[i] for i in valid], 1.0, (227, 227), GENDER_MEAN, swapRB=False
     )
     gender_net.setInput(blob)
     preds = gender_net.forward()
-    probs = preds[0]
-    if len(probs) < 2:
-        return "other", 0.0
-    # softmax
-    exp = np.exp(probs - probs.max())
-    probs = exp / exp.sum()
-    idx = int(probs.argmax())
-    conf = float(probs[idx])
-    return ("male" if idx == 0 else "female", conf)
+    for i, probs in zip(valid, preds):
+        results[i] = _softmax_gender(probs)
+    return results
+
+
+def _predict_gender(face_roi: np.ndarray) -> tuple[str, float]:
+    """对单个裁剪区域做性别预测，返回 (gender, confidence)"""
+    return predict_gender_batch([face_roi])[0]
+
+
+def _vote(scored: list[tuple[str, float]]) -> str:
+    """多张脸时按各性别置信度之和取结果"""
+    if len(scored) == 1:
+        return scored[0][0]
+    totals: dict[str, float] = {}
+    for gender, conf in scored:
+        totals[gender] = totals.get(gender, 0.0) + conf
+    return max(totals, key=totals.get)
+
+
+def pick_photo_sizes(photo_sizes: list, min_side: int = AVATAR_MIN_SIDE) -> list:
+    """
+    按面积升序返回候选尺寸（对象需有 width/height，如 telegram PhotoSize），最多三档：
+    短边 >= min_side 的最小尺寸（都不满足时只有最大尺寸）、大一档、最大尺寸；
+    未检出人脸时只多试大一档，再不行直接跳到最大尺寸，无脸头像不会把中间各档逐一下载一遍
+    """
+    ordered = sorted(photo_sizes, key=lambda p: p.width * p.height)
+    for i, p in enumerate(ordered):
+        if min(p.width, p.height) >= min_side:
+            head = ordered[i:i + 2]
+            return head if head[-1] is ordered[-1] else head + ordered[-1:]
+    return ordered[-1:]
+
+
+def decode_image(data: bytes | bytearray | memoryview) -> np.ndarray | None:
+    """内存中的图片字节解码为 BGR 图像，失败返回 None"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
 
 
 def detect_gender(image_path: Path) -> str:
+    """从图片文件检测性别，返回值同 detect_gender_image"""
+    image = cv2.imread(str(image_path))
+    if image is None:
+        return "failure"
+    return detect_gender_image(image)
+
+
+def detect_gender_bytes(data: bytes | bytearray | memoryview, face_only: bool = False,
+                        predict: GenderPredictor | None = None, face_detector: str | None = None,
+                        timings: dict | None = None) -> str:
+    """从内存中的图片字节检测性别（cv2.imdecode，不落盘），返回值同 detect_gender_image"""
+    started = time.perf_counter()
+    try:
+        image = decode_image(data)
+    except Exception as e:
+        logger.warning(f"图片解码失败: {e}")
+        return "failure"
+    finally:
+        _timed(timings, "decode", started)
+    if image is None:
+        return "failure"
+    return detect_gender_image(image, face_only=face_only, predict=predict,
+                               face_detector=face_detector, timings=timings)
+
+
+def gender_crops_bytes(data: bytes | bytearray | memoryview, face_only: bool = False,
+                       face_detector: str | None = None) -> tuple[str, list[np.ndarray]]:
+    """解码 + gender_crops（不做性别前向，供推理池把裁剪交给合批线程）；解码或检测出错返回 ("failure", [])"""
+    try:
+        image = decode_image(data)
+        if image is None:
+            return "failure", []
+        return gender_crops(image, face_only=face_only, face_detector=face_detector)
+    except Exception as e:
+        logger.exception(f"OpenCV 性别检测失败: {e}")
+        return "failure", []
+
+
+def gender_crops(image: np.ndarray, face_only: bool = False,
+                 all_faces: bool = SCORE_ALL_FACES,
+                 face_detector: str | None = None,
+                 timings: dict | None = None) -> tuple[str, list[np.ndarray]]:
+    """
+    检测阶段（人脸 → 人体），不含性别前向，返回 (stage, crops)：
+    stage 为 "face" / "body" 时 crops 是待性别分类的裁剪，前向后交给 verdict_from_scores；
+    否则 crops 为空，stage 即最终结果（"other"，或 face_only 时未检出人脸的 NO_FACE）
+    """
+    # 阶段 1：人脸检测
+    started = time.perf_counter()
+    face_bboxes = _detect_faces(image, face_detector)
+    _timed(timings, "face", started)
+    if not all_faces:
+        face_bboxes = face_bboxes[:1]
+    faces = [image[y1:y2, x1:x2] for (x1, y1, x2, y2) in face_bboxes]
+    faces = [f for f in faces if f.size > 0]
+    if faces:
+        return "face", faces
+    if face_only:
+        return NO_FACE, []
+
+    # 阶段 2：人体检测（无人脸时）
+    started = time.perf_counter()
+    person_bboxes = _detect_persons(image)
+    _timed(timings, "hog", started)
+    if not person_bboxes:
+        return "other", []
+
+    x1, y1, x2, y2 = person_bboxes[0]
+    h = y2 - y1
+    # 裁剪上半身（头部区域，约 40%）
+    upper_h = max(int(h * 0.4), 50)
+    upper_body = image[y1 : y1 + upper_h, x1:x2]
+    if upper_body.size == 0 or upper_body.shape[0] < 30 or upper_body.shape[1] < 30:
+        return "other", []
+    return "body", [upper_body]
+
+
+def verdict_from_scores(stage: str, scored: list[tuple[str, float]]) -> str:
+    """gender_crops 的裁剪经性别前向后得出最终结果：人脸按置信度投票，上半身置信度不足返回 other"""
+    if stage == "face":
+        return _vote(scored)
+    gender, conf = scored[0]
+    if conf < BODY_GENDER_CONFIDENCE_THRESHOLD:
+        return "other"
+    return gender
+
+
+def detect_gender_image(image: np.ndarray, face_only: bool = False,
+                        predict: GenderPredictor | None = None,
+                        all_faces: bool = SCORE_ALL_FACES,
+                        face_detector: str | None = None,
+                        timings: dict | None = None) -> str:
     """
     两阶段性别检测：人脸 → 人体 → other
     返回: "male"=男性, "female"=女性, "other"=无人脸/无人体/置信度低, "failure"=检测失败
+    face_only=True 时只做人脸阶段，未检出人脸返回 NO_FACE（用于小尺寸头像，检不出再换大图）
+    predict: 性别预测函数，默认在本线程直接批量前向
+    face_detector: "haar" | "dnn"，为空时用 FACE_DETECTOR
+    timings: 传入 dict 时按阶段累加耗时（秒）：face / hog / forward，供 bench_gender.py 使用
     """
+    predict = predict or predict_gender_batch
     try:
-        image = cv2.imread(str(image_path))
-        if image is None:
-            return "failure"
-
-        # 阶段 1：人脸检测
-        face_bboxes = _detect_faces(image)
-        if face_bboxes:
-            x1, y1, x2, y2 = face_bboxes[0]
-            face = image[y1:y2, x1:x2]
-            if face.size > 0:
-                gender, _ = _predict_gender(face)
-                return gender
-
-        # 阶段 2：人体检测（无人脸时）
-        person_bboxes = _detect_persons(image)
-        if not person_bboxes:
-            return "other"
-
-        x1, y1, x2, y2 = person_bboxes[0]
-        h = y2 - y1
-        # 裁剪上半身（头部区域，约 40%）
-        upper_h = max(int(h * 0.4), 50)
-        upper_body = image[y1 : y1 + upper_h, x1:x2]
-        if upper_body.size == 0 or upper_body.shape[0] < 30 or upper_body.shape[1] < 30:
-            return "other"
-
-        gender, conf = _predict_gender(upper_body)
-        if conf < BODY_GENDER_CONFIDENCE_THRESHOLD:
-            return "other"
-        return gender
+        stage, crops = gender_crops(image, face_only=face_only, all_faces=all_faces,
+                                    face_detector=face_detector, timings=timings)
+        if not crops:
+            return stage
+        started = time.perf_counter()
+        scored = predict(crops)
+        _timed(timings, "forward", started)
+        return verdict_from_scores(stage, scored)
 
     except Exception as e:
         logger.exception(f"OpenCV 性别检测失败: {e}")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+带过期时间的有界字典（各类缓存、pending 两段式状态共用）
+- 条目按写入/访问顺序存放在 OrderedDict 中（LRU 顺序），另用最小堆按过期时间排序；
+  读取/删除 O(1)，过期条目在读取时惰性删除；写入与 touch 需入堆一次，为 O(log n) 而非 O(1)：
+  各条目 TTL 可不同且 touch 会续期，过期顺序与写入顺序不一致，FIFO 队列无法按到期先后清理。
+  写入时顺带从堆顶清理少量，每个堆项最多出堆一次，热路径上无全量扫描；被覆盖/删除留下的失效堆项超过条目数时整体重建
+- len() 先从堆顶清掉所有已到期条目，返回的是未过期条目数，可用于判空/计数
+- 值原地修改不会续期，需续期时重新赋值或调用 touch()
+- 超过 max_size 时按 LRU 淘汰最久未使用的条目，内存有上界
+- 用法与 dict 基本一致（get / pop / in / [] / items / values / len），值原样保存，不改变调用方的数据结构
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# 每次写入时最多顺带清理的队头过期条目数
+_EXPIRE_PER_WRITE = 4
+
+_registry: Dict[str, "TTLMap"] = {}
+
+
+class TTLMap(MutableMapping):
+    """
+    ttl: 默认存活秒数（自最近一次写入起算）；set(key, value, ttl=...) 可按条目覆盖
+    max_size: 条目上限，0 表示不限
+    name: 非空时登记到全局，供 get_ttl_stats() 汇总
+    读取会刷新 LRU 顺序但不延长存活时间；需要续期时重新写入或 touch(key)
+    """
+
+    def __init__(self, ttl: float, max_size: int = 0, name: str = ""):
+        self.ttl = ttl
+        self.max_size = max(0, max_size)
+        self.name = name
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # key -> (过期时间, 值)
+        # (过期时间, 序号, key)；与 _data 中过期时间不一致的为失效项（条目已被覆盖或删除），出堆时跳过
+        self._expiry: List[Tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        if name:
+            _registry[name] = self
+
+    def _alive(self, key: Hashable, now: float) -> Optional[Tuple[float, Any]]:
+        """返回未过期条目；已过期则删除并返回 None（需持有锁）"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._data[key]
+            self.expired += 1
+            return None
+        return item
+
+    def _expire_head(self, now: float, limit: int) -> None:
+        """从过期堆顶弹出最多 limit 个已到期项，删除仍对应的条目，遇到未到期即停止（需持有锁）"""
+        heap = self._expiry
+        for _ in range(limit):
+            if not heap or heap[0][0] > now:
+                return
+            expire_at, _, key = heapq.heappop(heap)
+            item = self._data.get(key)
+            if item is not None and item[0] == expire_at:
+                del self._data[key]
+                self.expired += 1
+
+    def _schedule(self, key: Hashable, expire_at: float) -> None:
+        """登记过期时间；失效堆项过多时按现有条目重建堆，堆大小保持在条目数的 2 倍左右（需持有锁）"""
+        if len(self._expiry) > 2 * len(self._data) + 64:
+            self._expiry = [(exp, next(self._seq), k) for k, (exp, _) in self._data.items()]
+            heapq.heapify(self._expiry)
+            if key in self._data:
+                return
+        heapq.heappush(self._expiry, (expire_at, next(self._seq), key))
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._expire_head(now, _EXPIRE_PER_WRITE)
+            expire_at = now + (self.ttl if ttl is None else ttl)
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            self._schedule(key, expire_at)
+            if self.max_size:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self.evicted += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._alive(key, time.monotonic())
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._alive(key, time.monotonic())
+            if item is None:
+                self.misses += 1
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+
+    def touch(self, key: Hashable, ttl: Optional[float] = None) -> bool:
+        """续期：值不变，存活时间从现在重新计算（值被原地修改后用）；条目不存在或已过期返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._alive(key, now)
+            if item is None:
+                return False
+            expire_at = now + (self.ttl if ttl is None else ttl)
+            self._data[key] = (expire_at, item[1])
+            self._data.move_to_end(key)
+            self._schedule(key, expire_at)
+            return True
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            if self._alive(key, time.monotonic()) is None:
+                raise KeyError(key)
+            del self._data[key]
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return self._alive(key, time.monotonic()) is not None
+
+    def pop(self, key: Hashable, *default: Any) -> Any:
+        with self._lock:
+            item = self._alive(key, time.monotonic())
+            if item is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            del self._data[key]
+            return item[1]
+
+    def _snapshot(self) -> List[Tuple[Hashable, Any]]:
+        """未过期条目的快照，遍历期间可安全增删；顺带清理遇到的过期条目"""
+        now = time.monotonic()
+        with self._lock:
+            dead = [k for k, (exp, _) in self._data.items() if exp <= now]
+            for k in dead:
+                del self._data[k]
+            self.expired += len(dead)
+            return [(k, v) for k, (_, v) in self._data.items()]
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter([k for k, _ in self._snapshot()])
+
+    def items(self) -> List[Tuple[Hashable, Any]]:  # type: ignore[override]
+        return self._snapshot()
+
+    def values(self) -> List[Any]:  # type: ignore[override]
+        return [v for _, v in self._snapshot()]
+
+    def keys(self) -> List[Hashable]:  # type: ignore[override]
+        return [k for k, _ in self._snapshot()]
+
+    def __len__(self) -> int:
+        """未过期条目数：先从堆顶清掉所有已到期条目（均摊到各条目的一次出堆）"""
+        with self._lock:
+            self._expire_head(time.monotonic(), len(self._expiry))
+            return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+def get_ttl_stats() -> Dict[str, Dict[str, Any]]:
+    """所有具名 TTLMap 的大小与命中/过期/淘汰计数，写入 delete_stats.json 供观察内存占用"""
+    return {name: m.stats() for name, m in _registry.items()}
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+滑动窗口计数（霜刃触发冷却/验证失败计数、小助理按分钟限流共用）
+每个 key 只保存最近 capacity 个时间戳（定长环形 deque），每次事件只看这几个时间戳，O(1)；
+长时间无事件的 key 按最近活动顺序从队头回收，不做全量扫描。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# 每次事件时最多顺带回收的空闲 key 数
+_EVICT_PER_EVENT = 4
+
+
+class WindowCounter:
+    """
+    window: 窗口秒数，只统计 now - window 之后的事件
+    capacity: 每个 key 最多记录的事件数，即计数上限（限流取每窗口上限，失败计数取阈值即可）
+    cooldown: 距上次计入不足 cooldown 秒的事件不计入（0 表示不冷却）
+    max_keys: key 数上限，超出淘汰最久无活动的 key，0 表示不限
+    """
+
+    def __init__(self, window: float, capacity: int, cooldown: float = 0.0, max_keys: int = 0):
+        self.window = window
+        self.capacity = max(1, capacity)
+        self.cooldown = cooldown
+        self.max_keys = max(0, max_keys)
+        self._rings: "OrderedDict[Hashable, Deque[float]]" = OrderedDict()  # 按最近一次计入排序
+        self._lock = threading.Lock()
+
+    def _count(self, ring: Deque[float], now: float) -> int:
+        cutoff = now - self.window
+        return sum(1 for t in ring if t > cutoff)
+
+    def _evict_idle(self, now: float) -> None:
+        """队头即最久未计入的 key，其最近一次事件已出窗口则整个 key 计数为 0，可回收（需持有锁）"""
+        cutoff = now - self.window
+        for _ in range(_EVICT_PER_EVENT):
+            if not self._rings:
+                return
+            key, ring = next(iter(self._rings.items()))
+            if ring and ring[-1] > cutoff:
+                return
+            del self._rings[key]
+
+    def _append(self, key: Hashable, now: float) -> Deque[float]:
+        """记录一次事件（需持有锁）"""
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = deque(maxlen=self.capacity)
+            self._rings[key] = ring
+        else:
+            self._rings.move_to_end(key)
+        ring.append(now)
+        if self.max_keys:
+            while len(self._rings) > self.max_keys:
+                self._rings.popitem(last=False)
+        return ring
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> Tuple[bool, int]:
+        """冷却+窗口：返回 (本次是否计入, 当前窗口内次数)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict_idle(now)
+            ring = self._rings.get(key)
+            if ring and now - ring[-1] < self.cooldown:
+                return False, self._count(ring, now)  # 冷却中，不计入
+            ring = self._append(key, now)
+            return True, self._count(ring, now)
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """限流：窗口内已满 capacity 次则拒绝，否则记录一次并放行"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict_idle(now)
+            ring = self._rings.get(key)
+            if ring is not None and len(ring) == self.capacity and ring[0] > now - self.window:
+                return False
+            self._append(key, now)
+            return True
+
+    def count(self, key: Hashable, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            ring = self._rings.get(key)
+            return self._count(ring, now) if ring else 0
+
+    def pop(self, key: Hashable, default=None):
+        """清除某 key 的计数，返回其时间戳列表"""
+        with self._lock:
+            ring = self._rings.pop(key, None)
+        return list(ring) if ring is not None else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rings.clear()
+
+    def load(self, key: Hashable, timestamps: Iterable[float], now: Optional[float] = None) -> None:
+        """从持久化数据恢复某 key（只保留窗口内最近 capacity 个）"""
+        now = time.time() if now is None else now
+        cutoff = now - self.window
+        ts = sorted(t for t in timestamps if t > cutoff)[-self.capacity:]
+        if not ts:
+            return
+        with self._lock:
+            self._rings[key] = deque(ts, maxlen=self.capacity)
+            self._rings.move_to_end(key)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[Hashable, List[float]]:
+        """窗口内仍有事件的 key -> 时间戳列表，供持久化；每个 key 至多 capacity 个时间戳"""
+        now = time.time() if now is None else now
+        cutoff = now - self.window
+        with self._lock:
+            return {k: [t for t in ring if t > cutoff] for k, ring in self._rings.items() if ring and ring[-1] > cutoff}
+
+    def __len__(self) -> int:
+        return len(self._rings)
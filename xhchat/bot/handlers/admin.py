@@ -12,6 +12,9 @@ from bot.models.database import (
     has_sticker,
 )
 from bot.models.database import get_sticker_ids as db_get_sticker_ids
+from bot.services.admission import get_admission_stats
+from bot.services.ai_service import get_prompt_cache_stats, get_single_flight_stats
+from bot.services.response_cache import response_cache
 from bot.services.group_config import get_ai_config, get_custom_prompt, get_preset_list, get_use_web_search, PRESET_MODELS
 
 
@@ -84,6 +87,29 @@ async def callback_web_search(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.edit_message_text(f"🔍 联网搜索\n\n当前状态：{status}")
 
 
+def _cache_stats_text() -> str:
+    """AI 调用统计：缓存命中、请求合并、排队与熔断（自启动以来）"""
+    st = get_prompt_cache_stats()
+    if not st["requests"]:
+        line = "提示词缓存：暂无数据"
+    else:
+        line = (
+            f"提示词缓存：命中 {st['hit_requests']}/{st['requests']} 次，"
+            f"缓存 token {st['cached_tokens']}/{st['prompt_tokens']}（{st['token_hit_rate']:.0%}）"
+        )
+    rc = response_cache.stats()
+    if rc["enabled"]:
+        line += f"\n回复缓存：命中 {rc['hits']} / 未命中 {rc['misses']}（{rc['hit_rate']:.0%}），当前 {rc['size']} 条"
+    sf = get_single_flight_stats()
+    if sf["shared"]:
+        line += f"\n请求合并：实际调用 {sf['leaders']} 次，合并 {sf['shared']} 次"
+    ad = get_admission_stats()
+    line += f"\nAI 队列：进行中 {ad['active']}，排队 {ad['queued']}，拒绝 {ad['rejected'] + ad['timed_out']}"
+    if ad["breaker_open"]:
+        line += f"\n⚠️ 熔断中，已切换备用模型：{', '.join(ad['breaker_open'])}"
+    return line
+
+
 async def cmd_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """查看当前群配置"""
     if not await _check_owner(update, context):
@@ -98,7 +124,8 @@ async def cmd_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📋 当前为私聊，使用全局配置\n\n"
             f"模型：{cfg['ai_provider']} / {cfg['model_name']}\n"
             f"自定义设定：{'已设置' if custom else '未设置'}\n"
-            f"联网搜索：{'✅ 开启' if web_on else '❌ 关闭'}\n\n"
+            f"联网搜索：{'✅ 开启' if web_on else '❌ 关闭'}\n"
+            f"{_cache_stats_text()}\n\n"
             f"/web_search — 切换联网搜索"
         )
         await update.message.reply_text(text)
@@ -111,7 +138,8 @@ async def cmd_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         f"📋 本群配置\n\n"
         f"模型：{cfg['ai_provider']} / {cfg['model_name']}\n"
-        f"自定义设定：{'已设置 (' + str(len_custom) + ' 字)' if custom else '使用全局'}\n\n"
+        f"自定义设定：{'已设置 (' + str(len_custom) + ' 字)' if custom else '使用全局'}\n"
+        f"{_cache_stats_text()}\n\n"
         f"命令：\n"
         f"/set_model - 切换模型\n"
         f"/set_prompt - 设置本群设定\n"
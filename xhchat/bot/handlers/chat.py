@@ -1,4 +1,5 @@
 """群聊/私聊消息处理 - @提及触发"""
+import asyncio
 import logging
 import random
 import re
@@ -8,11 +9,13 @@ logger = logging.getLogger(__name__)
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
 
-from config.settings import AI_PROVIDER, ALLOWED_CHAT_IDS
+from config.settings import AI_PROVIDER, ALLOWED_CHAT_IDS, BOT_OWNER_ID
 from bot.services.sticker_service import get_sticker_ids
 from bot.services.ai_service import chat_completion
+from bot.services.admission import PRIORITY_NORMAL, PRIORITY_OWNER, AdmissionRejected
 from bot.services.context_manager import (
     build_messages_for_ai,
+    maybe_refresh_summary,
     save_exchange,
     rate_limiter,
 )
@@ -21,6 +24,14 @@ from bot.services.context_manager import (
 from bot.services.text_utils import replace_emoji_digits
 
 
+async def _refresh_summary_background(chat_id: int, user_id: int) -> None:
+    """回复发出后在线程中刷新滚动摘要，不阻塞事件循环；失败仅记录日志"""
+    try:
+        await asyncio.to_thread(maybe_refresh_summary, chat_id, user_id)
+    except Exception as e:
+        logger.warning("滚动摘要刷新失败 chat_id=%s user_id=%s: %s", chat_id, user_id, e)
+
+
 def should_respond(update: Update, context: ContextTypes.DEFAULT_TYPE) -> tuple[bool, str]:
     """
     判断是否应该回复，以及提取用户的实际问题
@@ -91,7 +102,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理文本消息，调用 AI 并回复"""
     # 检查是否在等待 /set_prompt 的输入（仅管理员可设置）
     if context.chat_data.get("awaiting_prompt") and update.message and update.message.text:
-        from config.settings import BOT_OWNER_ID
         if update.effective_user.id != BOT_OWNER_ID:
             await update.message.reply_text("❌ 权限不足。")
             return
@@ -149,13 +159,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         messages = build_messages_for_ai(chat_id, user_id, query, reply_to_assistant=reply_to_assistant)
-        reply = chat_completion(messages, chat_id=chat_id, user_full_name=full_name, user_message=query)
+        # 放到线程中执行，不阻塞事件循环；并发的相同提问在 chat_completion 内合并
+        reply = await asyncio.to_thread(
+            chat_completion,
+            messages,
+            chat_id=chat_id,
+            user_full_name=full_name,
+            user_message=query,
+            cacheable=not reply_to_assistant,
+            priority=PRIORITY_OWNER if user_id == BOT_OWNER_ID else PRIORITY_NORMAL,
+        )
         reply = replace_emoji_digits(reply or "")
         save_exchange(chat_id, user_id, query, reply)
         sent_msg = await message.reply_text(
             reply,
             reply_to_message_id=message.message_id,
         )
+        context.application.create_task(_refresh_summary_background(chat_id, user_id))
         # 小助理回复含「霜刃」时，霜刃收不到（bot→bot 限制），通过 handoff 代为发送「......」
         if sent_msg and "霜刃" in (reply or ""):
             try:
@@ -167,6 +187,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     logger.warning("handoff_frost: 写入失败")
             except Exception as e:
                 logger.warning("handoff_frost: 异常 %s", e, exc_info=True)
+    except AdmissionRejected as e:
+        logger.warning("AI 准入拒绝 chat_id=%s user_id=%s: %s", chat_id, user_id, e)
+        await message.reply_text(
+            "提问的人有点多，请稍后再试～",
+            reply_to_message_id=message.message_id,
+        )
     except Exception as e:
         err_msg = str(e)
         logger.warning("AI 调用异常: %s", e, exc_info=True)
@@ -105,10 +105,11 @@ async def track_admin_activity(update: Update, context: ContextTypes.DEFAULT_TYP
             now = datetime.now()
             last = _last_repeat_at.get(chat_id)
             if last is None or (now - last).total_seconds() >= REPEAT_COOLDOWN_SECONDS:
+                # 先占冷却并清空再发送：并发处理的其他消息不会在 await 期间重复触发
+                _last_repeat_at[chat_id] = now
+                _recent_messages[chat_id] = []
                 try:
                     await context.bot.send_message(chat_id=chat_id, text=last_n[0][1])
-                    _last_repeat_at[chat_id] = now
-                    _recent_messages[chat_id] = []  # 清空避免连续触发
                     logger.info("暖群: chat_id=%s %d人重复跟发", chat_id, required)
                 except Exception as e:
                     logger.warning("暖群: 重复跟发失败 %s", e)
@@ -33,7 +33,8 @@ from bot.handlers.admin import (
 from bot.handlers.xh import cmd_xhadd, cmd_xhdel, cmd_xhset
 from bot.handlers.warn import cmd_warn
 from bot.handlers.warm import track_admin_activity
-from bot.services.warm_scheduler import run_warm_scheduler
+from bot.services.warm_scheduler import setup_warm_jobs
+from bot.services.handoff_worker import start_handoff_workers, stop_handoff_workers
 from config.settings import ALLOWED_CHAT_IDS
 
 logging.basicConfig(
@@ -43,6 +44,16 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def _post_init(application: Application) -> None:
+    """事件循环就绪后注册调度任务并启动霜刃转交 worker"""
+    setup_warm_jobs(application)
+    start_handoff_workers(application.bot)
+
+
+async def _post_stop(application: Application) -> None:
+    await stop_handoff_workers()
+
+
 def main():
     if not TELEGRAM_BOT_TOKEN:
         env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -55,8 +66,20 @@ def main():
 
     init_db()
 
-    # job_queue(None) 避免 PTB 与 APScheduler 导致的 ExtBot 初始化错误
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).job_queue(None).build()
+    # concurrent_updates：所有处理器对不同 update 并发执行（PTB 默认最多 256 个），多人同时提问时并行处理，
+    # 相同提问由 chat_completion 合并为一次调用。并发安全性：
+    # - handle_message：AI 调用在线程中执行；同一用户连发两条时两次回复可能乱序，对话历史按完成顺序保存
+    # - 命令/回调：chat_data 的 awaiting_* 标志在同一次调用内同步读写，中间无 await
+    # - track_admin_activity（group -1，同一 update 内仍先于其他组执行）：重复跟发先占冷却再发送，避免并发重复触发
+    # - 暖群定时任务在 JobQueue 中运行，不受此项影响
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
@@ -100,8 +123,6 @@ def main():
         ),
     )
 
-    run_warm_scheduler()  # 始终启动（延迟删除 + 暖群）
-
     logger.info("Bot 启动中... (AI: %s, API: %s)", AI_PROVIDER, OPENAI_BASE_URL)
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
@@ -1,6 +1,8 @@
 """对话历史存储"""
+import json
 import sys
 import sqlite3
+import zlib
 from pathlib import Path
 
 
@@ -25,6 +27,10 @@ def get_connection():
 def init_db():
     """初始化数据库表"""
     conn = get_connection()
+    # 增量 VACUUM：删除后的空闲页可按需归还，文件大小随保留窗口有界。旧库需一次 VACUUM 才能切换模式
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,6 +45,28 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_messages_chat_user 
         ON messages(chat_id, user_id, created_at DESC)
     """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS context_summary (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            covered_until_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+    """)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS group_settings (
             chat_id INTEGER PRIMARY KEY,
@@ -93,7 +121,7 @@ def get_recent_messages(chat_id: int, user_id: int, limit: int = 10):
     conn = get_connection()
     rows = conn.execute(
         """
-        SELECT role, content FROM messages
+        SELECT id, role, content FROM messages
         WHERE chat_id = ? AND user_id = ?
         ORDER BY created_at DESC LIMIT ?
         """,
@@ -101,21 +129,142 @@ def get_recent_messages(chat_id: int, user_id: int, limit: int = 10):
     ).fetchall()
     conn.close()
     # 按时间正序返回
-    result = [{"role": row["role"], "content": row["content"]} for row in reversed(rows)]
+    result = [{"id": row["id"], "role": row["role"], "content": row["content"]} for row in reversed(rows)]
     return result
 
 
+def get_messages_between(chat_id: int, user_id: int, after_id: int, before_id: int):
+    """获取 after_id < id < before_id 的消息（按时间正序），用于生成滚动摘要"""
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT id, role, content FROM messages
+        WHERE chat_id = ? AND user_id = ? AND id > ? AND id < ?
+        ORDER BY id
+        """,
+        (chat_id, user_id, after_id, before_id),
+    ).fetchall()
+    conn.close()
+    return [{"id": row["id"], "role": row["role"], "content": row["content"]} for row in rows]
+
+
 def clear_context(chat_id: int, user_id: int):
-    """清除某用户的对话历史"""
+    """清除某用户的对话历史（含滚动摘要）"""
     conn = get_connection()
     conn.execute(
         "DELETE FROM messages WHERE chat_id = ? AND user_id = ?",
         (chat_id, user_id),
     )
+    conn.execute(
+        "DELETE FROM context_summary WHERE chat_id = ? AND user_id = ?",
+        (chat_id, user_id),
+    )
     conn.commit()
     conn.close()
 
 
+def get_context_summary(chat_id: int, user_id: int):
+    """获取滚动摘要，不存在返回 None。返回 {"summary": str, "covered_until_id": int}"""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT summary, covered_until_id FROM context_summary WHERE chat_id = ? AND user_id = ?",
+        (chat_id, user_id),
+    ).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def set_context_summary(chat_id: int, user_id: int, summary: str, covered_until_id: int) -> None:
+    """写入滚动摘要，covered_until_id 为摘要已覆盖的最后一条消息 id"""
+    conn = get_connection()
+    conn.execute(
+        """
+        INSERT INTO context_summary (chat_id, user_id, summary, covered_until_id, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(chat_id, user_id) DO UPDATE SET
+            summary = excluded.summary,
+            covered_until_id = excluded.covered_until_id,
+            updated_at = excluded.updated_at
+        """,
+        (chat_id, user_id, summary, covered_until_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def prune_messages(keep_rounds: int, archive: bool = False) -> int:
+    """
+    每个 (chat_id, user_id) 仅保留最近 keep_rounds 轮（user + assistant 各 1 条），返回移除条数。
+    archive=True 时被移除的消息以 zlib 压缩的 JSON 写入 messages_archive，否则直接删除。
+    每个 (chat_id, user_id) 单独提交，写锁只持有一组的时间，不阻塞正常对话的写入。
+    """
+    keep = max(1, keep_rounds) * 2
+    conn = get_connection()
+    removed = 0
+    try:
+        groups = conn.execute(
+            "SELECT chat_id, user_id FROM messages GROUP BY chat_id, user_id HAVING COUNT(*) > ?",
+            (keep,),
+        ).fetchall()
+        for g in groups:
+            chat_id, user_id = g["chat_id"], g["user_id"]
+            # 第 keep 新的消息 id 即保留下界，id 自增与写入顺序一致
+            cutoff = conn.execute(
+                "SELECT id FROM messages WHERE chat_id = ? AND user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (chat_id, user_id, keep - 1),
+            ).fetchone()
+            if not cutoff:
+                continue
+            if archive:
+                rows = conn.execute(
+                    "SELECT id, role, content, created_at FROM messages WHERE chat_id = ? AND user_id = ? AND id < ? ORDER BY id",
+                    (chat_id, user_id, cutoff["id"]),
+                ).fetchall()
+                if rows:
+                    payload = zlib.compress(json.dumps(
+                        [[r["role"], r["content"], r["created_at"]] for r in rows], ensure_ascii=False
+                    ).encode("utf-8"))
+                    conn.execute(
+                        "INSERT INTO messages_archive (chat_id, user_id, first_message_id, last_message_id, message_count, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                        (chat_id, user_id, rows[0]["id"], rows[-1]["id"], len(rows), payload),
+                    )
+            cur = conn.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND user_id = ? AND id < ?",
+                (chat_id, user_id, cutoff["id"]),
+            )
+            removed += cur.rowcount
+            conn.commit()
+    finally:
+        conn.close()
+    return removed
+
+
+def vacuum_incremental(max_pages: int = 0) -> int:
+    """增量 VACUUM，归还空闲页；max_pages=0 表示全部归还。返回执行前的空闲页数"""
+    conn = get_connection()
+    try:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free:
+            if max_pages > 0:
+                conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+            else:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+        return free
+    finally:
+        conn.close()
+
+
+def reindex_messages() -> None:
+    """重建对话表索引并刷新查询规划统计"""
+    conn = get_connection()
+    try:
+        conn.execute("REINDEX messages")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+    finally:
+        conn.close()
+
+
 def get_group_settings(chat_id: int):
     """获取群组配置，不存在返回 None"""
     conn = get_connection()
@@ -166,6 +315,10 @@ def set_group_settings(chat_id: int, custom_prompt=None, ai_provider=None, model
         )
     conn.commit()
     conn.close()
+    if custom_prompt is not None:
+        # 设定变更：丢弃已编译的二字索引（/xhadd、/xhdel、/set_prompt 均经由此处）
+        from bot.services.prompt_index import invalidate_prompt_index
+        invalidate_prompt_index(chat_id)
 
 
 def clear_group_model(chat_id: int):
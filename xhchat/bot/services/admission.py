@@ -0,0 +1,189 @@
+"""AI 调用准入控制 - 全局并发上限 + 有界优先级队列 + 请求截止时间 + 主模型熔断"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+from config.settings import (
+    AI_MAX_CONCURRENT,
+    AI_QUEUE_SIZE,
+    AI_REQUEST_DEADLINE_SECONDS,
+    BREAKER_COOLDOWN_SECONDS,
+    BREAKER_ERROR_RATE,
+    BREAKER_MIN_SAMPLES,
+    BREAKER_SLOW_RATE,
+    BREAKER_SLOW_SECONDS,
+    BREAKER_WINDOW,
+)
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越先出队
+PRIORITY_OWNER = 0
+PRIORITY_HANDOFF = 1
+PRIORITY_NORMAL = 2
+PRIORITY_BACKGROUND = 3
+
+
+class AdmissionRejected(Exception):
+    """队列已满或排队超过截止时间"""
+
+
+class AdmissionController:
+    """线程安全；调用方在线程中（asyncio.to_thread / 暖群调度线程）阻塞等待名额"""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: list[list] = []  # 堆：[priority, seq, ticket_id]
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_NORMAL, deadline: Optional[float] = None):
+        """取得一个调用名额；deadline 为 time.monotonic() 时间点，过期仍未轮到则抛 AdmissionRejected"""
+        self._acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _acquire(self, priority: int, deadline: Optional[float]) -> None:
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self.admitted += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("AI 请求队列已满")
+            entry = [priority, next(self._seq), None]
+            heapq.heappush(self._waiting, entry)
+            while not (self._waiting[0] is entry and self._active < self.max_concurrent):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.timed_out += 1
+                    self._cond.notify_all()
+                    raise AdmissionRejected("AI 请求排队超时")
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self.admitted += 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._waiting),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+class CircuitBreaker:
+    """
+    按最近 window 次调用的失败率与慢调用率判断：任一超阈值即熔断 cooldown 秒，
+    期间请求改走备用模型；冷却结束后放行一次试探，成功则恢复，失败则继续熔断；
+    试探未真正发出（排队超时、组装消息出错等）时调用方须 release_probe()，否则半开状态会一直占用
+    """
+
+    def __init__(self, window: int, min_samples: int, error_rate: float,
+                 slow_seconds: float, slow_rate: float, cooldown_seconds: float):
+        self.min_samples = min_samples
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._samples: deque[tuple[bool, float]] = deque(maxlen=max(1, window))
+        self._open_until = 0.0
+        self._probing = False
+        self._probe_thread = 0
+        self._lock = threading.Lock()
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """是否可调用主模型"""
+        with self._lock:
+            if not self._open_until:
+                return True
+            if time.monotonic() < self._open_until or self._probing:
+                return False
+            self._probing = True  # 半开：放行一次试探
+            self._probe_thread = threading.get_ident()
+            return True
+
+    def release_probe(self) -> None:
+        """本线程拿到的试探没有调用到主模型：归还试探名额，下一个请求可重新试探（非本线程的试探不受影响）"""
+        with self._lock:
+            if self._probing and self._probe_thread == threading.get_ident():
+                self._probing = False
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                if ok and latency < self.slow_seconds:
+                    self._open_until = 0.0
+                    self._samples.clear()
+                    logger.info("熔断恢复：主模型试探成功 (%.1fs)", latency)
+                else:
+                    self._open_until = time.monotonic() + self.cooldown_seconds
+                return
+            self._samples.append((ok, latency))
+            n = len(self._samples)
+            if self._open_until or n < self.min_samples:
+                return
+            errors = sum(1 for s_ok, _ in self._samples if not s_ok)
+            slow = sum(1 for s_ok, lat in self._samples if s_ok and lat >= self.slow_seconds)
+            if errors / n >= self.error_rate or slow / n >= self.slow_rate:
+                self._open_until = time.monotonic() + self.cooldown_seconds
+                self.trips += 1
+                logger.warning("熔断开启：最近 %d 次失败 %d、慢调用 %d，%ss 内改用备用模型",
+                               n, errors, slow, self.cooldown_seconds)
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return bool(self._open_until)
+
+
+admission = AdmissionController(AI_MAX_CONCURRENT, AI_QUEUE_SIZE)
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key: str) -> CircuitBreaker:
+    """每个主模型地址一个熔断器"""
+    with _breakers_lock:
+        br = _breakers.get(key)
+        if br is None:
+            br = CircuitBreaker(BREAKER_WINDOW, BREAKER_MIN_SAMPLES, BREAKER_ERROR_RATE,
+                                BREAKER_SLOW_SECONDS, BREAKER_SLOW_RATE, BREAKER_COOLDOWN_SECONDS)
+            _breakers[key] = br
+        return br
+
+
+def new_deadline() -> float:
+    return time.monotonic() + AI_REQUEST_DEADLINE_SECONDS
+
+
+def get_admission_stats() -> dict:
+    st = admission.stats()
+    with _breakers_lock:
+        st["breaker_open"] = [k for k, br in _breakers.items() if br.is_open()]
+        st["breaker_trips"] = sum(br.trips for br in _breakers.values())
+    return st
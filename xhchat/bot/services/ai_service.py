@@ -1,6 +1,7 @@
 """AI 服务 - 按 chat_id 读取配置，支持多模型"""
 import json
-import random
+import threading
+import time
 from datetime import datetime
 from typing import Optional
 
@@ -11,13 +12,41 @@ try:
 except ImportError:
     ZoneInfo = None
 
-from bot.services.group_config import get_use_web_search
+from bot.services.admission import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_NORMAL,
+    AdmissionRejected,
+    admission,
+    get_breaker,
+    new_deadline,
+)
+from bot.services.group_config import get_preset_config, get_use_web_search
+from bot.services.prompt_index import get_prompt_index
+from bot.services.response_cache import make_key, normalize_query, prompt_version, response_cache
+from bot.services.single_flight import SingleFlight
+from bot.services.token_budget import MESSAGE_OVERHEAD_TOKENS, count_tokens, fit_messages, truncate_lines
+from config.settings import (
+    AI_FALLBACK_PRESET,
+    CONTEXT_TOKEN_BUDGET,
+    SINGLE_FLIGHT_ENABLED,
+    SINGLE_FLIGHT_WINDOW_SECONDS,
+    SUMMARY_MAX_CHARS,
+)
 
 
 def _get_client(base_url: str, api_key: str) -> OpenAI:
     return OpenAI(api_key=api_key or "sk-none", base_url=base_url)
 
 
+def _client_for_config(cfg: dict) -> OpenAI:
+    """按 get_ai_config 的结果创建客户端"""
+    api_key = cfg["api_key"]
+    # Ollama 本地可接受任意 api_key
+    if cfg["ai_provider"] == "ollama":
+        api_key = api_key or "ollama"
+    return _get_client(cfg["base_url"], api_key)
+
+
 def _get_current_time_prompt() -> str:
     if ZoneInfo:
         now = datetime.now(ZoneInfo("Asia/Shanghai"))
@@ -30,6 +59,12 @@ SYSTEM_PROMPT_BASE = """你是一个友好的 AI 助手，在 Telegram 群聊中
 回复要简洁、有用，适合群聊场景，不超过1000字。适当使用 emoji，如果问题过于复杂，可以建议用户私聊进一步讨论。
 当用户询问天气、实时新闻等需要最新信息的问题时，请使用联网搜索获取准确数据。采用UTC+8时区"""
 
+# 自定义设定最多占用上下文预算的比例，其余留给摘要与历史对话
+CUSTOM_PROMPT_BUDGET_RATIO = 0.5
+
+SUMMARY_PROMPT = """请将以下群聊对话压缩为一段不超过 {max_chars} 字的摘要，供后续对话参考。
+保留用户身份、偏好、已确认的事实与未解决的问题，省略寒暄。只输出摘要正文。"""
+
 WEB_SEARCH_TOOLS = [{"type": "builtin_function", "function": {"name": "$web_search"}}]
 
 
@@ -37,53 +72,88 @@ def _web_search_impl(arguments: dict) -> dict:
     return arguments
 
 
+_single_flight = SingleFlight(SINGLE_FLIGHT_WINDOW_SECONDS)
+
+# 提示词缓存命中统计（从各家 usage 字段解析）
+_cache_stats_lock = threading.Lock()
+_cache_stats = {"requests": 0, "hit_requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+def _cached_tokens_from_usage(usage) -> int:
+    """
+    从 usage 中提取命中缓存的 prompt token 数：
+    - OpenAI 兼容：usage.prompt_tokens_details.cached_tokens
+    - Kimi：usage.cached_tokens
+    - DeepSeek：usage.prompt_cache_hit_tokens
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    try:
+        return int(cached or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _record_usage(response) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    cached = _cached_tokens_from_usage(usage)
+    with _cache_stats_lock:
+        _cache_stats["requests"] += 1
+        _cache_stats["prompt_tokens"] += prompt_tokens
+        _cache_stats["cached_tokens"] += cached
+        if cached > 0:
+            _cache_stats["hit_requests"] += 1
+
+
+def get_prompt_cache_stats() -> dict:
+    """返回提示词缓存统计：请求数、命中请求数、prompt/缓存 token 及命中率"""
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    total = stats["prompt_tokens"]
+    stats["token_hit_rate"] = stats["cached_tokens"] / total if total else 0.0
+    return stats
+
+
 def _chat_with_tools(client: OpenAI, messages: list[dict], model: str):
     response = client.chat.completions.create(
         model=model, messages=messages, temperature=0.6, max_tokens=4096, tools=WEB_SEARCH_TOOLS
     )
+    _record_usage(response)
     return response.choices[0]
 
 
-def _select_prompts_for_message(custom_prompt: str, user_message: str) -> str:
+def _select_prompts_for_message(custom_prompt: str, user_message: str, chat_id: int = 0) -> str:
     """
     根据用户消息选择 prompt：
-    - 有匹配时：全部采用匹配的 prompt；若不足 1/3 则从非匹配中随机补齐到 1/3；若超过 1/3 则全部采用
+    - 有匹配时：全部采用匹配的 prompt；若不足 1/3 则按原顺序从非匹配中补齐到 1/3；若超过 1/3 则全部采用
     - 无匹配时：不采用
+    匹配规则：用户消息的任一两字子串出现在该行。设定按群编译为二字倒排索引并缓存，
+    输出保持设定文件中的原始顺序，便于命中提供商的提示词缓存
     """
-    lines = [ln.strip() for ln in custom_prompt.split("\n") if ln.strip()]
-    if not lines:
-        return ""
-
-    def has_match(line: str, msg: str) -> bool:
-        """检查用户消息是否有 2+ 字符的子串出现在该行"""
-        if len(msg) < 2:
-            return False
-        for i in range(len(msg) - 1):
-            sub = msg[i : i + 2]  # 两字匹配
-            if sub in line:
-                return True
-        return False
-
-    matches = [ln for ln in lines if has_match(ln, user_message)]
-    target = max(1, (len(lines) + 2) // 3)  # 1/3，至少 1 条
-
-    if matches:
-        selected = list(matches)
-        if len(selected) < target:
-            rest = [ln for ln in lines if ln not in matches]
-            need = target - len(selected)
-            if rest:
-                selected.extend(random.sample(rest, min(need, len(rest))))
-        return "\n".join(selected)
-    return ""
+    return get_prompt_index(chat_id, custom_prompt).select(user_message)
 
 
 def _build_full_system_prompt(custom_prompt: str, user_full_name: Optional[str] = None) -> str:
-    parts = [SYSTEM_PROMPT_BASE, _get_current_time_prompt()]
+    """
+    固定内容在前（基础提示、设定），易变内容在后（当前时间、用户名），
+    使同一群的请求共享尽可能长的前缀，命中提供商的提示词缓存
+    """
+    parts = [SYSTEM_PROMPT_BASE]
+    if custom_prompt:
+        parts.append(f"【你的设定，请严格遵守】\n{custom_prompt}")
+    parts.append(_get_current_time_prompt())
     if user_full_name:
         parts.append(f"当前与你对话的用户名叫「{user_full_name}」，在合适的时候可以用名字称呼对方。")
-    if custom_prompt:
-        parts.append(f"\n\n【你的设定，请严格遵守】\n{custom_prompt}")
     return "\n\n".join(parts)
 
 
@@ -92,14 +162,19 @@ def chat_completion(
     chat_id: int = 0,
     user_full_name: Optional[str] = None,
     user_message: Optional[str] = None,
+    cacheable: bool = True,
+    priority: int = PRIORITY_NORMAL,
 ) -> str:
     """
     调用 AI 生成回复
     chat_id: 群组/私聊 ID，用于读取该会话的配置（模型、custom_prompt）
     user_message: 当前用户消息，用于 prompt 匹配；未传则从 messages 最后一条提取
+    cacheable: 是否允许走回复缓存（依赖上文的对话如回复机器人消息时传 False）
+    priority: 准入排队优先级（所有者、霜刃转交优先），排队满或超时抛 AdmissionRejected
     """
     from bot.services.group_config import get_ai_config, get_global_custom_prompt, get_group_custom_prompt
 
+    deadline = new_deadline()
     cfg = get_ai_config(chat_id)
     # 提取当前用户消息（用于 prompt 匹配）
     if user_message is None and messages:
@@ -113,28 +188,110 @@ def chat_completion(
     # 群组有设定：按匹配选择；无匹配则取全局
     # 群组无设定：直接使用完整全局设定
     if group_prompt:
-        selected = _select_prompts_for_message(group_prompt, user_msg)
+        selected = _select_prompts_for_message(group_prompt, user_msg, chat_id=chat_id)
         custom_prompt = selected if selected else global_prompt
     else:
         custom_prompt = global_prompt or ""
 
-    base_url = cfg["base_url"]
-    api_key = cfg["api_key"]
     model = cfg["model_name"]
     use_web_search = cfg["use_web_search"] and get_use_web_search()
 
-    # Ollama 本地可接受任意 api_key
-    if cfg["ai_provider"] == "ollama":
-        api_key = api_key or "ollama"
-
-    client = _get_client(base_url, api_key)
-
     # Kimi 且联网搜索时用 kimi-k2
     if use_web_search:
         model = "kimi-k2-turbo-preview"
 
-    full_messages = [{"role": "system", "content": _build_full_system_prompt(custom_prompt, user_full_name)}] + messages
+    # 回复缓存（可选）：同群同模型同设定下的相同提问直接返回；联网搜索的回复依赖实时结果，不缓存
+    prompt_source = group_prompt or global_prompt or ""
+    cache_key = make_key(chat_id, model, prompt_source, user_msg, use_web_search) if cacheable else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # 请求合并：同群同设定的相同提问并发到达时共用一次调用，各调用方仍各自回复自己的消息；
+    # 与回复缓存一致，不区分各人的上文；回复里带了发起人名字的不共用，其余调用方各自生成
+    norm_query = normalize_query(user_msg)
+    if SINGLE_FLIGHT_ENABLED and cacheable and norm_query:
+        flight_key = (chat_id, norm_query, prompt_version(prompt_source))
+        return _single_flight.do(
+            flight_key, _generate_reply, cfg, model, use_web_search, custom_prompt,
+            messages, user_full_name, cache_key, priority, deadline,
+            shareable=lambda reply: not (user_full_name and user_full_name in reply),
+        )
+    return _generate_reply(
+        cfg, model, use_web_search, custom_prompt, messages, user_full_name, cache_key, priority, deadline
+    )
+
+
+def get_single_flight_stats() -> dict:
+    """请求合并统计：leaders 实际调用次数，shared 共享结果次数，unshared 因回复含发起人名字而各自重新调用的次数"""
+    return _single_flight.stats()
+
+
+def _generate_reply(
+    cfg: dict,
+    model: str,
+    use_web_search: bool,
+    custom_prompt: str,
+    messages: list[dict],
+    user_full_name: Optional[str],
+    cache_key: Optional[tuple],
+    priority: int,
+    deadline: float,
+) -> str:
+    fallback = get_preset_config(AI_FALLBACK_PRESET) if AI_FALLBACK_PRESET else None
+    breaker = get_breaker(cfg["base_url"]) if fallback and fallback["base_url"] != cfg["base_url"] else None
+    with admission.slot(priority, deadline):
+        # 取得名额后再问熔断器：排队被拒时不会占用半开试探
+        # 主模型熔断中：改用备用预置方案（不联网、不写缓存）
+        if breaker and not breaker.allow():
+            cfg, model, use_web_search = fallback, fallback["model_name"], False
+            breaker, cache_key = None, None
+        try:
+            full_messages = _prepare_messages(cfg, custom_prompt, messages, user_full_name)
+            client = _client_with_deadline(cfg, deadline)
+            start = time.monotonic()
+            try:
+                reply = _request_reply(client, model, full_messages, use_web_search)
+            except Exception:
+                if breaker:
+                    breaker.record(False, time.monotonic() - start)
+                    breaker = None
+                raise
+            if breaker:
+                breaker.record(True, time.monotonic() - start)
+                breaker = None
+        finally:
+            # 未调用到主模型就失败（截止时间已过、组装消息出错）：归还试探，不计入统计
+            if breaker:
+                breaker.release_probe()
+    # 回复里带了用户名的不缓存，避免对下一个人叫错名字
+    if cache_key and reply and not (user_full_name and user_full_name in reply):
+        response_cache.put(cache_key, reply)
+    return reply
 
+
+def _prepare_messages(cfg: dict, custom_prompt: str, messages: list[dict], user_full_name: Optional[str]) -> list[dict]:
+    """按 token 预算裁剪：设定最多占一半，剩余给摘要与历史（最早的先丢弃）"""
+    budget = cfg.get("context_budget") or 0
+    if budget > 0:
+        custom_prompt = truncate_lines(custom_prompt, int(budget * CUSTOM_PROMPT_BUDGET_RATIO))
+    system_prompt = _build_full_system_prompt(custom_prompt, user_full_name)
+    if budget > 0:
+        messages = fit_messages(messages, max(0, budget - count_tokens(system_prompt)))
+    return [{"role": "system", "content": system_prompt}] + messages
+
+
+def _client_with_deadline(cfg: dict, deadline: float) -> OpenAI:
+    """取得名额后按剩余时间设置超时，保证排队 + 调用总耗时不超过截止时间"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise AdmissionRejected("AI 请求排队超时")
+    return _client_for_config(cfg).with_options(timeout=remaining)
+
+
+def _request_reply(client: OpenAI, model: str, full_messages: list[dict], use_web_search: bool) -> str:
+    """发起请求；联网搜索时循环处理 tool_calls 直到得到最终回复"""
     if use_web_search:
         finish_reason = None
         while finish_reason is None or finish_reason == "tool_calls":
@@ -162,4 +319,49 @@ def chat_completion(
         response = client.chat.completions.create(
             model=model, messages=full_messages, max_tokens=1024, temperature=0.7
         )
+        _record_usage(response)
         return (response.choices[0].message.content or "").strip()
+
+
+def summarize_conversation(previous_summary: str, messages: list[dict], chat_id: int = 0) -> tuple[str, int]:
+    """
+    将旧摘要与新一批对话合并为滚动摘要（后台优先级排队）
+    按当前方案的 context_budget 只取最早的、放得下的一段消息（单条过长时截断），
+    返回 (摘要, 本次覆盖的消息条数)，调用方按条数推进已摘要位置，剩余的下次再合并
+    """
+    from bot.services.group_config import get_ai_config
+
+    cfg = get_ai_config(chat_id)
+    system_prompt = SUMMARY_PROMPT.format(max_chars=SUMMARY_MAX_CHARS)
+    lines = []
+    if previous_summary:
+        lines.append(f"【已有摘要】{previous_summary}")
+    budget = (cfg.get("context_budget") or CONTEXT_TOKEN_BUDGET) - count_tokens(system_prompt) - count_tokens(
+        "\n".join(lines)) - 2 * MESSAGE_OVERHEAD_TOKENS
+    used = taken = 0
+    for m in messages:
+        who = "用户" if m.get("role") == "user" else "助理"
+        line = f"{who}：{m.get('content') or ''}"
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            if not taken:
+                lines.append(line[:max(0, budget)])
+                taken = 1
+            break
+        lines.append(line)
+        used += cost
+        taken += 1
+    deadline = new_deadline()
+    with admission.slot(PRIORITY_BACKGROUND, deadline):
+        client = _client_with_deadline(cfg, deadline)
+        response = client.chat.completions.create(
+            model=cfg["model_name"],
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": "\n".join(lines)},
+            ],
+            max_tokens=SUMMARY_MAX_CHARS * 2,
+            temperature=0.3,
+        )
+    _record_usage(response)
+    return (response.choices[0].message.content or "").strip()[:SUMMARY_MAX_CHARS * 2], taken
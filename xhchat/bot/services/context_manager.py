@@ -1,29 +1,52 @@
 """对话上下文管理"""
-from collections import defaultdict
-from datetime import datetime, timedelta
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
 from typing import Optional
 
-from bot.models.database import add_message, get_recent_messages
-from config.settings import MAX_CONTEXT_MESSAGES, RATE_LIMIT_PER_MINUTE
+from bot.models.database import (
+    add_message,
+    get_recent_messages,
+    get_messages_between,
+    get_context_summary,
+    set_context_summary,
+)
+from config.settings import (
+    MAX_CONTEXT_MESSAGES,
+    RATE_LIMIT_PER_MINUTE,
+    SUMMARY_ENABLED,
+    SUMMARY_REFRESH_MESSAGES,
+    SUMMARY_RETRY_SECONDS,
+)
+
+# xhbot 根目录下与霜刃共用的模块（handoff、window_counter）
+_XHBOT_ROOT = Path(__file__).resolve().parents[3]
+if str(_XHBOT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_XHBOT_ROOT))
+from window_counter import WindowCounter  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "【此前对话摘要】\n"
+
+# 滚动摘要：同一用户同时只刷新一次；失败后 SUMMARY_RETRY_SECONDS 内不再重试
+_summary_lock = threading.Lock()
+_summary_inflight: set[tuple[int, int]] = set()
+_summary_retry_at: dict[tuple[int, int], float] = {}
 
 
 class RateLimiter:
-    """简单的按分钟限流"""
+    """按分钟限流：每个用户只保留最近 max_per_minute 次请求时间，一分钟无请求的用户自动回收"""
 
     def __init__(self, max_per_minute: int = 5):
         self.max_per_minute = max_per_minute
-        self.requests: dict[tuple[int, int], list[datetime]] = defaultdict(list)
+        self._counter = WindowCounter(60, max_per_minute)
 
     def check(self, chat_id: int, user_id: int) -> bool:
         """检查是否超限，未超限则记录一次请求"""
-        key = (chat_id, user_id)
-        now = datetime.now()
-        cutoff = now - timedelta(minutes=1)
-        self.requests[key] = [t for t in self.requests[key] if t > cutoff]
-        if len(self.requests[key]) >= self.max_per_minute:
-            return False
-        self.requests[key].append(now)
-        return True
+        return self._counter.allow((chat_id, user_id))
 
 
 rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE)
@@ -34,11 +57,16 @@ def build_messages_for_ai(
 ) -> list[dict]:
     """
     构建发送给 AI 的消息列表
-    包含历史上下文 + 当前用户问题
+    包含滚动摘要（如有）+ 历史上下文 + 当前用户问题，按 token 预算的裁剪在 chat_completion 中进行
     当用户回复机器人某条消息时，reply_to_assistant 为该条消息内容，会作为上一条 assistant 注入上下文
     """
     history = get_recent_messages(chat_id, user_id, MAX_CONTEXT_MESSAGES)
-    messages = [{"role": m["role"], "content": m["content"]} for m in history]
+    messages = []
+    if SUMMARY_ENABLED:
+        summary = get_context_summary(chat_id, user_id)
+        if summary and summary.get("summary"):
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + summary["summary"]})
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history)
     if reply_to_assistant and reply_to_assistant.strip():
         messages.append({"role": "assistant", "content": reply_to_assistant.strip()})
     messages.append({"role": "user", "content": user_query})
@@ -49,3 +77,50 @@ def save_exchange(chat_id: int, user_id: int, user_content: str, assistant_conte
     """保存一轮对话"""
     add_message(chat_id, user_id, "user", user_content)
     add_message(chat_id, user_id, "assistant", assistant_content)
+
+
+def maybe_refresh_summary(chat_id: int, user_id: int) -> bool:
+    """
+    滚动摘要：上下文窗口之外、尚未被摘要覆盖的消息累计达到 SUMMARY_REFRESH_MESSAGES 条时，
+    与旧摘要合并生成新摘要。未达阈值直接返回，不调用 AI。返回是否刷新
+    每次只合并 token 预算放得下的一段（从最早的开始），积压较多时随后续回复分段推进；
+    同一用户已在刷新中则跳过，失败后 SUMMARY_RETRY_SECONDS 内不重试
+    """
+    if not SUMMARY_ENABLED:
+        return False
+    key = (chat_id, user_id)
+    with _summary_lock:
+        if key in _summary_inflight or _summary_retry_at.get(key, 0) > time.monotonic():
+            return False
+        _summary_inflight.add(key)
+    try:
+        ok = _refresh_summary(chat_id, user_id)
+    except Exception:
+        with _summary_lock:
+            _summary_retry_at[key] = time.monotonic() + SUMMARY_RETRY_SECONDS
+        raise
+    finally:
+        with _summary_lock:
+            _summary_inflight.discard(key)
+    with _summary_lock:
+        _summary_retry_at.pop(key, None)
+    return ok
+
+
+def _refresh_summary(chat_id: int, user_id: int) -> bool:
+    recent = get_recent_messages(chat_id, user_id, MAX_CONTEXT_MESSAGES)
+    if not recent:
+        return False
+    window_start = min(m["id"] for m in recent)
+    summary = get_context_summary(chat_id, user_id)
+    covered = summary["covered_until_id"] if summary else 0
+    pending = get_messages_between(chat_id, user_id, covered, window_start)
+    if len(pending) < SUMMARY_REFRESH_MESSAGES:
+        return False
+    from bot.services.ai_service import summarize_conversation
+    text, taken = summarize_conversation(summary["summary"] if summary else "", pending, chat_id=chat_id)
+    if not text or not taken:
+        return False
+    set_context_summary(chat_id, user_id, text, pending[taken - 1]["id"])
+    logger.info("滚动摘要已刷新: chat_id=%s user_id=%s 合并 %d/%d 条", chat_id, user_id, taken, len(pending))
+    return True
@@ -6,6 +6,7 @@ from typing import Optional
 from bot.models.database import get_group_settings
 from config.settings import (
     AI_PROVIDER,
+    CONTEXT_TOKEN_BUDGET,
     CUSTOM_PROMPT_FILE,
     CUSTOM_SYSTEM_PROMPT,
     ENABLE_WEB_SEARCH,
@@ -14,55 +15,63 @@ from config.settings import (
     OPENAI_BASE_URL,
 )
 
-# 预置模型方案
+# 预置模型方案（context_budget：输入上下文 token 预算，控制 prompt 大小与首字延迟）
 PRESET_MODELS = {
     "kimi": {
         "ai_provider": "kimi",
         "model_name": "moonshot-v1-128k",
         "base_url": "https://api.moonshot.cn/v1",
         "api_key": None,  # 用全局
+        "context_budget": 8000,
     },
     "kimi-k2": {
         "ai_provider": "kimi",
         "model_name": "kimi-k2-turbo-preview",
         "base_url": "https://api.moonshot.cn/v1",
         "api_key": None,
+        "context_budget": 8000,
     },
     "ollama-qwen": {
         "ai_provider": "ollama",
         "model_name": "qwen2.5",  # 需先执行 ollama pull qwen2.5
         "base_url": "http://localhost:11434/v1",
         "api_key": "ollama",
+        "context_budget": 3000,
     },
     "ollama-qwen3-vl": {
         "ai_provider": "ollama",
         "model_name": "qwen3-vl:8b",
         "base_url": "http://localhost:11434/v1",
         "api_key": "ollama",
+        "context_budget": 3000,
     },
     "ollama-gemma3": {
         "ai_provider": "ollama",
         "model_name": "gemma3:4b",
         "base_url": "http://localhost:11434/v1",
         "api_key": "ollama",
+        "context_budget": 3000,
     },
     "ollama-llama": {
         "ai_provider": "ollama",
         "model_name": "llama3.2",  # 需先执行 ollama pull llama3.2
         "base_url": "http://localhost:11434/v1",
         "api_key": "ollama",
+        "context_budget": 3000,
     },
     "openai": {
         "ai_provider": "openai",
         "model_name": "gpt-4o-mini",
         "base_url": "https://api.openai.com/v1",
         "api_key": None,
+        "context_budget": 8000,
     },
     "deepseek": {
         "ai_provider": "deepseek",
         "model_name": "deepseek-chat",
         "base_url": "https://api.deepseek.com/v1",
         "api_key": None,
+        "context_budget": 8000,
     },
 }
 
@@ -104,7 +113,7 @@ def get_custom_prompt(chat_id: int) -> str:
 def get_ai_config(chat_id: int) -> dict:
     """
     获取 AI 配置：群组优先，否则全局
-    返回: ai_provider, model_name, base_url, api_key, use_web_search
+    返回: ai_provider, model_name, base_url, api_key, use_web_search, context_budget
     """
     gs = get_group_settings(chat_id)
     if gs and gs.get("ai_provider"):
@@ -113,6 +122,7 @@ def get_ai_config(chat_id: int) -> dict:
         base_url = gs.get("openai_base_url")
         api_key = gs.get("openai_api_key")
         preset = PRESET_MODELS.get(provider)
+        budget = _preset_budget(provider, model)
         if preset:
             model = model or preset["model_name"]
             base_url = base_url or preset["base_url"]
@@ -128,6 +138,7 @@ def get_ai_config(chat_id: int) -> dict:
             "base_url": base_url,
             "api_key": api_key,
             "use_web_search": provider == "kimi",
+            "context_budget": budget,
         }
     return {
         "ai_provider": AI_PROVIDER,
@@ -135,9 +146,40 @@ def get_ai_config(chat_id: int) -> dict:
         "base_url": OPENAI_BASE_URL,
         "api_key": OPENAI_API_KEY,
         "use_web_search": AI_PROVIDER == "kimi",
+        "context_budget": _preset_budget(AI_PROVIDER, MODEL_NAME),
     }
 
 
+def get_preset_config(preset_id: str) -> Optional[dict]:
+    """按预置方案 id 返回与 get_ai_config 同结构的配置，不存在返回 None"""
+    preset = PRESET_MODELS.get(preset_id)
+    if not preset:
+        return None
+    provider = preset["ai_provider"]
+    api_key = preset.get("api_key")
+    if api_key is None:
+        api_key = OPENAI_API_KEY if provider != "ollama" else "ollama"
+    return {
+        "ai_provider": provider,
+        "model_name": preset["model_name"],
+        "base_url": preset["base_url"],
+        "api_key": api_key,
+        "use_web_search": False,
+        "context_budget": preset.get("context_budget") or CONTEXT_TOKEN_BUDGET,
+    }
+
+
+def _preset_budget(provider: str, model: Optional[str]) -> int:
+    """按模型名匹配预置方案的 context_budget，其次按 provider，均无则用全局 CONTEXT_TOKEN_BUDGET"""
+    for preset in PRESET_MODELS.values():
+        if model and preset["model_name"] == model:
+            return preset.get("context_budget") or CONTEXT_TOKEN_BUDGET
+    preset = PRESET_MODELS.get(provider)
+    if preset:
+        return preset.get("context_budget") or CONTEXT_TOKEN_BUDGET
+    return CONTEXT_TOKEN_BUDGET
+
+
 def get_use_web_search() -> bool:
     """联网搜索开关：优先读数据库（私聊 /web_search 设置），否则用 .env 的 ENABLE_WEB_SEARCH"""
     from bot.models.database import get_global_config
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""霜刃转交：在主事件循环上由多个协程并发回答，不占用调度线程"""
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Bot
+
+from config.settings import ALLOWED_CHAT_IDS, HANDOFF_CONCURRENCY, HANDOFF_POLL_INTERVAL
+from bot.services.admission import PRIORITY_HANDOFF, AdmissionRejected
+from bot.services.ai_service import chat_completion
+from bot.services.context_manager import build_messages_for_ai, maybe_refresh_summary, save_exchange
+from bot.services.text_utils import replace_emoji_digits
+
+logger = logging.getLogger(__name__)
+
+_tasks: list[asyncio.Task] = []
+_queue: Optional[asyncio.Queue] = None
+
+
+async def _answer_handoff(bot: Bot, req: dict) -> None:
+    """回答一条转交：调用 AI → 保存 → 回复原消息 → 刷新滚动摘要"""
+    chat_id = req["chat_id"]
+    reply_to_id = req["reply_to_message_id"]
+    question = req["question"]
+    if chat_id not in ALLOWED_CHAT_IDS:
+        logger.warning("handoff: 跳过非允许群 chat_id=%s", chat_id)
+        return
+    messages = await asyncio.to_thread(build_messages_for_ai, chat_id, 0, question)
+    reply = await asyncio.to_thread(
+        chat_completion,
+        messages,
+        chat_id=chat_id,
+        user_full_name="用户",
+        user_message=question,
+        priority=PRIORITY_HANDOFF,
+    )
+    reply = replace_emoji_digits(reply or "")
+    await asyncio.to_thread(save_exchange, chat_id, 0, question, reply)
+    await bot.send_message(
+        chat_id=chat_id,
+        text=reply,
+        reply_to_message_id=reply_to_id,
+    )
+    logger.info("handoff: 已代为回复 chat_id=%s reply_to=%s", chat_id, reply_to_id)
+    try:
+        await asyncio.to_thread(maybe_refresh_summary, chat_id, 0)
+    except Exception as e:
+        logger.warning("handoff: 滚动摘要刷新失败 %s", e)
+
+
+async def _worker(bot: Bot, queue: asyncio.Queue, idle: asyncio.Semaphore, idx: int) -> None:
+    while True:
+        req = await queue.get()
+        try:
+            await _answer_handoff(bot, req)
+        except AdmissionRejected as e:
+            logger.warning("handoff: 准入拒绝 chat_id=%s: %s", req.get("chat_id"), e)
+        except Exception as e:
+            logger.warning("handoff 处理失败 (worker %d): %s", idx, e)
+        finally:
+            queue.task_done()
+            idle.release()
+
+
+async def _poller(queue: asyncio.Queue, idle: asyncio.Semaphore) -> None:
+    """轮询 handoff 文件；先占一个空闲 worker 名额再取出，每条取出的请求都有 worker 立即接手，其余留在文件中"""
+    try:
+        from handoff import take_handoff
+    except ImportError:
+        logger.info("handoff 模块不可用，转交 worker 未启动")
+        return
+    while True:
+        await idle.acquire()
+        try:
+            req = await asyncio.to_thread(take_handoff)
+        except Exception as e:
+            logger.warning("handoff: 读取失败 %s", e)
+            req = None
+        if req:
+            queue.put_nowait(req)
+            continue
+        idle.release()
+        await asyncio.sleep(HANDOFF_POLL_INTERVAL)
+
+
+def start_handoff_workers(bot: Bot, concurrency: Optional[int] = None) -> None:
+    """在当前事件循环上启动 1 个轮询协程 + concurrency 个回答协程（供 post_init 调用）"""
+    global _queue
+    n = max(1, concurrency or HANDOFF_CONCURRENCY)
+    _queue = asyncio.Queue()
+    idle = asyncio.Semaphore(n)  # 空闲 worker 数：队列中的请求不会多于它
+    loop = asyncio.get_running_loop()
+    _tasks.append(loop.create_task(_poller(_queue, idle), name="handoff_poller"))
+    for i in range(n):
+        _tasks.append(loop.create_task(_worker(bot, _queue, idle, i), name=f"handoff_worker_{i}"))
+    logger.info("霜刃转交 worker 已启动（并发 %d）", n)
+
+
+async def stop_handoff_workers() -> None:
+    """取消所有转交协程（供 post_stop 调用）；已取出但还没有 worker 接手的请求写回 handoff 文件"""
+    global _queue
+    for t in _tasks:
+        t.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    if _queue is None:
+        return
+    pending = []
+    while not _queue.empty():
+        pending.append(_queue.get_nowait())
+    _queue = None
+    if not pending:
+        return
+    from handoff import put_handoff
+    for req in pending:
+        await asyncio.to_thread(put_handoff, req["chat_id"], req["reply_to_message_id"], req["question"])
+    logger.info("handoff: 停止时写回 %d 条未处理的转交", len(pending))
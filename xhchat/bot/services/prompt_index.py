@@ -0,0 +1,70 @@
+"""群设定的二字倒排索引 - 设定变更前只编译一次，选择时按用户消息的二字组合并"""
+import threading
+from typing import Optional
+
+
+class PromptIndex:
+    """把设定按行拆开，建立 二字 -> 行号 的倒排索引"""
+
+    def __init__(self, prompt: str):
+        self.source = prompt
+        self.lines = [ln.strip() for ln in prompt.split("\n") if ln.strip()]
+        self.bigrams: dict[str, list[int]] = {}
+        for idx, line in enumerate(self.lines):
+            for gram in {line[i : i + 2] for i in range(len(line) - 1)}:
+                self.bigrams.setdefault(gram, []).append(idx)
+
+    def match(self, message: str) -> set[int]:
+        """返回与消息共享任一二字子串的行号"""
+        hit: set[int] = set()
+        if len(message) < 2:
+            return hit
+        for gram in {message[i : i + 2] for i in range(len(message) - 1)}:
+            ids = self.bigrams.get(gram)
+            if ids:
+                hit.update(ids)
+        return hit
+
+    def select(self, message: str) -> str:
+        """
+        - 有匹配时：全部采用匹配的行；若不足 1/3 则按原顺序从非匹配中补齐到 1/3
+        - 无匹配时：返回空
+        输出保持原始行序
+        """
+        if not self.lines:
+            return ""
+        selected = self.match(message)
+        if not selected:
+            return ""
+        target = max(1, (len(self.lines) + 2) // 3)  # 1/3，至少 1 条
+        if len(selected) < target:
+            for idx in range(len(self.lines)):
+                if len(selected) >= target:
+                    break
+                selected.add(idx)
+        return "\n".join(self.lines[i] for i in sorted(selected))
+
+
+_lock = threading.Lock()
+_indexes: dict[int, PromptIndex] = {}
+
+
+def get_prompt_index(chat_id: int, prompt: str) -> PromptIndex:
+    """取群设定的索引；未编译或设定文本已变化时重新编译"""
+    with _lock:
+        index = _indexes.get(chat_id)
+    if index is not None and index.source == prompt:
+        return index
+    index = PromptIndex(prompt)
+    with _lock:
+        _indexes[chat_id] = index
+    return index
+
+
+def invalidate_prompt_index(chat_id: Optional[int] = None) -> None:
+    """设定变更（/xhadd、/xhdel、set_group_settings）后丢弃索引；chat_id 为 None 时全部丢弃"""
+    with _lock:
+        if chat_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(chat_id, None)
@@ -0,0 +1,93 @@
+"""回复缓存 - 群内重复提问（问候、营业时间等）直接返回上次回复，省去一次 AI 调用"""
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from config.settings import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+
+# 时效性问题（时间、天气、新闻等）不缓存
+_TIME_SENSITIVE = re.compile(r"今天|明天|昨天|现在|几点|几号|星期|周几|天气|新闻|最新|实时|汇率|股价|比分")
+# 归一化时去掉的标点、空白与语气符号
+_STRIP = re.compile(r"[\s,，.。!！?？~～、…:：;；\"'“”‘’()（）\[\]【】]+")
+
+
+def normalize_query(text: str) -> str:
+    """归一化提问：去标点空白、转小写，使「在吗？」与「在吗」命中同一条"""
+    return _STRIP.sub("", (text or "").lower())
+
+
+def prompt_version(prompt: str) -> int:
+    """设定的版本指纹，设定一改缓存自然失效"""
+    return zlib.crc32((prompt or "").encode("utf-8"))
+
+
+def is_time_sensitive(text: str) -> bool:
+    return bool(_TIME_SENSITIVE.search(text or ""))
+
+
+class ResponseCache:
+    """带 TTL 的有界 LRU，线程安全"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[tuple, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: tuple, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
+
+def make_key(chat_id: int, model: str, prompt: str, query: str, use_web_search: bool = False) -> Optional[tuple]:
+    """生成缓存键；未开启、联网搜索、问题为空或具有时效性时返回 None（不走缓存）"""
+    if not RESPONSE_CACHE_ENABLED or use_web_search:
+        return None
+    norm = normalize_query(query)
+    if not norm or is_time_sensitive(query):
+        return None
+    return (chat_id, model, prompt_version(prompt), norm)
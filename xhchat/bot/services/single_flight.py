@@ -0,0 +1,81 @@
+"""请求合并（single-flight）- 同一问题并发到达时只调用一次 AI，其余调用方等待并共享结果"""
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("future", "finished_at", "shareable")
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.finished_at: float = 0.0
+        self.shareable: bool = True
+
+
+class SingleFlight:
+    """
+    线程安全：处理器线程（asyncio.to_thread）与暖群调度线程可共用。
+    进行中的调用直接共享；调用结束后 window 秒内到达的相同请求也复用该结果，覆盖「几乎同时」的情况
+    shareable：由发起调用的一方判断结果能否给别人用（如回复里带了发起人的名字），不能则等待方各自重新调用
+    """
+
+    def __init__(self, window_seconds: float = 0.0):
+        self.window_seconds = window_seconds
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.unshared = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, shareable: Optional[Callable[[Any], bool]] = None, **kwargs):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+        if not leader:
+            result = call.future.result()
+            if call.shareable:
+                return result
+            with self._lock:
+                self.shared -= 1
+                self.unshared += 1
+            return fn(*args, **kwargs)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.future.set_exception(e)
+            # 失败不复用，下一个请求重新调用
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            raise
+        call.shareable = shareable(result) if shareable else True
+        call.future.set_result(result)
+        with self._lock:
+            call.finished_at = time.monotonic()
+            if self.window_seconds <= 0 and self._calls.get(key) is call:
+                del self._calls[key]
+        return result
+
+    def _expire(self, now: float) -> None:
+        """清理复用窗口已过的调用（需持有锁）"""
+        expired = [
+            k for k, c in self._calls.items()
+            if c.finished_at and now - c.finished_at >= self.window_seconds
+        ]
+        for k in expired:
+            del self._calls[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "shared": self.shared, "unshared": self.unshared, "active": len(self._calls)}
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""上下文 token 预算：本地估算 token 数，按预算裁剪设定与历史消息"""
+import re
+
+# 中日韩字符按 1 token/字估算（Kimi、GPT 实际约 0.6~1.5），其余按 4 字符/token
+_CJK_RE = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """估算文本 token 数（偏保守，宁多勿少）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """估算消息列表 token 数"""
+    return sum(count_tokens(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_lines(text: str, max_tokens: int) -> str:
+    """按行截断文本到 max_tokens 以内，保留前面的行"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for line in text.split("\n"):
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def fit_messages(messages: list[dict], budget: int) -> list[dict]:
+    """
+    裁剪消息列表到 budget 以内：system 消息（摘要）与最后一条消息始终保留，
+    其余从最早的开始丢弃
+    """
+    if count_message_tokens(messages) <= budget:
+        return messages
+    pinned = [m for m in messages[:-1] if m.get("role") == "system"]
+    rest = [m for m in messages[:-1] if m.get("role") != "system"]
+    last = messages[-1:]
+    used = count_message_tokens(pinned) + count_message_tokens(last)
+    kept = []
+    for m in reversed(rest):
+        cost = count_message_tokens([m])
+        if used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+    return pinned + kept + last
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
-"""暖群调度器 + 延迟删除：独立线程，统一处理暖群与 /xhset 自动删除"""
+"""
+暖群调度 + 延迟删除：作为 JobQueue 任务运行在主 Application 的事件循环上，共用同一个 Bot
+读写 SQLite、handoff 文件等阻塞调用一律 asyncio.to_thread，不占用事件循环
+"""
 import asyncio
+import heapq
 import logging
 import random
 import threading
@@ -13,8 +17,8 @@ except ImportError:
     ZoneInfo = None
 
 from telegram import Bot
+from telegram.ext import Application, ContextTypes, Job, JobQueue
 from config.settings import (
-    TELEGRAM_BOT_TOKEN,
     ALLOWED_CHAT_IDS,
     WARM_ENABLED,
     WARM_IDLE_MINUTES,
@@ -24,23 +28,40 @@ from config.settings import (
     WARM_SILENT_END,
     RANDOM_WATER_MIN_MINUTES,
     RANDOM_WATER_MAX_MINUTES,
+    MAX_CONTEXT_MESSAGES,
+    MESSAGE_RETENTION_ROUNDS,
+    MESSAGE_ARCHIVE_ENABLED,
+    DB_MAINTENANCE_INTERVAL_MINUTES,
+    DB_REINDEX_EVERY,
 )
 from bot.services.sticker_service import get_sticker_ids
-from bot.services.context_manager import build_messages_for_ai, save_exchange
-from bot.services.ai_service import chat_completion
-from bot.models.database import get_group_activity, update_warm_at
+from bot.models.database import (
+    get_group_activity,
+    update_warm_at,
+    prune_messages,
+    vacuum_incremental,
+    reindex_messages,
+)
 from bot.handlers.warm import WARM_MESSAGES
 
 logger = logging.getLogger(__name__)
 
 _startup_warm_done = False
-_stop_event = threading.Event()
-# 延迟删除队列：(run_at, chat_id, message_id)，线程安全
-_delete_queue: list[tuple[float, int, int]] = []
+_job_queue: JobQueue | None = None
+# 延迟删除最小堆：(run_at, chat_id, message_id)，只挂一个 JobQueue 定时器，指向堆顶时间
+_delete_heap: list[tuple[float, int, int]] = []
 _delete_lock = threading.Lock()
-# 循环检查最大睡眠（秒），两个下次任务都较远时减少唤醒
-LOOP_MAX_SLEEP_SEC = 300
+_drain_job: Job | None = None
+_drain_at = float("inf")
+# 到期时间相差不超过该秒数的删除合并为一批
+DELETE_BATCH_WINDOW_SEC = 1.0
+# deleteMessages 单次最多 100 条
+DELETE_BULK_MAX = 100
 HANDOFF_CHECK_INTERVAL_SEC = 2
+# 首次数据库维护在启动后延迟的秒数，避开启动时的读写高峰
+DB_MAINTENANCE_FIRST_DELAY = 300
+# 数据库维护次数，每 DB_REINDEX_EVERY 次重建一次索引
+_maintenance_runs = 0
 
 
 def _beijing_hour() -> int:
@@ -67,11 +88,11 @@ async def _delete_message_async(bot: Bot, chat_id: int, message_id: int) -> None
 
 async def _do_random_water_async(bot: Bot) -> None:
     """随机水群：仅发送贴纸，向每个允许的群发送"""
-    sticker_ids = get_sticker_ids()
-    if not sticker_ids:
-        return
     if _in_silent_period():
         return
+    sticker_ids = await asyncio.to_thread(get_sticker_ids)
+    if not sticker_ids:
+        return
     sticker_id = random.choice(sticker_ids)
     for chat_id in ALLOWED_CHAT_IDS:
         try:
@@ -96,7 +117,7 @@ async def _do_warm_tick_async(bot: Bot) -> None:
     # 首次运行：启动暖群，向每个群发送
     if not _startup_warm_done:
         _startup_warm_done = True
-        sticker_ids = get_sticker_ids()
+        sticker_ids = await asyncio.to_thread(get_sticker_ids)
         for chat_id in ALLOWED_CHAT_IDS:
             try:
                 use_sticker = sticker_ids and random.random() < 0.5
@@ -126,7 +147,7 @@ async def _do_warm_tick_async(bot: Bot) -> None:
 
     for chat_id in ALLOWED_CHAT_IDS:
         try:
-            activity = get_group_activity(chat_id)
+            activity = await asyncio.to_thread(get_group_activity, chat_id)
         except Exception as e:
             logger.warning("暖群: chat_id=%s 读取活动记录失败 %s", chat_id, e)
             continue
@@ -142,7 +163,7 @@ async def _do_warm_tick_async(bot: Bot) -> None:
         cooldown_ok = last_warm_dt is None or (now - last_warm_dt) >= timedelta(minutes=WARM_COOLDOWN_MINUTES)
         if idle_ok and cooldown_ok:
             try:
-                sticker_ids = get_sticker_ids()
+                sticker_ids = await asyncio.to_thread(get_sticker_ids)
                 use_sticker = sticker_ids and random.random() < 0.5
                 if use_sticker:
                     sticker_id = random.choice(sticker_ids)
@@ -150,47 +171,18 @@ async def _do_warm_tick_async(bot: Bot) -> None:
                 else:
                     msg = random.choice(WARM_MESSAGES)
                     await bot.send_message(chat_id=chat_id, text=msg)
-                update_warm_at(chat_id)
+                await asyncio.to_thread(update_warm_at, chat_id)
                 logger.info("暖群: chat_id=%s 已发送%s", chat_id, "贴纸" if use_sticker else "文案")
             except Exception as e:
                 logger.warning("暖群 chat_id=%s 发送失败: %s", chat_id, e)
 
 
-async def _process_handoff_async(bot: Bot) -> None:
-    """霜刃转交：轮询 handoff 文件，代为回复"""
-    try:
-        from handoff import take_handoff
-        req = take_handoff()
-        if not req:
-            return
-        chat_id = req["chat_id"]
-        reply_to_id = req["reply_to_message_id"]
-        question = req["question"]
-        if chat_id not in ALLOWED_CHAT_IDS:
-            logger.warning("handoff: 跳过非允许群 chat_id=%s", chat_id)
-            return
-        from bot.services.text_utils import replace_emoji_digits
-        messages = build_messages_for_ai(chat_id, 0, question)
-        reply = chat_completion(messages, chat_id=chat_id, user_full_name="用户", user_message=question)
-        reply = replace_emoji_digits(reply or "")
-        save_exchange(chat_id, 0, question, reply)
-        await bot.send_message(
-            chat_id=chat_id,
-            text=reply,
-            reply_to_message_id=reply_to_id,
-        )
-        logger.info("handoff: 已代为回复 chat_id=%s reply_to=%s", chat_id, reply_to_id)
-    except ImportError:
-        pass
-    except Exception as e:
-        logger.warning("handoff 处理失败: %s", e)
-
-
 async def _process_delete_handoff_async(bot: Bot) -> None:
     """方案 C：轮询 handoff_delete，执行删除任务；失败时写入 handoff_delete_frost 由霜刃兜底"""
     try:
         from handoff import take_delete_handoff, put_delete_handoff_frost
-        req = take_delete_handoff()
+        # 整文件读写且与写入线程共用锁，放到线程中执行
+        req = await asyncio.to_thread(take_delete_handoff)
         if not req:
             return
         chat_id = req["chat_id"]
@@ -200,89 +192,138 @@ async def _process_delete_handoff_async(bot: Bot) -> None:
             logger.info("handoff_delete: 已删除 chat_id=%s msg_id=%s", chat_id, msg_id)
         except Exception as e:
             logger.warning("handoff_delete: 删除失败 chat_id=%s msg_id=%s: %s", chat_id, msg_id, e)
-            put_delete_handoff_frost(chat_id, msg_id)
+            await asyncio.to_thread(put_delete_handoff_frost, chat_id, msg_id)
     except ImportError:
         pass
     except Exception as e:
         logger.warning("handoff_delete 处理失败: %s", e)
 
 
-def run_warm_scheduler() -> None:
-    """在独立线程中运行：延迟删除 + 暖群（启动/空闲/随机水群）"""
-    if not TELEGRAM_BOT_TOKEN:
+def _run_db_maintenance() -> None:
+    """数据库维护：按保留窗口裁剪对话记录 → 增量 VACUUM → 定期重建索引"""
+    global _maintenance_runs
+    _maintenance_runs += 1
+    try:
+        keep_rounds = max(MESSAGE_RETENTION_ROUNDS, MAX_CONTEXT_MESSAGES)
+        removed = prune_messages(keep_rounds, archive=MESSAGE_ARCHIVE_ENABLED)
+        freed = vacuum_incremental()
+        reindexed = DB_REINDEX_EVERY > 0 and _maintenance_runs % DB_REINDEX_EVERY == 0
+        if reindexed:
+            reindex_messages()
+        if removed or freed or reindexed:
+            logger.info(
+                "数据库维护: 移除 %d 条对话%s，归还 %d 页%s",
+                removed, "（已归档）" if MESSAGE_ARCHIVE_ENABLED else "", freed, "，已重建索引" if reindexed else "",
+            )
+    except Exception as e:
+        logger.warning("数据库维护失败: %s", e)
+
+
+async def _delete_batch_async(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
+    """同一群的多条消息走 deleteMessages 批量删除，单条走 deleteMessage"""
+    if len(message_ids) == 1:
+        await _delete_message_async(bot, chat_id, message_ids[0])
         return
+    for i in range(0, len(message_ids), DELETE_BULK_MAX):
+        await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[i : i + DELETE_BULK_MAX])
 
-    def _worker():
-        time.sleep(60)  # 等待主 bot 完全启动
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
-            idle_interval_sec = WARM_CHECK_INTERVAL * 60 if WARM_ENABLED else 3600
-            next_random_water = time.time() + random.randint(
-                RANDOM_WATER_MIN_MINUTES * 60, RANDOM_WATER_MAX_MINUTES * 60
-            ) if WARM_ENABLED else float("inf")
-            next_idle = time.time() if WARM_ENABLED else float("inf")
-            next_handoff = time.time()
-            while not _stop_event.is_set():
-                now = time.time()
-                # 0. 霜刃转交 + 删除 handoff（每 2 秒检查）
-                if now >= next_handoff:
-                    try:
-                        loop.run_until_complete(_process_handoff_async(bot))
-                    except Exception:
-                        pass
-                    try:
-                        loop.run_until_complete(_process_delete_handoff_async(bot))
-                    except Exception:
-                        pass
-                    next_handoff = now + HANDOFF_CHECK_INTERVAL_SEC
-                # 1. 处理延迟删除
-                with _delete_lock:
-                    due = [(t, c, m) for t, c, m in _delete_queue if t <= now]
-                    _delete_queue[:] = [(t, c, m) for t, c, m in _delete_queue if t > now]
-                    next_delete = min((t for t, _, _ in _delete_queue), default=float("inf"))
-                for _, chat_id, msg_id in due:
-                    try:
-                        loop.run_until_complete(_delete_message_async(bot, chat_id, msg_id))
-                    except Exception:
-                        pass
-                # 2. 暖群（仅 WARM_ENABLED 时）
-                if WARM_ENABLED:
-                    if now >= next_random_water:
-                        loop.run_until_complete(_do_random_water_async(bot))
-                        next_random_water = now + random.randint(
-                            RANDOM_WATER_MIN_MINUTES * 60, RANDOM_WATER_MAX_MINUTES * 60
-                        )
-                    if now >= next_idle:
-                        loop.run_until_complete(_do_warm_tick_async(bot))
-                        next_idle = now + idle_interval_sec
-                # 3. 下次唤醒时间
-                candidates = [next_random_water - now, next_idle - now, next_handoff - now]
-                if next_delete != float("inf"):
-                    candidates.append(next_delete - now)
-                sleep_sec = min((c for c in candidates if 0 < c < float("inf")), default=LOOP_MAX_SLEEP_SEC)
-                sleep_sec = min(max(1, int(sleep_sec)), LOOP_MAX_SLEEP_SEC)
-                _stop_event.wait(sleep_sec)
-        finally:
-            loop.close()
-
-    t = threading.Thread(target=_worker, daemon=True, name="warm_scheduler")
-    t.start()
+
+def _arm_drain(run_at: float) -> None:
+    """让唯一的删除定时器指向最早到期时间；已有更早的定时器则不动"""
+    global _drain_job, _drain_at
+    if _job_queue is None:
+        return
+    if _drain_job is not None and _drain_at <= run_at + DELETE_BATCH_WINDOW_SEC:
+        return
+    if _drain_job is not None:
+        _drain_job.schedule_removal()
+    _drain_at = run_at
+    _drain_job = _job_queue.run_once(
+        _job_drain_deletes, when=max(0.0, run_at - time.time()), name="delayed_delete"
+    )
+
+
+async def _job_drain_deletes(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """取出所有到期（含批量窗口内）的删除，按群分组并发执行，再把定时器指向新的堆顶"""
+    global _drain_job, _drain_at
+    _drain_job, _drain_at = None, float("inf")
+    horizon = time.time() + DELETE_BATCH_WINDOW_SEC
+    by_chat: dict[int, list[int]] = {}
+    with _delete_lock:
+        while _delete_heap and _delete_heap[0][0] <= horizon:
+            _, chat_id, message_id = heapq.heappop(_delete_heap)
+            by_chat.setdefault(chat_id, []).append(message_id)
+        next_at = _delete_heap[0][0] if _delete_heap else None
+    if next_at is not None:
+        _arm_drain(next_at)
+    if by_chat:
+        await asyncio.gather(
+            *(_delete_batch_async(context.bot, c, ids) for c, ids in by_chat.items()),
+            return_exceptions=True,
+        )
+
+
+async def _job_delete_handoff(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await _process_delete_handoff_async(context.bot)
+
+
+async def _job_warm_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await _do_warm_tick_async(context.bot)
+
+
+async def _job_random_water(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """随机水群后按随机间隔安排下一次"""
+    try:
+        await _do_random_water_async(context.bot)
+    finally:
+        context.job_queue.run_once(
+            _job_random_water,
+            when=random.randint(RANDOM_WATER_MIN_MINUTES * 60, RANDOM_WATER_MAX_MINUTES * 60),
+            name="random_water",
+        )
+
+
+async def _job_db_maintenance(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await asyncio.to_thread(_run_db_maintenance)
+
+
+def setup_warm_jobs(application: Application) -> None:
+    """在 Application 就绪后（post_init）注册：延迟删除、删除 handoff、暖群、随机水群、数据库维护"""
+    global _job_queue
+    jq = application.job_queue
+    if jq is None:
+        logger.warning("JobQueue 不可用（需安装 python-telegram-bot[job-queue]），调度任务未启动")
+        return
+    _job_queue = jq
+    with _delete_lock:
+        first_at = _delete_heap[0][0] if _delete_heap else None
+    if first_at is not None:
+        _arm_drain(first_at)
+
+    jq.run_repeating(_job_delete_handoff, interval=HANDOFF_CHECK_INTERVAL_SEC, first=0, name="delete_handoff")
+    if DB_MAINTENANCE_INTERVAL_MINUTES > 0:
+        jq.run_repeating(
+            _job_db_maintenance, interval=DB_MAINTENANCE_INTERVAL_MINUTES * 60, first=DB_MAINTENANCE_FIRST_DELAY,
+            name="db_maintenance",
+        )
     if WARM_ENABLED:
+        jq.run_repeating(_job_warm_tick, interval=WARM_CHECK_INTERVAL * 60, first=0, name="warm_tick")
+        jq.run_once(
+            _job_random_water,
+            when=random.randint(RANDOM_WATER_MIN_MINUTES * 60, RANDOM_WATER_MAX_MINUTES * 60),
+            name="random_water",
+        )
         logger.info(
-            "调度器已启动（延迟删除 + 空闲检查每 %s 分钟，随机水群 %d-%d 分钟）",
+            "调度任务已注册（延迟删除 + 空闲检查每 %s 分钟，随机水群 %d-%d 分钟）",
             WARM_CHECK_INTERVAL, RANDOM_WATER_MIN_MINUTES, RANDOM_WATER_MAX_MINUTES,
         )
     else:
-        logger.info("调度器已启动（仅延迟删除）")
-
-
-def stop_warm_scheduler() -> None:
-    _stop_event.set()
+        logger.info("调度任务已注册（仅延迟删除）")
 
 
 def schedule_delete_message(chat_id: int, message_id: int, delay_sec: float = 3) -> None:
-    """安排延迟删除消息（供 /xhset 等调用，合并到调度线程）"""
+    """安排延迟删除消息（供 /xhset 等调用）：O(log n) 入堆，到期后批量删除"""
+    run_at = time.time() + delay_sec
     with _delete_lock:
-        _delete_queue.append((time.time() + delay_sec, chat_id, message_id))
+        heapq.heappush(_delete_heap, (run_at, chat_id, message_id))
+    _arm_drain(run_at)
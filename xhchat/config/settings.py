@@ -59,6 +59,53 @@ CUSTOM_SYSTEM_PROMPT = os.getenv("CUSTOM_SYSTEM_PROMPT", "")
 # 对话（保留轮数，每轮=用户+助理各1条）
 MAX_CONTEXT_MESSAGES = int(os.getenv("MAX_CONTEXT_MESSAGES", "5"))
 
+# 上下文 token 预算（输入部分，本地估算）。各预置方案可在 PRESET_MODELS 中单独配置 context_budget，未配置时用此值
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# 滚动摘要：超出上下文窗口的较早对话压缩为摘要，随请求发送。开启后约每 SUMMARY_REFRESH_MESSAGES/2 轮对话
+# 每个用户额外调用一次 AI（后台优先级），默认关闭
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() in ("true", "1", "yes")
+# 窗口外累计未摘要的消息达到 N 条时才刷新摘要（避免每轮都调用一次 AI）
+SUMMARY_REFRESH_MESSAGES = int(os.getenv("SUMMARY_REFRESH_MESSAGES", "10"))
+# 摘要最大字数
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "300"))
+# 摘要调用失败后多少秒内不再为同一用户重试
+SUMMARY_RETRY_SECONDS = int(os.getenv("SUMMARY_RETRY_SECONDS", "600"))
+
+# 对话记录保留：每个 (chat_id, user_id) 仅保留最近 N 轮，超出部分删除或归档（不小于 MAX_CONTEXT_MESSAGES）
+MESSAGE_RETENTION_ROUNDS = int(os.getenv("MESSAGE_RETENTION_ROUNDS", "50"))
+# 超出保留窗口的消息压缩归档到 messages_archive 表；false 则直接删除
+MESSAGE_ARCHIVE_ENABLED = os.getenv("MESSAGE_ARCHIVE_ENABLED", "false").lower() in ("true", "1", "yes")
+# 数据库维护间隔（分钟）：裁剪对话记录 + 增量 VACUUM
+DB_MAINTENANCE_INTERVAL_MINUTES = int(os.getenv("DB_MAINTENANCE_INTERVAL_MINUTES", "60"))
+# 每 N 次维护重建一次索引（REINDEX + PRAGMA optimize）
+DB_REINDEX_EVERY = int(os.getenv("DB_REINDEX_EVERY", "24"))
+
+# 回复缓存：相同提问直接返回上次回复（默认关闭；时效性问题不缓存）
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("true", "1", "yes")
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+
+# 请求合并：同群相同提问并发到达时只调用一次 AI；调用结束后 N 秒内到达的相同提问也复用结果
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("true", "1", "yes")
+SINGLE_FLIGHT_WINDOW_SECONDS = float(os.getenv("SINGLE_FLIGHT_WINDOW_SECONDS", "3"))
+
+# 准入控制：全局同时进行的 AI 调用数、排队上限、单次请求截止时间（含排队）
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "4"))
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", "20"))
+AI_REQUEST_DEADLINE_SECONDS = float(os.getenv("AI_REQUEST_DEADLINE_SECONDS", "60"))
+# 熔断：主模型失败率或慢调用率超阈值时，改用备用预置方案（如 ollama-qwen），留空则不切换
+AI_FALLBACK_PRESET = os.getenv("AI_FALLBACK_PRESET", "").strip()
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_SAMPLES = int(os.getenv("BREAKER_MIN_SAMPLES", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "20"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "60"))
+
+# 霜刃转交：并发回答的协程数、轮询 handoff 文件的间隔（秒）
+HANDOFF_CONCURRENCY = int(os.getenv("HANDOFF_CONCURRENCY", "4"))
+HANDOFF_POLL_INTERVAL = float(os.getenv("HANDOFF_POLL_INTERVAL", "2"))
+
 # 限流
 RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "5"))
 